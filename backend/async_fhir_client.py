@@ -0,0 +1,268 @@
+import asyncio
+import hashlib
+import weakref
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+from urllib.parse import urlencode, urlsplit
+
+import httpx
+
+import deadline
+from env_config import FHIR_SEARCH_CONFIG, FHIR_SINGLEFLIGHT_CONFIG, HTTP_POOL_CONFIG
+from fhir_client import _eob_data, _next_link, _same_origin
+from hedging import hedger
+from http2_transport import http2_settings
+from json_codec import loads
+from resilience import CircuitOpenError, acall_with_retries
+from singleflight import async_reads
+
+# httpx.AsyncClient is bound to the event loop it was first used on, so the
+# shared pool is kept per (loop, origin) and dropped together with its loop.
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, httpx.AsyncClient]]" = weakref.WeakKeyDictionary()
+
+# Search helpers available to gather_patient_resources, by resource type
+PATIENT_SEARCHES = {
+    'ExplanationOfBenefit': 'get_explanation_of_benefits',
+    'Claim': 'get_claims',
+    'Coverage': 'get_coverage',
+    'Observation': 'get_observations',
+    'Procedure': 'get_procedures',
+    'MedicationRequest': 'get_medication_requests',
+    'Condition': 'get_conditions'
+}
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+def get_async_client(url: str) -> httpx.AsyncClient:
+    """Return the pooled AsyncClient for the origin of `url` on the running loop"""
+    loop = asyncio.get_running_loop()
+    per_loop = _clients.setdefault(loop, {})
+    origin = _origin(url)
+    client = per_loop.get(origin)
+    if client is None or client.is_closed:
+        config = HTTP_POOL_CONFIG
+        client = httpx.AsyncClient(
+            # HTTP/2 multiplexing when enabled and negotiated (see http2_transport)
+            **http2_settings(origin),
+            limits=httpx.Limits(
+                max_connections=config['pool_maxsize'],
+                max_keepalive_connections=config['pool_maxsize'],
+                keepalive_expiry=config['keepalive_idle_timeout']
+            ),
+            # Shared across users: never replay one user's cookies for another
+            cookies=httpx.Cookies(CookieJar(DefaultCookiePolicy(allowed_domains=[]))),
+            follow_redirects=False
+        )
+        per_loop[origin] = client
+    return client
+
+async def close_async_clients():
+    """Close the pooled clients of the running loop (worker shutdown)"""
+    per_loop = _clients.pop(asyncio.get_running_loop(), {})
+    for client in per_loop.values():
+        await client.aclose()
+
+class AsyncEpicFHIRClient:
+    """asyncio counterpart of EpicFHIRClient with the same method surface"""
+
+    def __init__(self, base_url: str, access_token: str):
+        self.base_url = base_url
+        self.token_id = hashlib.sha256(access_token.encode()).hexdigest()
+        self.headers = {
+            'Authorization': f'Bearer {access_token}',
+            'Accept': 'application/fhir+json',
+            'Content-Type': 'application/fhir+json'
+        }
+
+    def _resource_type(self, url: str) -> str:
+        """Resource type addressed by a URL under base_url"""
+        path = urlsplit(url).path
+        base_path = urlsplit(self.base_url).path.rstrip('/')
+        if path.startswith(base_path):
+            path = path[len(base_path):]
+        return path.strip('/').split('/')[0]
+
+    async def _make_request(self, url: str, params: Optional[Dict] = None) -> Dict:
+        """Make HTTP request to FHIR endpoint (identical in-flight reads are coalesced)"""
+        query = urlencode(sorted((params or {}).items()), doseq=True)
+        try:
+            if not FHIR_SINGLEFLIGHT_CONFIG['enabled']:
+                return await self._fetch(url, params)
+            return await async_reads.do((self.token_id, url, query), lambda: self._fetch(url, params),
+                                        timeout=deadline.remaining())
+        except TimeoutError:
+            deadline.note_exceeded()
+            return {'error': f'request deadline exceeded for {url}'}
+
+    async def _fetch(self, url: str, params: Optional[Dict] = None) -> Dict:
+        """Upstream half of _make_request; raises DeadlineExceeded when the deadline cuts it short"""
+        client = get_async_client(url)
+
+        async def send(timeout):
+            connect, read = timeout
+            return await client.get(url, headers=self.headers, params=params,
+                                    timeout=httpx.Timeout(read, connect=connect))
+
+        host, resource_type = urlsplit(url).netloc, self._resource_type(url)
+        try:
+            response = await acall_with_retries(
+                host, resource_type, lambda timeout: hedger.acall(host, resource_type, send, timeout),
+                transient_errors=(httpx.TransportError,)
+            )
+            response.raise_for_status()
+            return loads(response.content)
+        except (httpx.HTTPError, ValueError, CircuitOpenError) as e:
+            # Callers see the failure in the result (and a search's errors sink)
+            return {'error': str(e)}
+
+    async def get_patient(self, patient_id: str) -> Dict:
+        """Get patient demographics"""
+        url = f"{self.base_url}/Patient/{patient_id}"
+        return await self._make_request(url)
+
+    async def iter_search(self, resource_type: str, params: Optional[Dict] = None,
+                          count: Optional[int] = None, max_pages: Optional[int] = None,
+                          max_resources: Optional[int] = None,
+                          prefetch: Optional[bool] = None,
+                          errors: Optional[List[str]] = None) -> AsyncIterator[Dict]:
+        """Async version of EpicFHIRClient.iter_search (`errors` is filled the same way)"""
+        config = FHIR_SEARCH_CONFIG
+        count = config['page_size'] if count is None else count
+        max_pages = config['max_pages'] if max_pages is None else max_pages
+        max_resources = config['max_resources'] if max_resources is None else max_resources
+        prefetch = config['prefetch'] if prefetch is None else prefetch
+
+        params = dict(params or {})
+        if count:
+            params.setdefault('_count', count)
+
+        page = await self._make_request(f"{self.base_url}/{resource_type}", params)
+        pages_read = 0
+        yielded = 0
+        pending: Optional[asyncio.Task] = None
+        errors = [] if errors is None else errors
+
+        try:
+            while True:
+                if 'error' in page:
+                    errors.append(page['error'])
+                    return
+                pages_read += 1
+
+                next_url = _next_link(page)
+                if next_url and not _same_origin(next_url, self.base_url):
+                    print(f"⚠️ Ignoring cross-origin next link for {resource_type}: {next_url}")
+                    next_url = None
+                if next_url and max_pages and pages_read >= max_pages:
+                    print(f"⚠️ {resource_type} search truncated at max_pages={max_pages}")
+                    errors.append(f"truncated at max_pages={max_pages}")
+                    next_url = None
+                if next_url and prefetch:
+                    pending = asyncio.ensure_future(self._make_request(next_url))
+
+                for entry in page.get('entry', []):
+                    if 'resource' not in entry:
+                        continue
+                    if max_resources and yielded >= max_resources:
+                        print(f"⚠️ {resource_type} search truncated at max_resources={max_resources}")
+                        errors.append(f"truncated at max_resources={max_resources}")
+                        return
+                    yield entry['resource']
+                    yielded += 1
+
+                if not next_url:
+                    return
+
+                page = None
+                if pending is not None:
+                    page, pending = await pending, None
+                else:
+                    page = await self._make_request(next_url)
+        finally:
+            if pending is not None:
+                pending.cancel()
+
+    async def _search(self, resource_type: str, params: Dict, errors: Optional[List[str]] = None) -> List[Dict]:
+        return [resource async for resource in self.iter_search(resource_type, params, errors=errors)]
+
+    async def get_explanation_of_benefits(self, patient_id: str, errors: Optional[List[str]] = None) -> List[Dict]:
+        """Get EOB resources for patient (all pages)"""
+        return await self._search('ExplanationOfBenefit', {'patient': patient_id}, errors)
+
+    async def get_claims(self, patient_id: str, errors: Optional[List[str]] = None) -> List[Dict]:
+        """Get Claim resources for patient (fallback for EOB)"""
+        return await self._search('Claim', {'patient': patient_id}, errors)
+
+    async def get_eob_data(self, patient_id: str) -> Dict:
+        """Get EOB data with fallback strategy (shaped like EpicFHIRClient.get_eob_data, without references)"""
+        eob_errors: List[str] = []
+        claim_errors: List[str] = []
+        eobs = await self.get_explanation_of_benefits(patient_id, eob_errors)
+        claims: List[Dict] = []
+        if not eobs:
+            claims = await self.get_claims(patient_id, claim_errors)
+        return _eob_data(eobs, claims, eob_errors, claim_errors, quiet=True)
+
+    async def get_coverage(self, patient_id: str) -> List[Dict]:
+        """Get coverage information"""
+        return await self._search('Coverage', {'patient': patient_id})
+
+    async def get_observations(self, patient_id: str) -> List[Dict]:
+        """Get observations (labs, vitals, etc.)"""
+        return await self._search('Observation', {'patient': patient_id})
+
+    async def get_procedures(self, patient_id: str) -> List[Dict]:
+        """Get procedures"""
+        return await self._search('Procedure', {'patient': patient_id})
+
+    async def get_medication_requests(self, patient_id: str) -> List[Dict]:
+        """Get medication requests"""
+        return await self._search('MedicationRequest', {'patient': patient_id})
+
+    async def get_conditions(self, patient_id: str) -> List[Dict]:
+        """Get conditions (diagnoses)"""
+        return await self._search('Condition', {'patient': patient_id})
+
+    async def get_organization(self, org_id: str) -> Dict:
+        """Get organization details"""
+        return await self._make_request(f"{self.base_url}/Organization/{org_id}")
+
+    async def get_practitioner(self, practitioner_id: str) -> Dict:
+        """Get practitioner details"""
+        return await self._make_request(f"{self.base_url}/Practitioner/{practitioner_id}")
+
+    async def search_patients(self, search_params: Dict) -> List[Dict]:
+        """Search for patients"""
+        return await self._search('Patient', search_params)
+
+    async def gather_patient_resources(self, patient_id: str,
+                                       resource_types: Iterable[str] = ('Patient', 'ExplanationOfBenefit', 'Coverage'),
+                                       concurrency: int = 4) -> Dict[str, object]:
+        """Fetch several resource types for one patient concurrently
+
+        At most `concurrency` upstream calls are in flight at once. Returns
+        a dict keyed by resource type; 'Patient' maps to the Patient resource
+        and every other type to its list of search results. A failed fetch
+        yields {'error': ...} for that type without cancelling the others.
+        """
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def fetch(resource_type: str):
+            async with semaphore:
+                if resource_type == 'Patient':
+                    return await self.get_patient(patient_id)
+                if resource_type not in PATIENT_SEARCHES:
+                    return {'error': f'Unsupported resource type: {resource_type}'}
+                return await getattr(self, PATIENT_SEARCHES[resource_type])(patient_id)
+
+        resource_types = list(dict.fromkeys(resource_types))
+        results = await asyncio.gather(*(fetch(rt) for rt in resource_types), return_exceptions=True)
+
+        gathered = {}
+        for resource_type, result in zip(resource_types, results):
+            if isinstance(result, Exception):
+                result = {'error': str(result)}
+            gathered[resource_type] = result
+        return gathered
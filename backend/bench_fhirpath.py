@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Benchmark compiled FHIRPath against hand-written extraction.
+
+The hand-written side is the nested-`if` extract_* style transformers.py
+used before its mappings became FHIRPath tables. Each expression is timed
+standalone (fhirpath.select over the EOBs), and so is the whole expense
+mapping (the compiled EOB_EXPENSE_FIELDS vs. one call per helper).
+
+    python bench_fhirpath.py [--entries 2000] [--repeat 20]
+"""
+
+import argparse
+import time
+from typing import List
+
+import fhirpath
+from categorization import categorizer
+from bench_json_codec import make_eob
+from transformers import EXPENSE_EXTRACTORS
+
+
+def service_date(eob):
+    if 'billablePeriod' in eob and 'start' in eob['billablePeriod']:
+        return eob['billablePeriod']['start']
+    if 'item' in eob and len(eob['item']) > 0:
+        item = eob['item'][0]
+        if 'servicedDate' in item:
+            return item['servicedDate']
+    return None
+
+
+def service_description(eob):
+    if 'item' in eob and len(eob['item']) > 0:
+        item = eob['item'][0]
+        if 'productOrService' in item and 'text' in item['productOrService']:
+            return item['productOrService']['text']
+        if 'productOrService' in item and 'coding' in item['productOrService']:
+            coding = item['productOrService']['coding'][0]
+            if 'display' in coding:
+                return coding['display']
+    return None
+
+
+def patient_responsibility(eob):
+    if 'total' in eob:
+        for total in eob['total']:
+            if 'category' in total and 'coding' in total['category']:
+                coding = total['category']['coding'][0]
+                if coding.get('code') == 'patient-pay' and 'amount' in total:
+                    return total['amount']['value']
+    if 'item' in eob and len(eob['item']) > 0:
+        item = eob['item'][0]
+        if 'adjudication' in item:
+            for adj in item['adjudication']:
+                if 'category' in adj and 'coding' in adj['category']:
+                    coding = adj['category']['coding'][0]
+                    if coding.get('code') == 'patient-pay' and 'amount' in adj:
+                        return adj['amount']['value']
+    return None
+
+
+def currency(eob):
+    if 'total' in eob and len(eob['total']) > 0:
+        total = eob['total'][0]
+        if 'amount' in total and 'currency' in total['amount']:
+            return total['amount']['currency']
+    if 'item' in eob and len(eob['item']) > 0:
+        item = eob['item'][0]
+        if 'adjudication' in item and len(item['adjudication']) > 0:
+            adj = item['adjudication'][0]
+            if 'amount' in adj and 'currency' in adj['amount']:
+                return adj['amount']['currency']
+    return None
+
+
+def status(eob):
+    return {'active': 'Approved', 'cancelled': 'Cancelled', 'draft': 'Pending',
+            'entered-in-error': 'Error'}.get(eob.get('status', 'unknown'), 'Pending')
+
+
+def category(eob, description):
+    codings = None
+    if 'item' in eob and len(eob['item']) > 0:
+        item = eob['item'][0]
+        if 'productOrService' in item and 'coding' in item['productOrService']:
+            codings = item['productOrService']['coding']
+    type_code = None
+    if 'type' in eob and 'coding' in eob['type'] and len(eob['type']['coding']) > 0:
+        type_code = eob['type']['coding'][0].get('code')
+    return categorizer.categorize(codings, type_code, description)
+
+
+def provider(eob):
+    if 'provider' in eob and 'display' in eob['provider']:
+        return eob['provider']['display']
+    if 'organization' in eob and 'display' in eob['organization']:
+        return eob['organization']['display']
+    return 'Unknown Provider'
+
+
+def hand_written_expense(eob, context):
+    service = service_description(eob) or 'Unknown Service'
+    return {
+        'id': eob.get('id', 'unknown'),
+        'date': service_date(eob),
+        'provider': provider(eob),
+        'service': service,
+        'amount': float(patient_responsibility(eob) or 0.0),
+        'status': status(eob),
+        'category': category(eob, service),
+        'fhir_data': eob,
+        'patient_name': context['patient_name'],
+        'currency': currency(eob) or 'USD'
+    }
+
+
+EXPRESSIONS = [
+    ('service date', service_date, "billablePeriod.start | item.first().servicedDate"),
+    ('service', service_description,
+     "item.first().productOrService.text | item.first().productOrService.coding.first().display"),
+    ('patient pay', patient_responsibility,
+     "total.where(category.coding.first().code = 'patient-pay').amount.value"
+     " | item.first().adjudication.where(category.coding.first().code = 'patient-pay').amount.value"),
+    ('currency', currency, "total.first().amount.currency | item.first().adjudication.first().amount.currency")
+]
+
+
+def best_of(repeat: int, *fns) -> List[float]:
+    """Best time of each fn, interleaved so both sides see the same machine noise"""
+    timings = [[] for _ in fns]
+    for _ in range(repeat):
+        for fn, timing in zip(fns, timings):
+            start = time.perf_counter()
+            fn()
+            timing.append(time.perf_counter() - start)
+    return [min(timing) for timing in timings]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--entries', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    eobs = [make_eob(i) for i in range(args.entries)]
+    for i, eob in enumerate(eobs):
+        # Exercise the fallback alternatives too
+        if i % 4 == 0:
+            del eob['billablePeriod']
+            del eob['total']
+    context = {'patient_name': 'John Appleseed', 'references': None}
+    extract = EXPENSE_EXTRACTORS['ExplanationOfBenefit'].extract
+
+    rows = [(name, lambda fn=fn: [fn(eob) for eob in eobs],
+             lambda expression=expression: list(fhirpath.select(expression, eobs)))
+            for name, fn, expression in EXPRESSIONS]
+    rows.append(('whole expense', lambda: [hand_written_expense(eob, context) for eob in eobs],
+                 lambda: [extract(eob, context) for eob in eobs]))
+
+    print(f"📦 {args.entries} EOBs; microseconds per resource")
+    print(f"{'extraction':<16}{'hand-written':>14}{'fhirpath':>12}{'speedup':>10}")
+    for name, hand_written, compiled in rows:
+        assert name == 'whole expense' or hand_written() == compiled()
+        baseline, fast = (t / args.entries * 1e6 for t in best_of(args.repeat, hand_written, compiled))
+        print(f"{name:<16}{baseline:>14.2f}{fast:>12.2f}{baseline / fast:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Benchmark the JSON codecs on representative EOB traffic.
+
+Decodes a searchset Bundle of dental EOBs (the _make_request side) and
+encodes the /api/expenses payload built from it, with fhir_data echoed
+(the jsonify side). Compares Flask's default provider, stdlib json and
+orjson (when installed). Each codec also encodes the default list view
+(no fhir_data) from expense dicts and from Expense records (see records).
+
+    python bench_json_codec.py [--entries 500] [--repeat 20]
+"""
+
+import argparse
+import json
+import time
+from decimal import Decimal
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import json_codec
+from transformers import DEFAULT_EXPENSE_FIELDS, transform_eobs_to_expenses
+
+
+def make_eob(i: int) -> dict:
+    amount = 30.0 + i % 70
+    return {
+        'resourceType': 'ExplanationOfBenefit',
+        'id': f'EOB-DENTAL-{i:05d}',
+        'meta': {'versionId': '1', 'lastUpdated': '2025-08-20T10:15:00Z'},
+        'status': 'active',
+        'type': {
+            'coding': [{'system': 'http://terminology.hl7.org/CodeSystem/claim-type', 'code': 'oral', 'display': 'Dental'}],
+            'text': 'Dental'
+        },
+        'patient': {'reference': 'Patient/123', 'display': 'John Appleseed'},
+        'billablePeriod': {'start': '2025-08-19'},
+        'provider': {'reference': 'Organization/456', 'display': 'Downtown Dental Associates'},
+        'item': [{
+            'sequence': 1,
+            'productOrService': {
+                'coding': [{'system': 'http://www.ada.org/cdt', 'code': 'D1110', 'display': 'Adult Dental Prophylaxis'}],
+                'text': 'Adult Dental Prophylaxis'
+            },
+            'servicedDate': '2025-08-19',
+            'adjudication': [
+                {'category': {'coding': [{'code': 'submitted'}]}, 'amount': {'value': amount * 5, 'currency': 'USD'}},
+                {'category': {'coding': [{'code': 'benefit'}]}, 'amount': {'value': amount * 4, 'currency': 'USD'}},
+                {'category': {'coding': [{'code': 'patient-pay'}]}, 'amount': {'value': amount, 'currency': 'USD'}}
+            ]
+        }],
+        'total': [
+            {'category': {'coding': [{'code': 'submitted'}]}, 'amount': {'value': amount * 5, 'currency': 'USD'}},
+            {'category': {'coding': [{'code': 'benefit'}]}, 'amount': {'value': amount * 4, 'currency': 'USD'}},
+            {'category': {'coding': [{'code': 'patient-pay'}]}, 'amount': {'value': amount, 'currency': 'USD'}}
+        ],
+        'payment': {'amount': {'value': amount * 4, 'currency': 'USD'}}
+    }
+
+
+def make_payloads(entries: int):
+    bundle = {
+        'resourceType': 'Bundle',
+        'type': 'searchset',
+        'total': entries,
+        'link': [{'relation': 'self', 'url': 'https://fhir.example.org/api/FHIR/R4/ExplanationOfBenefit?patient=123'}],
+        'entry': [{'fullUrl': f'https://fhir.example.org/api/FHIR/R4/ExplanationOfBenefit/{i}',
+                   'resource': make_eob(i), 'search': {'mode': 'match'}} for i in range(entries)]
+    }
+    patient = {'resourceType': 'Patient', 'id': '123', 'name': [{'given': ['John'], 'family': 'Appleseed'}]}
+    eobs = [entry['resource'] for entry in bundle['entry']]
+    response = {
+        'patient': {'name': 'John Appleseed', 'id': '123'},
+        'expenses': transform_eobs_to_expenses(eobs, patient),
+        'source': 'epic_fhir_explanationofbenefit',
+        'total_amount': Decimal('1234.56')
+    }
+    list_views = [{**response, 'expenses': transform_eobs_to_expenses(eobs, patient, DEFAULT_EXPENSE_FIELDS, records=records)}
+                  for records in (False, True)]
+    return json.dumps(bundle).encode('utf-8'), response, list_views
+
+
+def best_of(repeat: int, fn) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--entries', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    raw_bundle, response, (dict_view, record_view) = make_payloads(args.entries)
+    flask_provider = DefaultJSONProvider(Flask(__name__))
+
+    codecs = [('flask-default', lambda data: json.loads(data), lambda obj: flask_provider.dumps(obj).encode('utf-8')),
+              ('json', json_codec.StdlibCodec().loads, json_codec.StdlibCodec().dumps)]
+    if json_codec.orjson is not None:
+        codecs.append(('orjson', json_codec.OrjsonCodec().loads, json_codec.OrjsonCodec().dumps))
+
+    print(f"📦 Bundle: {args.entries} EOBs, {len(raw_bundle) / 1024:.0f} KB; "
+          f"expenses payload: {len(json_codec.dumps(response)) / 1024:.0f} KB; active codec: {json_codec.codec.name}")
+    print(f"{'codec':<15}{'decode ms':>12}{'encode ms':>12}{'total ms':>12}{'list dicts':>12}{'list records':>14}")
+    for name, loads, dumps in codecs:
+        decode = best_of(args.repeat, lambda: loads(raw_bundle)) * 1000
+        encode = best_of(args.repeat, lambda: dumps(response)) * 1000
+        dicts = best_of(args.repeat, lambda: dumps(dict_view)) * 1000
+        records = '' if name == 'flask-default' else f"{best_of(args.repeat, lambda: dumps(record_view)) * 1000:>14.2f}"
+        print(f"{name:<15}{decode:>12.2f}{encode:>12.2f}{decode + encode:>12.2f}{dicts:>12.2f}{records}")
+
+
+if __name__ == '__main__':
+    main()
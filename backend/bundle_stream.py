@@ -0,0 +1,204 @@
+"""
+Incremental parsing of FHIR searchset Bundles.
+
+A BundleStream reads a Bundle's JSON text chunk by chunk and hands out its
+`entry` elements one at a time, so at most one entry (plus one network chunk)
+is held in memory instead of the whole Bundle tree. Top-level members other
+than `entry` (resourceType, type, total, link, ...) are collected in `fields`
+as the parser passes them.
+
+The object answers the handful of dict-style calls EpicFHIRClient.iter_bundle
+makes on a page ('error' in page, page.get('link'), page.get('entry')), so a
+stream can stand in for a decoded page.
+"""
+
+import codecs
+import re
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from json_codec import loads
+
+# Characters that change nesting or string state outside / inside a string
+_STRUCTURAL = re.compile(r'["{}\[\]]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+_SCALAR_END = re.compile(r'[\s,\]}]')
+_WHITESPACE = re.compile(r'\s*')
+
+
+class BundleStream:
+    """Lazily parsed Bundle over an iterable of byte chunks"""
+
+    def __init__(self, chunks: Iterable[bytes], close: Optional[Callable[[], None]] = None,
+                 transport_errors: Tuple[type, ...] = (), params: Optional[Dict] = None):
+        self._chunks = iter(chunks)
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self._close = close
+        self._transport_errors = transport_errors
+        self._events = self._parse()
+        self._in_entries = False
+        self._done = False
+        self.fields: Dict = {}
+        self.error: Optional[str] = None
+        self.entries_read = 0
+        # Search parameters the page was requested with, for the caller
+        self.params: Dict = params or {}
+
+    # -- dict-style access used by iter_bundle ---------------------------------
+
+    def __contains__(self, key: str) -> bool:
+        if key == 'error':
+            return self.error is not None
+        return self.get(key) is not None
+
+    def get(self, key: str, default=None):
+        """Top-level member `key`; 'entry' returns the lazy entry iterator
+
+        Members that follow `entry` in the document are only known once the
+        entries have been consumed.
+        """
+        if key == 'entry':
+            return self.entries()
+        if key == 'error':
+            return self.error if self.error is not None else default
+        while key not in self.fields and not self._in_entries and not self._done:
+            self._advance()
+        return self.fields.get(key, default)
+
+    def entries(self) -> Iterator[Dict]:
+        """Yield each Bundle.entry element, then read the rest of the document"""
+        while not self._done:
+            entry = self._advance()
+            if entry is not None:
+                yield entry
+
+    def close(self):
+        self._done = True
+        if self._close is not None:
+            close, self._close = self._close, None
+            close()
+
+    # -- parser ---------------------------------------------------------------
+
+    def _advance(self) -> Optional[Dict]:
+        """Run the parser to its next entry (returned) or the start of `entry`"""
+        try:
+            return next(self._events)
+        except StopIteration:
+            self.close()
+        except (ValueError,) + self._transport_errors as e:
+            self.error = f"Bundle stream failed after {self.entries_read} entries: {e}"
+            self.close()
+        return None
+
+    def _parse(self) -> Iterator[Optional[Dict]]:
+        self._expect('{')
+        while True:
+            char = self._peek()
+            if char == '}':
+                return
+            if char == ',':
+                self._pos += 1
+                continue
+            key = self._read_value()
+            self._expect(':')
+            if key != 'entry':
+                self.fields[key] = self._read_value()
+                continue
+
+            self._expect('[')
+            self._in_entries = True
+            yield None
+            while True:
+                char = self._peek()
+                if char == ']':
+                    self._pos += 1
+                    break
+                if char == ',':
+                    self._pos += 1
+                    continue
+                entry = self._read_value()
+                self.entries_read += 1
+                yield entry
+            self._in_entries = False
+
+    def _fill(self) -> bool:
+        """Append the next chunk to the buffer; False at end of input"""
+        if self._eof:
+            return False
+        for chunk in self._chunks:
+            text = self._text.decode(chunk)
+            if text:
+                self._buf += text
+                return True
+        self._buf += self._text.decode(b'', final=True)
+        self._eof = True
+        return False
+
+    def _peek(self) -> str:
+        """Next non-whitespace character (not consumed)"""
+        while True:
+            self._pos = _WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                raise ValueError('unexpected end of Bundle')
+
+    def _expect(self, char: str):
+        found = self._peek()
+        if found != char:
+            raise ValueError(f"expected {char!r} at offset {self._pos}, found {found!r}")
+        self._pos += 1
+
+    def _read_value(self):
+        """Decode the JSON value at the cursor and drop it from the buffer"""
+        self._peek()
+        end = self._value_end()
+        value = loads(self._buf[self._pos:end])
+        # Keep only the unread tail so memory stays at ~one value + one chunk
+        self._buf = self._buf[end:]
+        self._pos = 0
+        return value
+
+    def _value_end(self) -> int:
+        """Offset just past the value starting at the cursor, reading input as needed"""
+        if self._buf[self._pos] not in '{["':
+            while True:
+                match = _SCALAR_END.search(self._buf, self._pos)
+                if match:
+                    return match.start()
+                if not self._fill():
+                    return len(self._buf)
+
+        depth = 0
+        in_string = False
+        i = self._pos
+        while True:
+            pattern = _STRING_SPECIAL if in_string else _STRUCTURAL
+            match = pattern.search(self._buf, i)
+            if match is None or (match.group() == '\\' and match.end() >= len(self._buf)):
+                # Value continues past the buffered text
+                i = len(self._buf) if match is None else match.start()
+                if not self._fill():
+                    raise ValueError('unexpected end of Bundle')
+                continue
+
+            char = match.group()
+            i = match.end()
+            if in_string:
+                if char == '\\':
+                    i += 1
+                    continue
+                in_string = False
+                if depth == 0:
+                    return i
+            elif char == '"':
+                in_string = True
+            elif char in '{[':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return i
@@ -0,0 +1,394 @@
+"""
+Record/replay of upstream HTTP traffic for offline load testing.
+
+With FHIR_CASSETTE_MODE=record, every request the pooled sessions send
+(EpicFHIRClient, EpicOAuthHandler) is passed through to the network and
+the request/response pair is appended to a cassette. With
+FHIR_CASSETTE_MODE=replay, nothing goes to the network: responses are
+served from the cassette after an artificial latency, so /api/expenses and
+the OAuth callback can be driven at full concurrency on a laptop.
+
+Cassettes are gzip'd JSON lines, one interaction per line:
+
+    {"key": "GET https://.../Patient/123?", "request": {"method": ..., "url": ...},
+     "response": {"status": 200, "reason": "OK", "headers": {...}, "json": {...}},
+     "elapsed_ms": 183.0}
+
+Interactions are matched on method, URL (query sorted) and a digest of the
+request body. Auth headers never take part, and volatile form/query fields
+(the OAuth code and state) are left out of the key. Repeated keys replay
+their recordings in turn.
+
+Before anything is written, the interaction passes through the configured
+scrubbers. 'credentials' removes tokens. 'demographics' replaces Patient
+and RelatedPerson names, contacts, birth dates and identifiers, the display
+and identifier of every Reference (patient, subscriber, beneficiary, ...),
+Coverage.subscriberId, and patient ids wherever they appear: the token
+response's `patient`, resource ids, references and request URLs. Ids map
+to stable pseudonyms, so a replayed session asks for the URLs that were
+recorded. More scrubbers can be added with register_scrubber.
+"""
+
+import base64
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from env_config import CASSETTE_CONFIG
+
+# Response headers worth keeping; everything else (Set-Cookie, server noise) is dropped
+KEPT_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control', 'Retry-After', 'Location')
+
+
+class CassetteMissError(requests.exceptions.RequestException):
+    """Replay found no recording for a request"""
+
+
+def request_key(method: str, url: str, body: Optional[bytes], ignore_params: List[str]) -> str:
+    """Stable identity of a request, independent of credentials and volatile fields"""
+    parts = urlsplit(url)
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in ignore_params)
+    key = f"{method.upper()} {parts.scheme}://{parts.netloc}{parts.path}?{urlencode(query)}"
+    if body:
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        try:
+            form = parse_qsl(body.decode('ascii'), keep_blank_values=True, strict_parsing=True)
+            body = urlencode(sorted((k, v) for k, v in form if k not in ignore_params)).encode('ascii')
+        except (UnicodeDecodeError, ValueError):
+            pass
+        key += f" #{hashlib.sha256(body).hexdigest()[:16]}"
+    return key
+
+
+# -- scrubbers ----------------------------------------------------------------
+
+_scrubbers: Dict[str, Callable[[Dict], Dict]] = {}
+
+
+def register_scrubber(name: str, scrubber: Callable[[Dict], Dict]):
+    """Make `scrubber(interaction) -> interaction` available to CASSETTE_CONFIG['scrubbers']"""
+    _scrubbers[name] = scrubber
+
+
+def _resources(body: Any):
+    """The resource in a response body plus any Bundle entry resources"""
+    if not isinstance(body, dict):
+        return
+    yield body
+    for entry in body.get('entry', []) or []:
+        resource = entry.get('resource') if isinstance(entry, dict) else None
+        if isinstance(resource, dict):
+            yield from _resources(resource)
+
+
+def _scrub_credentials(interaction: Dict) -> Dict:
+    body = interaction['response'].get('json')
+    if isinstance(body, dict):
+        for field in ('access_token', 'refresh_token', 'id_token'):
+            if field in body:
+                body[field] = f'scrubbed-{field}'
+    return interaction
+
+
+# Keys a FHIR Reference may carry; a dict made only of these is taken for one
+_REFERENCE_KEYS = {'reference', 'type', 'identifier', 'display', 'id', 'extension'}
+
+# Real patient id -> pseudonym, shared across interactions so requests for a
+# scrubbed id (from the token response) still match on replay
+_patient_ids: Dict[str, str] = {}
+
+
+def _digest(value: str, length: int) -> str:
+    return hashlib.sha256(value.encode()).hexdigest()[:length]
+
+
+def _pseudonym(patient_id: str) -> str:
+    pseudonym = _patient_ids.get(patient_id)
+    if pseudonym is None:
+        if patient_id in _patient_ids.values():
+            return patient_id  # already scrubbed
+        pseudonym = _patient_ids.setdefault(patient_id, f'scrubbed-{_digest(patient_id, 16)}')
+    return pseudonym
+
+
+def _scrub_identifiers(identifiers: Any):
+    for identifier in identifiers if isinstance(identifiers, list) else [identifiers]:
+        if isinstance(identifier, dict) and isinstance(identifier.get('value'), str):
+            identifier['value'] = _digest(identifier['value'], 12)
+
+
+def _scrub_path(path: str) -> str:
+    """`path` (a URL path or relative reference) with known patient ids replaced"""
+    return '/'.join(_patient_ids.get(segment, segment) for segment in path.split('/'))
+
+
+def _scrub_query(query: str) -> str:
+    return urlencode([(k, _scrub_path(v)) for k, v in parse_qsl(query, keep_blank_values=True)])
+
+
+def _scrub_url(url: str) -> str:
+    parts = urlsplit(url)
+    return parts._replace(path=_scrub_path(parts.path), query=_scrub_query(parts.query)).geturl()
+
+
+def _scrub_references(value: Any):
+    """Pseudonymise display and identifier on every Reference below `value`"""
+    if isinstance(value, list):
+        for item in value:
+            _scrub_references(item)
+        return
+    if not isinstance(value, dict):
+        return
+    if (value.keys() <= _REFERENCE_KEYS and value.keys() & {'reference', 'identifier', 'display'}
+            and not isinstance(value.get('type'), dict)):
+        reference = value.get('reference')
+        if isinstance(reference, str):
+            target = reference.rstrip('/').rsplit('/', 2)[-2:]
+            if len(target) == 2 and target[0] in ('Patient', 'RelatedPerson'):
+                _pseudonym(target[1])
+            value['reference'] = _scrub_path(reference)
+        if isinstance(value.get('display'), str):
+            # For a Patient, the same pseudonym as its own scrubbed name
+            source = reference.rsplit('/', 1)[-1] if isinstance(reference, str) else value['display']
+            value['display'] = f"Test Member-{_digest(source, 8)}"
+        if 'identifier' in value:
+            _scrub_identifiers(value['identifier'])
+        return
+    for key, item in value.items():
+        if key in ('fullUrl', 'url') and isinstance(item, str):
+            value[key] = _scrub_url(item)
+        else:
+            _scrub_references(item)
+
+
+def _scrub_demographics(interaction: Dict) -> Dict:
+    body = interaction['response'].get('json')
+    if isinstance(body, dict) and 'resourceType' not in body and isinstance(body.get('patient'), str):
+        # Token response: the patient in context
+        body['patient'] = _pseudonym(body['patient'])
+
+    for resource in _resources(body):
+        if resource.get('resourceType') not in ('Patient', 'RelatedPerson'):
+            if resource.get('resourceType') == 'Coverage' and isinstance(resource.get('subscriberId'), str):
+                resource['subscriberId'] = _digest(resource['subscriberId'], 12)
+            continue
+        digest = _digest(str(resource.get('id')), 8)
+        if 'id' in resource:
+            resource['id'] = _pseudonym(str(resource['id']))
+        if 'name' in resource:
+            resource['name'] = [{'use': 'official', 'family': f'Member-{digest}', 'given': ['Test']}]
+        for field in ('telecom', 'address', 'photo', 'contact'):
+            resource.pop(field, None)
+        if 'birthDate' in resource:
+            resource['birthDate'] = resource['birthDate'][:4] + '-01-01'
+        _scrub_identifiers(resource.get('identifier', []))
+    _scrub_references(body)
+
+    # Patient ids in the request (Patient/<id>, ?patient=<id>) follow the pseudonyms
+    request = interaction['request']
+    request['url'] = _scrub_url(request['url'])
+    method, _, rest = interaction['key'].partition(' ')
+    url, marker, digest = rest.partition(' #')
+    path, _, query = url.partition('?')
+    interaction['key'] = f"{method} {_scrub_path(path)}?{_scrub_query(query)}{marker}{digest}"
+    return interaction
+
+
+register_scrubber('credentials', _scrub_credentials)
+register_scrubber('demographics', _scrub_demographics)
+
+
+# -- cassette -----------------------------------------------------------------
+
+class Cassette:
+    """Interactions on disk plus the replay cursor for each request key"""
+
+    def __init__(self, path: str, ignore_params: List[str], scrubbers: List[str]):
+        self.path = path
+        self.ignore_params = ignore_params
+        self.scrubbers = [_scrubbers[name] for name in scrubbers]
+        self._lock = threading.Lock()
+        self._interactions: Dict[str, List[Dict]] = {}
+        self._cursors: Dict[str, int] = {}
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+
+    def load(self):
+        self._interactions.clear()
+        self._cursors.clear()
+        if not os.path.exists(self.path):
+            print(f"⚠️ Cassette {self.path} does not exist; every request will miss")
+            return
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    interaction = json.loads(line)
+                    interaction['body'] = _response_body(interaction['response'])
+                    self._interactions.setdefault(interaction['key'], []).append(interaction)
+        print(f"📼 Loaded {sum(len(v) for v in self._interactions.values())} interactions from {self.path}")
+
+    def record(self, key: str, request: requests.PreparedRequest, response: requests.Response,
+               elapsed_ms: float):
+        interaction = {
+            'key': key,
+            'request': {'method': request.method, 'url': request.url},
+            'response': {
+                'status': response.status_code,
+                'reason': response.reason,
+                'headers': {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers}
+            },
+            'elapsed_ms': round(elapsed_ms, 1)
+        }
+        content = response.content or b''
+        try:
+            interaction['response']['json'] = json.loads(content) if content else None
+        except ValueError:
+            try:
+                interaction['response']['text'] = content.decode('utf-8')
+            except UnicodeDecodeError:
+                interaction['response']['base64'] = base64.b64encode(content).decode('ascii')
+
+        for scrubber in self.scrubbers:
+            interaction = scrubber(interaction)
+
+        line = json.dumps(interaction, separators=(',', ':')) + '\n'
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Each append is its own gzip member; gzip readers concatenate them
+            with gzip.open(self.path, 'at', encoding='utf-8') as f:
+                f.write(line)
+            self.recorded += 1
+
+    def next_interaction(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            recordings = self._interactions.get(key)
+            if not recordings:
+                self.misses += 1
+                return None
+            cursor = self._cursors.get(key, 0)
+            self._cursors[key] = cursor + 1
+            self.replayed += 1
+            return recordings[cursor % len(recordings)]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'recorded': self.recorded, 'replayed': self.replayed, 'misses': self.misses}
+
+
+def _response_body(recorded: Dict) -> bytes:
+    if recorded.get('json') is not None:
+        return json.dumps(recorded['json']).encode('utf-8')
+    if 'text' in recorded:
+        return recorded['text'].encode('utf-8')
+    if 'base64' in recorded:
+        return base64.b64decode(recorded['base64'])
+    return b''
+
+
+class CassetteAdapter(BaseAdapter):
+    """requests adapter that records through `inner` or replays from the cassette"""
+
+    def __init__(self, cassette: Cassette, mode: str, inner: Optional[BaseAdapter] = None,
+                 latency_ms: Optional[float] = None, jitter_ms: float = 0.0, seed: Optional[int] = None):
+        super().__init__()
+        self.cassette = cassette
+        self.mode = mode
+        self.inner = inner
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    def send(self, request: requests.PreparedRequest, stream=False, timeout=None, verify=True,
+             cert=None, proxies=None):
+        key = request_key(request.method, request.url, request.body, self.cassette.ignore_params)
+        if self.mode == 'record':
+            started = time.perf_counter()
+            response = self.inner.send(request, stream=stream, timeout=timeout, verify=verify,
+                                       cert=cert, proxies=proxies)
+            response.content  # read the body so its transfer time is part of the latency
+            self.cassette.record(key, request, response, (time.perf_counter() - started) * 1000)
+            return response
+        return self._replay(key, request)
+
+    def _replay(self, key: str, request: requests.PreparedRequest) -> requests.Response:
+        interaction = self.cassette.next_interaction(key)
+        if interaction is None:
+            raise CassetteMissError(f"no cassette recording for {key}", request=request)
+
+        # Recorded latency unless a fixed one is configured, plus uniform jitter
+        delay = interaction.get('elapsed_ms', 0.0) if self.latency_ms is None else self.latency_ms
+        if self.jitter_ms:
+            with self._random_lock:
+                delay += self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+        recorded = interaction['response']
+        response = requests.Response()
+        response.status_code = recorded['status']
+        response.reason = recorded.get('reason')
+        response.headers = CaseInsensitiveDict(recorded.get('headers', {}))
+        response._content = interaction['body']
+        response._content_consumed = True
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.elapsed = timedelta(milliseconds=max(delay, 0))
+        return response
+
+    def close(self):
+        if self.inner is not None:
+            self.inner.close()
+
+
+_cassette: Optional[Cassette] = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette() -> Optional[Cassette]:
+    """The process-wide cassette, or None when record/replay is off"""
+    global _cassette
+    config = CASSETTE_CONFIG
+    if config['mode'] not in ('record', 'replay'):
+        return None
+    with _cassette_lock:
+        if _cassette is None:
+            _cassette = Cassette(config['path'], config['ignore_params'], config['scrubbers'])
+            if config['mode'] == 'replay':
+                _cassette.load()
+            print(f"📼 Cassette {config['mode']} mode: {config['path']}")
+    return _cassette
+
+
+def wrap_adapter(inner: BaseAdapter) -> BaseAdapter:
+    """Wrap a transport adapter for the configured cassette mode (no-op when off)"""
+    cassette = get_cassette()
+    if cassette is None:
+        return inner
+    config = CASSETTE_CONFIG
+    return CassetteAdapter(cassette, config['mode'], inner, config['latency_ms'], config['jitter_ms'], config['seed'])
+
+
+def get_cassette_stats() -> Dict:
+    cassette = _cassette
+    if cassette is None:
+        return {'mode': 'off'}
+    return {'mode': CASSETTE_CONFIG['mode'], **cassette.stats()}
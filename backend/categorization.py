@@ -0,0 +1,250 @@
+"""
+Expense categorization: code-system lookups first, descriptions last.
+
+For each expense the first rule that answers wins:
+
+1. Product/service codes (item.productOrService.coding) from CDT, CPT,
+   HCPCS and NDC, looked up in hash indexes built once from the local
+   code table (CATEGORIZATION_CONFIG['table']). Rows are exact codes or
+   prefixes ('920*'); an exact code beats a prefix and the longest prefix
+   wins. A lookup is one dict probe per distinct prefix length in that
+   system, so its cost does not grow with the table.
+2. The claim type (type.coding.first().code: oral, vision, medical).
+3. Whole-system rows ('ndc,*'): a code from that system that no exact or
+   prefix row covers. They only say which system a code is from, so they
+   rank below the claim type.
+4. Keywords in the service description, all matched by one compiled
+   pattern. Each category's keywords are folded into a trie, so matching
+   is one left-to-right scan whose cost depends on the description rather
+   than on how many keywords there are. Keywords match at word starts
+   ('accidental' is not dental); when several categories match, the
+   earlier one in DESCRIPTION_KEYWORDS wins.
+5. DEFAULT_CATEGORY.
+
+Every rule (table row, claim type, keyword category, default) counts its
+hits, exposed on /metrics via get_categorization_stats(). Each thread counts
+into its own dict without locking; stats() adds them up, folding in the
+counts of threads that have finished. Counts are per process, so
+transforms run on parallel_transform workers are not included.
+"""
+
+import csv
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from env_config import CATEGORIZATION_CONFIG
+
+DEFAULT_CATEGORY = 'Medical'
+
+# Distinct (system, code) pairs whose lookup result is remembered as-is
+SEEN_CODES_LIMIT = 100000
+
+# Code system URIs (and OIDs) by table system name
+CODE_SYSTEMS = {
+    'http://www.ada.org/cdt': 'cdt',
+    'http://ada.org/cdt': 'cdt',
+    'urn:oid:2.16.840.1.113883.6.13': 'cdt',
+    'http://www.ama-assn.org/go/cpt': 'cpt',
+    'urn:oid:2.16.840.1.113883.6.12': 'cpt',
+    'https://www.cms.gov/Medicare/Coding/HCPCSReleaseCodeSets': 'hcpcs',
+    'http://www.cms.gov/Medicare/Coding/HCPCSReleaseCodeSets': 'hcpcs',
+    'urn:oid:2.16.840.1.113883.6.285': 'hcpcs',
+    'http://hl7.org/fhir/sid/ndc': 'ndc',
+    'urn:oid:2.16.840.1.113883.6.69': 'ndc'
+}
+
+TYPE_CATEGORIES = {
+    'oral': 'Dental',
+    'vision': 'Vision',
+    'medical': 'Medical'
+}
+
+# In priority order; keywords match at the start of a word
+DESCRIPTION_KEYWORDS = {
+    'Dental': ['dental', 'tooth', 'prophylaxis'],
+    'Vision': ['vision', 'eye', 'glasses'],
+    'Prescription': ['medication', 'prescription']
+}
+
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    """One regex alternation for `words` with shared prefixes factored out"""
+    trie: Dict = {}
+    for word in words:
+        node = trie
+        for char in word.lower():
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node: Dict) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        if '' in node:
+            # A shorter keyword already matched here; matching is by prefix
+            return ''
+        return branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+
+    return build(trie)
+
+
+def load_code_table(path: str) -> List[Tuple[str, str, str]]:
+    """(system, code, category) rows of a code table CSV; '#' lines are comments"""
+    with open(path, newline='') as f:
+        rows = csv.DictReader(line for line in f if not line.startswith('#'))
+        return [(row['system'].strip().lower(), row['code'].strip().upper(), row['category'].strip())
+                for row in rows if row.get('system')]
+
+
+class CategorizationEngine:
+    """Indexed categorization rules; categorize() is safe to call from any thread"""
+
+    def __init__(self, code_rows: Iterable[Tuple[str, str, str]],
+                 type_categories: Optional[Dict[str, str]] = None,
+                 description_keywords: Optional[Dict[str, Sequence[str]]] = None,
+                 default: str = DEFAULT_CATEGORY):
+        self.exact: Dict[Tuple[str, str], Tuple[str, str]] = {}
+        self.prefixes: Dict[Tuple[str, str], Tuple[str, str]] = {}
+        self.prefix_lengths: Dict[str, List[int]] = {}
+        self.systems: Dict[str, Tuple[str, str]] = {}
+        for system, code, category in code_rows:
+            rule = f"code:{system}:{code}"
+            if code == '*':
+                self.systems[system] = (category, rule)
+            elif code.endswith('*'):
+                self.prefixes[(system, code[:-1])] = (category, rule)
+                self.prefix_lengths.setdefault(system, []).append(len(code) - 1)
+            else:
+                self.exact[(system, code)] = (category, rule)
+        for system, lengths in self.prefix_lengths.items():
+            self.prefix_lengths[system] = sorted(set(lengths), reverse=True)
+
+        self.type_categories = dict(TYPE_CATEGORIES if type_categories is None else type_categories)
+        keywords = DESCRIPTION_KEYWORDS if description_keywords is None else description_keywords
+        self.keyword_categories = list(keywords)
+        groups = '|'.join(f"({_trie_pattern(words)})" for words in keywords.values())
+        # Matched against the lowercased description: cheaper than IGNORECASE
+        self.keywords = re.compile(rf"(?<![a-z0-9])(?:{groups})") if keywords else None
+        self.default = default
+
+        # (system URI, code) as seen in resources -> code_category() result
+        self._seen: Dict[Tuple[Optional[str], Optional[str]], Optional[Tuple[str, str]]] = {}
+        code_rules = list(self.exact.values()) + list(self.prefixes.values()) + list(self.systems.values())
+        self.rules: Tuple[str, ...] = tuple(dict.fromkeys(
+            [rule for _, rule in code_rules]
+            + [f"type:{code}" for code in self.type_categories]
+            + [f"description:{category}" for category in self.keyword_categories]
+            + ['default']))
+        # Hit counts: one dict per thread (every rule present up front, so
+        # counting never resizes it), plus the totals of finished threads
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._thread_hits: List[Tuple[threading.Thread, Dict[str, int]]] = []
+        self._finished_hits: Dict[str, int] = dict.fromkeys(self.rules, 0)
+
+    @classmethod
+    def from_table(cls, path: str) -> 'CategorizationEngine':
+        return cls(load_code_table(path))
+
+    def _hit(self, rule: str, category: str) -> str:
+        try:
+            hits = self._local.hits
+        except AttributeError:
+            hits = self._register_thread()
+        hits[rule] += 1
+        return category
+
+    def _register_thread(self) -> Dict[str, int]:
+        hits = self._local.hits = dict.fromkeys(self.rules, 0)
+        with self._lock:
+            self._fold_finished()
+            self._thread_hits.append((threading.current_thread(), hits))
+        return hits
+
+    def _fold_finished(self):
+        """Move the counts of finished threads into _finished_hits (lock held)"""
+        live = []
+        for thread, hits in self._thread_hits:
+            if thread.is_alive():
+                live.append((thread, hits))
+            else:
+                for rule, count in hits.items():
+                    self._finished_hits[rule] += count
+        self._thread_hits = live
+
+    def code_category(self, system: Optional[str], code: Optional[str]) -> Optional[Tuple[str, str]]:
+        """(category, rule) for one coding, or None when no exact or prefix row covers it"""
+        system = CODE_SYSTEMS.get(system)
+        if system is None or not isinstance(code, str):
+            return None
+        code = code.strip().upper()
+        found = self.exact.get((system, code))
+        if found is not None:
+            return found
+        for length in self.prefix_lengths.get(system, ()):
+            if length <= len(code):
+                found = self.prefixes.get((system, code[:length]))
+                if found is not None:
+                    return found
+        return None
+
+    def description_category(self, description: Optional[str]) -> Optional[str]:
+        """Highest-priority keyword category in `description`, if any"""
+        if not description or self.keywords is None:
+            return None
+        best = None
+        for match in self.keywords.finditer(description.lower()):
+            if best is None or match.lastindex < best:
+                best = match.lastindex
+                if best == 1:
+                    break
+        return None if best is None else self.keyword_categories[best - 1]
+
+    def categorize(self, codings: Optional[Iterable[Dict]], type_code: Optional[str],
+                   description: Optional[str]) -> str:
+        """Category for an expense from its item codings, claim type code and service description"""
+        by_system = None
+        for coding in codings or ():
+            if coding.__class__ is dict:
+                key = (coding.get('system'), coding.get('code'))
+                found = self._seen.get(key, key)
+                if found is key:
+                    found = self.code_category(*key)
+                    if len(self._seen) < SEEN_CODES_LIMIT:
+                        self._seen[key] = found
+                if found is not None:
+                    return self._hit(found[1], found[0])
+                if by_system is None and key[1]:
+                    by_system = self.systems.get(CODE_SYSTEMS.get(key[0]))
+        category = self.type_categories.get(type_code)
+        if category is not None:
+            return self._hit(f"type:{type_code}", category)
+        if by_system is not None:
+            return self._hit(by_system[1], by_system[0])
+        category = self.description_category(description)
+        if category is not None:
+            return self._hit(f"description:{category}", category)
+        return self._hit('default', self.default)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._fold_finished()
+            hits = dict(self._finished_hits)
+            for _, thread_hits in self._thread_hits:
+                # Another thread may be counting; its dict only changes values, never size
+                for rule, count in list(thread_hits.items()):
+                    hits[rule] += count
+        return {
+            'categorized': sum(hits.values()),
+            'code_rules': len(self.exact) + len(self.prefixes) + len(self.systems),
+            'hits': hits
+        }
+
+
+categorizer = CategorizationEngine.from_table(CATEGORIZATION_CONFIG['table'])
+
+
+def get_categorization_stats() -> Dict:
+    """Per-rule hit counts of the expense categorizer"""
+    return categorizer.stats()
@@ -0,0 +1,105 @@
+"""
+Shared pytest fixtures: a local FHIR server and isolated client caches
+"""
+
+import http.server
+import json
+import socketserver
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+
+import fhir_client
+from env_config import FHIR_RESOURCE_STORE_CONFIG
+from fhir_sync import IncrementalSyncStore
+from resource_store import ResourceStore
+
+
+class FakeRequest(NamedTuple):
+    method: str
+    path: str  # below /fhir, e.g. 'Patient/p1'
+    params: Dict[str, str]
+    headers: Dict[str, str]
+    body: Optional[Dict]
+
+
+Route = Callable[[FakeRequest], Tuple[int, Optional[Dict], Dict[str, str]]]
+
+
+class FakeFHIR:
+    """FHIR server on 127.0.0.1 answering every request with route(request) -> (status, body, headers)"""
+
+    def __init__(self):
+        self.route: Route = lambda request: (404, {'resourceType': 'OperationOutcome'}, {})
+        self.requests: List[FakeRequest] = []
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def handle_request(self, method):
+                parts = urlsplit(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                request = FakeRequest(method, parts.path[len('/fhir/'):], dict(parse_qsl(parts.query)),
+                                      dict(self.headers), json.loads(self.rfile.read(length)) if length else None)
+                fake.requests.append(request)
+                status, body, headers = fake.route(request)
+                payload = json.dumps(body).encode() if body is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/fhir+json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self.handle_request('GET')
+
+            def do_POST(self):
+                self.handle_request('POST')
+
+            def log_message(self, *args):
+                pass
+
+        socketserver.ThreadingTCPServer.daemon_threads = True
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/fhir"
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def searchset(self, request: FakeRequest, resources: List[Dict], included: List[Dict] = ()) -> Tuple:
+        """One page of `resources` by _offset/_count, with a next link while more remain"""
+        offset, count = int(request.params.get('_offset', 0)), int(request.params.get('_count', 50))
+        bundle = {
+            'resourceType': 'Bundle', 'type': 'searchset', 'total': len(resources),
+            'entry': [{'resource': resource, 'search': {'mode': 'match'}} for resource in resources[offset:offset + count]]
+                     + [{'resource': resource, 'search': {'mode': 'include'}} for resource in included],
+            'link': []
+        }
+        if offset + count < len(resources):
+            params = '&'.join(f"{name}={value}" for name, value in {**request.params, '_offset': offset + count}.items())
+            bundle['link'].append({'relation': 'next', 'url': f"{self.base_url}/{request.path}?{params}"})
+        return 200, bundle, {}
+
+    def searches(self, resource_type: str) -> List[FakeRequest]:
+        return [request for request in self.requests if request.method == 'GET' and request.path == resource_type]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def fake_fhir(tmp_path, monkeypatch):
+    """A fresh FakeFHIR, with the client's sync state and resource store private to the test"""
+    config = FHIR_RESOURCE_STORE_CONFIG
+    monkeypatch.setattr(fhir_client, '_sync_store', IncrementalSyncStore(100))
+    monkeypatch.setattr(fhir_client, '_resource_store', ResourceStore(
+        str(tmp_path / 'fhir_resources.sqlite3'), config['ttl_by_type'], config['default_ttl'],
+        config['memory_max_entries'], config['memory_max_bytes'],
+        config['disk_max_entries'], config['disk_max_bytes']))
+    fake = FakeFHIR()
+    yield fake
+    fake.close()
@@ -0,0 +1,99 @@
+"""
+Per-request deadline budget.
+
+The Flask app starts a budget when a request comes in. The budget comes from
+the X-Request-Timeout-Ms header or the route's default in DEADLINE_CONFIG.
+It lives in a context variable, so the FHIR client, the OAuth handler and
+the resilience layer can all see it. Every outbound call gets
+min(its own timeout, remaining budget), retries stop once the next attempt
+would not fit, and a call made with no budget left fails fast with
+DeadlineExceeded. Callers then fall back to partial or cached data and can
+ask exceeded() whether that happened.
+
+Context variables do not follow work into thread pools on their own, so
+work handed to an executor must go through submit().
+"""
+
+import contextvars
+import time
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from typing import Callable, Optional, Tuple
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's deadline budget is used up"""
+
+
+class Budget:
+    __slots__ = ('expires_at', 'exceeded')
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+        # Shared by every context copied from the request, so worker threads
+        # can report back that they ran out of time
+        self.exceeded = False
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+
+_budget: contextvars.ContextVar[Optional[Budget]] = contextvars.ContextVar('deadline_budget', default=None)
+
+
+def start(seconds: float) -> contextvars.Token:
+    """Begin a budget of `seconds` for the current context; pass the token to end()"""
+    return _budget.set(Budget(seconds))
+
+
+def end(token: contextvars.Token):
+    _budget.reset(token)
+
+
+@contextmanager
+def budget(seconds: float):
+    token = start(seconds)
+    try:
+        yield _budget.get()
+    finally:
+        end(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current budget, or None when no deadline is set"""
+    current = _budget.get()
+    return None if current is None else current.remaining()
+
+
+def note_exceeded():
+    current = _budget.get()
+    if current is not None:
+        current.exceeded = True
+
+
+def exceeded() -> bool:
+    """Whether any call in this request was cut short by the deadline"""
+    current = _budget.get()
+    return current is not None and current.exceeded
+
+
+def check():
+    """Raise DeadlineExceeded if the budget is already spent"""
+    left = remaining()
+    if left is not None and left <= 0:
+        note_exceeded()
+        raise DeadlineExceeded('request deadline exceeded')
+
+
+def timeout_for(timeout: Tuple[float, float]) -> Tuple[float, float]:
+    """Clamp a (connect, read) timeout to the remaining budget"""
+    left = remaining()
+    if left is None:
+        return timeout
+    check()
+    return (min(timeout[0], left), min(timeout[1], left))
+
+
+def submit(executor: Executor, fn: Callable, *args, **kwargs) -> Future:
+    """executor.submit that carries the caller's context (and so its deadline)"""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
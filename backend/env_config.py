@@ -13,7 +13,9 @@ EPIC_CONFIG = {
     'client_id': os.getenv('EPIC_CLIENT_ID', '4c5fe68b-3ef5-487c-a0e1-3515d37e51fd'),
     'redirect_uri': os.getenv('EPIC_REDIRECT_URI', 'http://localhost:4000/auth/epic/callback'),
     # FOCUSED SCOPES: Essential APIs for EOB and expense tracking
-    'scopes': 'openid patient/*.read explanationofbenefit/*.read'
+    'scopes': 'openid patient/*.read explanationofbenefit/*.read',
+    # (connect, read) seconds for the token endpoint; clamped to the request deadline
+    'token_timeout': (5, 30)
 }
 
 # Test patient IDs from Epic sandbox
@@ -45,3 +47,217 @@ DEMO_CONFIG = {
     'mock_patient_id': 'erXuFYUfucBZaryVksYEcMg3',
     'mock_provider_name': 'Trellis Healthcare'
 }
+
+# Shared HTTP connection pool (one pool per upstream origin, see http_pool.py)
+HTTP_POOL_CONFIG = {
+    'pool_maxsize': int(os.getenv('FHIR_POOL_MAXSIZE', '20')),
+    # Blocking makes callers wait for a free pooled connection instead of
+    # opening an extra one; the wait is capped by pool_timeout and the
+    # request deadline (see deadline)
+    'pool_block': os.getenv('FHIR_POOL_BLOCK', 'false').lower() == 'true',
+    'pool_timeout': float(os.getenv('FHIR_POOL_TIMEOUT', '5')),
+    'keepalive_idle_timeout': float(os.getenv('FHIR_POOL_IDLE_TIMEOUT', '55')),
+    'dns_cache_ttl': float(os.getenv('FHIR_DNS_CACHE_TTL', '300')),
+    # Multiplex concurrent reads over one HTTP/2 connection per https origin
+    # (needs the h2 package; see http2_transport). Prior knowledge speaks h2c
+    # to plain-http origins, for local stand-in servers.
+    'http2': os.getenv('FHIR_HTTP2', 'false').lower() == 'true',
+    'http2_prior_knowledge': os.getenv('FHIR_HTTP2_PRIOR_KNOWLEDGE', 'false').lower() == 'true'
+}
+
+# FHIR search paging (see EpicFHIRClient.iter_search); 0 disables a limit
+FHIR_SEARCH_CONFIG = {
+    'page_size': int(os.getenv('FHIR_PAGE_SIZE', '100')),
+    'max_pages': int(os.getenv('FHIR_MAX_PAGES', '100')),
+    'max_resources': int(os.getenv('FHIR_MAX_RESOURCES', '10000')),
+    'prefetch': os.getenv('FHIR_PREFETCH_PAGES', 'true').lower() == 'true',
+    'prefetch_workers': int(os.getenv('FHIR_PREFETCH_WORKERS', '8')),
+    # Parse search pages incrementally instead of buffering whole Bundles
+    'stream': os.getenv('FHIR_STREAM_BUNDLES', 'false').lower() == 'true',
+    'stream_chunk_size': int(os.getenv('FHIR_STREAM_CHUNK_SIZE', str(64 * 1024)))
+}
+
+# Concurrent upstream reads within one API request (see get_patient_and_eob_data).
+# claim_hedge_delay: seconds to wait on EOB before also starting the Claim
+# fallback; 0 issues Patient, EOB and Claim at the same time.
+FHIR_FANOUT_CONFIG = {
+    'workers': int(os.getenv('FHIR_FANOUT_WORKERS', '32')),
+    'claim_hedge_delay': float(os.getenv('FHIR_CLAIM_HEDGE_DELAY', '0'))
+}
+
+# FHIR batch Bundles (see EpicFHIRClient.batch). Individual GETs are used
+# whenever batch is disabled or the CapabilityStatement doesn't list it.
+FHIR_BATCH_CONFIG = {
+    'enabled': os.getenv('FHIR_BATCH_ENABLED', 'true').lower() == 'true',
+    'capability_ttl': float(os.getenv('FHIR_CAPABILITY_TTL', '3600')),
+    'capability_retry': float(os.getenv('FHIR_CAPABILITY_RETRY', '60'))
+}
+
+# Conditional-request response cache (see fhir_cache.ConditionalRequestCache).
+# TTLs are seconds of freshness before revalidating with ETag/Last-Modified.
+FHIR_RESPONSE_CACHE_CONFIG = {
+    'enabled': os.getenv('FHIR_RESPONSE_CACHE', 'true').lower() == 'true',
+    'max_bytes': int(os.getenv('FHIR_RESPONSE_CACHE_BYTES', str(64 * 1024 * 1024))),
+    'default_ttl': float(os.getenv('FHIR_RESPONSE_CACHE_TTL', '30')),
+    'ttl_by_type': {
+        'Patient': 300,
+        'Organization': 3600,
+        'Practitioner': 3600,
+        'Coverage': 300,
+        'ExplanationOfBenefit': 30,
+        'Claim': 30,
+        'metadata': 3600
+    }
+}
+
+# Incremental EOB/Claim sync (see fhir_sync). A full pull is forced every
+# full_resync_interval seconds to pick up hard deletes.
+FHIR_SYNC_CONFIG = {
+    'enabled': os.getenv('FHIR_INCREMENTAL_SYNC', 'true').lower() == 'true',
+    'max_states': int(os.getenv('FHIR_SYNC_MAX_STATES', '2000')),
+    # Resources held in memory, per state and in total (0 = no cap); a state
+    # over either falls back to full pulls
+    'max_resources_per_state': int(os.getenv('FHIR_SYNC_MAX_RESOURCES_PER_STATE', '5000')),
+    'max_resources': int(os.getenv('FHIR_SYNC_MAX_RESOURCES', '200000')),
+    'full_resync_interval': float(os.getenv('FHIR_FULL_RESYNC_INTERVAL', '86400'))
+}
+
+# Provider reference resolution: EOB/Claim searches _include their providers,
+# and Organization/Practitioner resources are cached process-wide.
+FHIR_REFERENCE_CONFIG = {
+    'include_enabled': os.getenv('FHIR_INCLUDE_PROVIDERS', 'true').lower() == 'true',
+    'includes': {
+        'ExplanationOfBenefit': ['ExplanationOfBenefit:provider'],
+        'Claim': ['Claim:provider']
+    },
+    'shared_types': ['Organization', 'Practitioner'],
+    'resolve_missing': os.getenv('FHIR_RESOLVE_MISSING_REFERENCES', 'true').lower() == 'true',
+    'ttl': float(os.getenv('FHIR_REFERENCE_TTL', '3600')),
+    'max_entries': int(os.getenv('FHIR_REFERENCE_MAX_ENTRIES', '10000'))
+}
+
+# Retries, timeouts and circuit breaking for upstream FHIR calls (see resilience).
+# Policies are 'default' overlaid with 'hosts'[host] and 'resource_types'[type].
+FHIR_RESILIENCE_CONFIG = {
+    'default': {
+        'max_attempts': int(os.getenv('FHIR_RETRY_MAX_ATTEMPTS', '3')),
+        'backoff_base': float(os.getenv('FHIR_RETRY_BACKOFF_BASE', '0.25')),
+        'backoff_max': float(os.getenv('FHIR_RETRY_BACKOFF_MAX', '4')),
+        'retry_statuses': [429, 502, 503, 504],
+        'max_retry_after': float(os.getenv('FHIR_MAX_RETRY_AFTER', '10')),
+        'connect_timeout': float(os.getenv('FHIR_CONNECT_TIMEOUT', '5')),
+        'read_timeout': float(os.getenv('FHIR_READ_TIMEOUT', '30')),
+        'failure_threshold': int(os.getenv('FHIR_BREAKER_FAILURES', '5')),
+        'reset_timeout': float(os.getenv('FHIR_BREAKER_RESET_TIMEOUT', '30')),
+        'half_open_max_calls': int(os.getenv('FHIR_BREAKER_HALF_OPEN_CALLS', '1'))
+    },
+    'hosts': {},
+    'resource_types': {
+        # Capability lookups are cached and have a safe fallback; don't wait on them
+        'metadata': {'max_attempts': 1, 'read_timeout': 10}
+    }
+}
+
+# JSON codec for FHIR responses and API output (see json_codec):
+# 'auto' uses orjson when installed, 'json' forces the stdlib module.
+JSON_CODEC_CONFIG = {
+    'backend': os.getenv('JSON_CODEC', 'auto').lower()
+}
+
+# Coalesce identical in-flight FHIR GETs (same token, URL and params) into one
+# upstream call (see singleflight)
+FHIR_SINGLEFLIGHT_CONFIG = {
+    'enabled': os.getenv('FHIR_SINGLEFLIGHT', 'true').lower() == 'true'
+}
+
+# Two-tier resource cache (see resource_store): in-process LRU plus a SQLite
+# file shared by the workers on this host. An empty path keeps memory only.
+# The file holds patient data: by default it lives in the user's data
+# directory and is created private to the app's user (0700 directory, 0600 file).
+FHIR_RESOURCE_STORE_CONFIG = {
+    'enabled': os.getenv('FHIR_RESOURCE_STORE', 'true').lower() == 'true',
+    'path': os.getenv('FHIR_RESOURCE_STORE_PATH',
+                      os.path.join(os.getenv('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share'),
+                                   'connect-my-provider', 'fhir_resources.sqlite3')),
+    'memory_max_entries': int(os.getenv('FHIR_RESOURCE_STORE_MEMORY_ENTRIES', '5000')),
+    'memory_max_bytes': int(os.getenv('FHIR_RESOURCE_STORE_MEMORY_BYTES', str(32 * 1024 * 1024))),
+    'disk_max_entries': int(os.getenv('FHIR_RESOURCE_STORE_DISK_ENTRIES', '200000')),
+    'disk_max_bytes': int(os.getenv('FHIR_RESOURCE_STORE_DISK_BYTES', str(512 * 1024 * 1024))),
+    'prune_every': 500,
+    # Streamed search pages are written to the store this many resources at a time
+    'stream_batch': 100,
+    'default_ttl': float(os.getenv('FHIR_RESOURCE_STORE_TTL', '300')),
+    'ttl_by_type': {
+        'Patient': 86400,
+        'Organization': 86400,
+        'Practitioner': 86400,
+        'Coverage': 3600,
+        'ExplanationOfBenefit': 300,
+        'Claim': 300
+    }
+}
+
+# Hedged reads (see hedging). Off by default. A read of one of
+# resource_types that is still running after the `percentile` latency of its
+# (host, resource type) gets a duplicate; budget_ratio caps hedges at that
+# fraction of reads (plus budget_burst saved up).
+FHIR_HEDGING_CONFIG = {
+    'enabled': os.getenv('FHIR_HEDGING', 'false').lower() == 'true',
+    'percentile': float(os.getenv('FHIR_HEDGE_PERCENTILE', '95')),
+    'min_delay': 0.05,
+    'max_delay': float(os.getenv('FHIR_HEDGE_MAX_DELAY', '5')),
+    'min_samples': 20,
+    'window': 1000,
+    'budget_ratio': float(os.getenv('FHIR_HEDGE_BUDGET', '0.05')),
+    'budget_burst': 10,
+    'max_workers': 16,
+    'resource_types': ['ExplanationOfBenefit', 'Claim', 'Coverage', 'Patient']
+}
+
+# Record/replay of upstream HTTP traffic for offline load tests (see cassette).
+# mode: 'off', 'record' or 'replay'. latency_ms: fixed replay latency, or
+# unset to replay each response after its recorded latency.
+CASSETTE_CONFIG = {
+    'mode': os.getenv('FHIR_CASSETTE_MODE', 'off').lower(),
+    'path': os.getenv('FHIR_CASSETTE_PATH', 'cassettes/epic.jsonl.gz'),
+    'latency_ms': float(os.environ['FHIR_REPLAY_LATENCY_MS']) if os.getenv('FHIR_REPLAY_LATENCY_MS') else None,
+    'jitter_ms': float(os.getenv('FHIR_REPLAY_JITTER_MS', '0')),
+    'seed': int(os.getenv('FHIR_REPLAY_SEED', '0')),
+    # Left out of request matching: they change on every OAuth round trip
+    'ignore_params': ['code', 'state', 'code_verifier'],
+    'scrubbers': [name for name in os.getenv('FHIR_CASSETTE_SCRUBBERS', 'credentials,demographics').split(',') if name]
+}
+
+# Per-request deadline budget (see deadline). Clients may ask for a shorter
+# budget with the header, never for more than max_seconds. Routes not listed
+# in routes get default_seconds.
+DEADLINE_CONFIG = {
+    'enabled': os.getenv('REQUEST_DEADLINE_ENABLED', 'true').lower() == 'true',
+    'header': 'X-Request-Timeout-Ms',
+    'default_seconds': float(os.getenv('REQUEST_DEADLINE_SECONDS', '25')),
+    'max_seconds': float(os.getenv('REQUEST_DEADLINE_MAX_SECONDS', '60')),
+    'routes': {
+        'get_expenses': 20,
+        'get_expense_fhir': 10,
+        'test_eob_apis': 20,
+        'epic_oauth_callback': 10,
+        'auth_callback': 10
+    }
+}
+
+# Parallel expense transforms of raw payloads for backfills (see
+# parallel_transform). Tasks carry about chunk_bytes of payload so the
+# per-task IPC cost is amortized; waiting on one gives up after task_timeout
+# seconds (or the request deadline).
+TRANSFORM_POOL_CONFIG = {
+    'workers': int(os.getenv('TRANSFORM_WORKERS', str(os.cpu_count() or 1))),
+    'chunk_bytes': int(os.getenv('TRANSFORM_CHUNK_BYTES', str(4 * 1024 * 1024))),
+    'task_timeout': float(os.getenv('TRANSFORM_TASK_TIMEOUT', '300'))
+}
+
+# Expense categorization (see categorization). table: product/service code
+# table (CSV of system,code,category,note).
+CATEGORIZATION_CONFIG = {
+    'table': os.getenv('SERVICE_CODE_TABLE',
+                       os.path.join(os.path.dirname(os.path.abspath(__file__)), 'code_tables', 'service_categories.csv'))
+}
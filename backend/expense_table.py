@@ -0,0 +1,177 @@
+"""
+Columnar expense table for reporting over large EOB/Claim batches.
+
+One NumPy array per column instead of one dict per expense:
+
+    id          bytes (FHIR ids are ASCII, at most 64 characters)
+    date        datetime64[D] (NaT when the service date is unparseable)
+    amount      int64 cents of patient responsibility
+    provider,   dictionary encoded: int32 codes into a tuple of labels,
+    category,   e.g. table.category[i] indexes table.categories
+    currency,
+    status
+
+That is roughly 50 bytes per expense against several hundred for the dict
+form, and sums, group-bys and date filters run as array operations
+(total, totals_by, between, where). Build tables with
+transformers.transform_any_eob_data_to_table.
+
+NumPy is optional for the rest of the backend (pip install numpy); only
+this module needs it.
+"""
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # optional: only the columnar transforms need it
+    np = None
+
+CATEGORICAL_COLUMNS = ('provider', 'category', 'currency', 'status')
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("Columnar expense tables require numpy (pip install numpy)")
+
+
+def _encode(values: Iterable[str]) -> Tuple['np.ndarray', Tuple[str, ...]]:
+    """Dictionary-encode `values`: (int32 codes, labels in first-seen order)"""
+    index: Dict[str, int] = {}
+    codes = [index.setdefault(value, len(index)) for value in values]
+    return np.array(codes, dtype=np.int32), tuple(index)
+
+
+def _dates(values: List[str]) -> 'np.ndarray':
+    """FHIR date/dateTime strings as datetime64[D]; unparseable ones become NaT"""
+    days = [value[:10] if isinstance(value, str) else 'NaT' for value in values]
+    try:
+        return np.array(days, dtype='datetime64[D]')
+    except ValueError:
+        parsed = []
+        for day in days:
+            try:
+                parsed.append(np.datetime64(day, 'D'))
+            except ValueError:
+                parsed.append(np.datetime64('NaT', 'D'))
+        return np.array(parsed, dtype='datetime64[D]')
+
+
+class ExpenseTable:
+    """Expenses as parallel columns; see the module docstring for the layout"""
+
+    __slots__ = ('id', 'date', 'amount', 'provider', 'category', 'currency', 'status',
+                 'providers', 'categories', 'currencies', 'statuses')
+
+    # label tuple attribute for each dictionary-encoded column
+    LABELS = {'provider': 'providers', 'category': 'categories', 'currency': 'currencies', 'status': 'statuses'}
+
+    def __init__(self, id, date, amount, provider, category, currency, status,
+                 providers=(), categories=(), currencies=(), statuses=()):
+        self.id = id
+        self.date = date
+        self.amount = amount
+        self.provider = provider
+        self.category = category
+        self.currency = currency
+        self.status = status
+        self.providers = tuple(providers)
+        self.categories = tuple(categories)
+        self.currencies = tuple(currencies)
+        self.statuses = tuple(statuses)
+
+    @classmethod
+    def from_expenses(cls, expenses: Sequence[Dict]) -> 'ExpenseTable':
+        """Build from expense dicts carrying at least the table's columns"""
+        _require_numpy()
+        columns = {}
+        for column in CATEGORICAL_COLUMNS:
+            columns[column], columns[cls.LABELS[column]] = _encode(expense[column] for expense in expenses)
+        ids = [expense['id'].encode('ascii', 'replace') for expense in expenses]
+        amounts = np.array([expense['amount'] for expense in expenses], dtype=np.float64)
+        return cls(
+            id=np.array(ids, dtype=f"S{max(map(len, ids), default=1)}"),
+            date=_dates([expense['date'] for expense in expenses]),
+            amount=np.rint(amounts * 100).astype(np.int64),
+            **columns
+        )
+
+    @classmethod
+    def concat(cls, tables: Sequence['ExpenseTable']) -> 'ExpenseTable':
+        """One table from several, re-coding the categorical columns onto merged labels"""
+        _require_numpy()
+        columns = {}
+        for column in CATEGORICAL_COLUMNS:
+            labels_name = cls.LABELS[column]
+            merged: Dict[str, int] = {}
+            parts = []
+            for table in tables:
+                labels = getattr(table, labels_name)
+                remap = np.array([merged.setdefault(label, len(merged)) for label in labels], dtype=np.int32)
+                parts.append(remap[getattr(table, column)] if len(labels) else getattr(table, column))
+            columns[column] = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int32)
+            columns[labels_name] = tuple(merged)
+        empty = {'id': np.zeros(0, dtype='S1'), 'date': np.zeros(0, dtype='datetime64[D]'),
+                 'amount': np.zeros(0, dtype=np.int64)}
+        for column in ('id', 'date', 'amount'):
+            columns[column] = np.concatenate([getattr(table, column) for table in tables]) if tables else empty[column]
+        return cls(**columns)
+
+    def __len__(self) -> int:
+        return len(self.amount)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the column arrays"""
+        return sum(getattr(self, column).nbytes for column in ('id', 'date', 'amount') + CATEGORICAL_COLUMNS)
+
+    def labels(self, column: str) -> 'np.ndarray':
+        """Decoded values of a dictionary-encoded column"""
+        return np.array(getattr(self, self.LABELS[column]), dtype=object)[getattr(self, column)]
+
+    def where(self, mask: 'np.ndarray') -> 'ExpenseTable':
+        """Rows where the boolean `mask` is true (labels are kept as they are)"""
+        return ExpenseTable(**{name: getattr(self, name)[mask] if name not in self.LABELS.values()
+                               else getattr(self, name) for name in self.__slots__})
+
+    def between(self, start: Optional[str] = None, end: Optional[str] = None) -> 'ExpenseTable':
+        """Rows with a service date in [start, end] (ISO dates; either may be open)"""
+        mask = ~np.isnat(self.date)
+        if start is not None:
+            mask &= self.date >= np.datetime64(start, 'D')
+        if end is not None:
+            mask &= self.date <= np.datetime64(end, 'D')
+        return self.where(mask)
+
+    def total(self) -> int:
+        """Sum of patient responsibility, in cents"""
+        return int(self.amount.sum())
+
+    def totals_by(self, column: str) -> Dict[str, int]:
+        """Patient responsibility in cents per label of a dictionary-encoded column"""
+        labels = getattr(self, self.LABELS[column])
+        codes = getattr(self, column)
+        totals = np.zeros(len(labels), dtype=np.int64)
+        np.add.at(totals, codes, self.amount)
+        present = np.bincount(codes, minlength=len(labels))
+        return {label: int(total) for label, total, count in zip(labels, totals, present) if count}
+
+    def counts_by(self, column: str) -> Dict[str, int]:
+        """Number of expenses per label of a dictionary-encoded column"""
+        labels = getattr(self, self.LABELS[column])
+        counts = np.bincount(getattr(self, column), minlength=len(labels))
+        return {label: int(count) for label, count in zip(labels, counts) if count}
+
+    def to_dicts(self) -> List[Dict]:
+        """Back to expense dicts (amount in currency units, date as ISO string)"""
+        decoded = {column: self.labels(column) for column in CATEGORICAL_COLUMNS}
+        dates = np.datetime_as_string(self.date, unit='D')
+        return [{
+            'id': self.id[i].decode('ascii'),
+            'date': None if dates[i] == 'NaT' else str(dates[i]),
+            'provider': decoded['provider'][i],
+            'amount': int(self.amount[i]) / 100,
+            'status': decoded['status'][i],
+            'category': decoded['category'][i],
+            'currency': decoded['currency'][i]
+        } for i in range(len(self))]
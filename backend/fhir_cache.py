@@ -0,0 +1,173 @@
+"""
+Caches sitting under EpicFHIRClient.
+
+ConditionalRequestCache keeps whole FHIR responses together with their
+validators (ETag, Last-Modified, meta.versionId). Fresh entries are served
+directly; stale ones are revalidated upstream with If-None-Match /
+If-Modified-Since and reused on 304 Not Modified. Keys always include the
+caller's patient and token scope so one user's data is never served to
+another.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+
+
+class CachedResponse:
+    """One cached FHIR response body and its validators"""
+
+    __slots__ = ('body', 'size', 'etag', 'last_modified', 'version_id', 'expires_at')
+
+    def __init__(self, body: Dict, size: int, etag: Optional[str], last_modified: Optional[str],
+                 version_id: Optional[str], expires_at: float):
+        self.body = body
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.version_id = version_id
+        self.expires_at = expires_at
+
+    @property
+    def fresh(self) -> bool:
+        return time.monotonic() < self.expires_at
+
+    def validator_headers(self) -> Dict[str, str]:
+        """Conditional-request headers for revalidating this entry"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        elif self.version_id:
+            # FHIR servers derive the ETag from the version: W/"<versionId>"
+            headers['If-None-Match'] = f'W/"{self.version_id}"'
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ConditionalRequestCache:
+    """Bytes-bounded LRU of FHIR responses with per-entry TTL"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, CachedResponse]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    def lookup(self, key: Hashable) -> Optional[CachedResponse]:
+        """Return the entry for key (fresh or stale) and count the outcome"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if entry.fresh:
+                self.hits += 1
+            else:
+                self.revalidations += 1
+            return entry
+
+    def store(self, key: Hashable, body: Dict, size: int, ttl: float,
+              etag: Optional[str] = None, last_modified: Optional[str] = None):
+        """Insert or replace an entry, evicting least recently used ones to fit"""
+        if size > self.max_bytes:
+            return
+
+        meta = body.get('meta', {}) if isinstance(body, dict) else {}
+        entry = CachedResponse(body, size, etag, last_modified, meta.get('versionId'),
+                               time.monotonic() + ttl)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._entries[key] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self.evictions += 1
+
+    def mark_not_modified(self, entry: CachedResponse, ttl: float):
+        """Record a 304 for entry and extend its freshness"""
+        with self._lock:
+            self.not_modified += 1
+            entry.expires_at = time.monotonic() + ttl
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry.size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+                'not_modified': self.not_modified,
+                'evictions': self.evictions
+            }
+
+
+class ReferenceCache:
+    """Process-wide TTL cache of shared, non-patient resources
+
+    Organization and Practitioner resources are the same for every patient,
+    so a provider resolved for one member is reused for all of them.
+    Entries are keyed by (base_url, 'Type/id').
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Dict]:
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None or cached[0] <= time.monotonic():
+                if cached is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cached[1]
+
+    def put(self, key: Hashable, resource: Dict):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, resource)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -1,50 +1,692 @@
+import hashlib
 import requests
-from typing import Dict, List, Optional
-import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import deadline
+from bundle_stream import BundleStream
+from hedging import hedger
+from env_config import (FHIR_BATCH_CONFIG, FHIR_FANOUT_CONFIG, FHIR_REFERENCE_CONFIG,
+                        FHIR_RESOURCE_STORE_CONFIG, FHIR_RESPONSE_CACHE_CONFIG, FHIR_SEARCH_CONFIG,
+                        FHIR_SINGLEFLIGHT_CONFIG, FHIR_SYNC_CONFIG)
+from fhir_cache import ConditionalRequestCache, ReferenceCache
+from fhir_sync import IncrementalSyncStore
+from http_pool import get_session
+from json_codec import dumps, loads
+from resilience import CircuitOpenError, call_with_retries
+from resource_store import ResourceStore
+from singleflight import reads
+
+# Process-wide conditional-request cache under _make_request
+_response_cache = ConditionalRequestCache(FHIR_RESPONSE_CACHE_CONFIG['max_bytes'])
+
+# Organization/Practitioner resources, shared across patients
+_reference_cache = ReferenceCache(FHIR_REFERENCE_CONFIG['ttl'], FHIR_REFERENCE_CONFIG['max_entries'])
+
+# Per-patient EOB/Claim sets kept current with _lastUpdated deltas
+_sync_store = IncrementalSyncStore(FHIR_SYNC_CONFIG['max_states'], FHIR_SYNC_CONFIG['max_resources'],
+                                   FHIR_SYNC_CONFIG['max_resources_per_state'])
+
+# Individual resources by (scope, type, id): memory LRU over a SQLite file
+# shared by the workers on this host, so restarts start warm
+_resource_store = ResourceStore(
+    FHIR_RESOURCE_STORE_CONFIG['path'],
+    FHIR_RESOURCE_STORE_CONFIG['ttl_by_type'],
+    FHIR_RESOURCE_STORE_CONFIG['default_ttl'],
+    FHIR_RESOURCE_STORE_CONFIG['memory_max_entries'],
+    FHIR_RESOURCE_STORE_CONFIG['memory_max_bytes'],
+    FHIR_RESOURCE_STORE_CONFIG['disk_max_entries'],
+    FHIR_RESOURCE_STORE_CONFIG['disk_max_bytes'],
+    FHIR_RESOURCE_STORE_CONFIG['prune_every']
+)
+
+# Shared by every client; fetches page N+1 of a search while page N is consumed
+_prefetch_executor = ThreadPoolExecutor(
+    max_workers=FHIR_SEARCH_CONFIG['prefetch_workers'],
+    thread_name_prefix='fhir-prefetch'
+)
+
+# Runs independent reads of one request side by side. Kept apart from the
+# prefetch pool because these tasks block on prefetches themselves.
+_fanout_executor = ThreadPoolExecutor(
+    max_workers=FHIR_FANOUT_CONFIG['workers'],
+    thread_name_prefix='fhir-fanout'
+)
+
+# Failures worth retrying for idempotent requests; anything else is final
+_TRANSIENT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+# base_url -> (expires_at, supports_batch); CapabilityStatements rarely change
+_batch_support: Dict[str, Tuple[float, bool]] = {}
+_batch_support_lock = threading.Lock()
+
+def _next_link(bundle: Dict) -> Optional[str]:
+    """Return the Bundle's link[rel=next] url, if any"""
+    for link in bundle.get('link', []):
+        if link.get('relation') == 'next' and link.get('url'):
+            return link['url']
+    return None
+
+def _search_params(params: Optional[Dict], count: Optional[int]) -> Dict:
+    """Copy search params, applying the configured _count page size"""
+    count = FHIR_SEARCH_CONFIG['page_size'] if count is None else count
+    params = dict(params or {})
+    if count:
+        params.setdefault('_count', count)
+    return params
+
+def _patient_params(resource_type: str, patient_id: str, elements: Optional[List[str]] = None) -> Dict:
+    """Search params for a patient's resources, optionally projected with _elements
+
+    Configured _include parameters (e.g. ExplanationOfBenefit:provider) are
+    added so referenced providers arrive in the same Bundle.
+    """
+    params = {'patient': patient_id}
+    if FHIR_REFERENCE_CONFIG['include_enabled'] and FHIR_REFERENCE_CONFIG['includes'].get(resource_type):
+        params['_include'] = list(FHIR_REFERENCE_CONFIG['includes'][resource_type])
+    if elements:
+        # meta is always kept: versionId/lastUpdated drive caching and sync
+        params['_elements'] = ','.join(dict.fromkeys(list(elements) + ['meta']))
+    return params
+
+def _entry_error(entry: Dict) -> Optional[str]:
+    """Return an error message for a non-2xx batch-response entry"""
+    status = entry.get('response', {}).get('status', '')
+    if status[:1] == '2':
+        return None
+    outcome = entry.get('response', {}).get('outcome') or entry.get('resource') or {}
+    details = [issue.get('diagnostics') or issue.get('details', {}).get('text', '')
+               for issue in outcome.get('issue', [])]
+    message = '; '.join(d for d in details if d)
+    return f"{status or 'no status'}{': ' + message if message else ''}"
+
+def _search_incomplete(resource_type: str, errors: Iterable[str]) -> List[str]:
+    """Why a search returned less than its full result, from its `errors` sink (safe to show callers)"""
+    return [f"{resource_type} search {error}" if error.startswith('truncated at ')
+            else f"{resource_type} search stopped by a failed request" for error in errors]
+
+def _eob_data(eobs: List[Dict], claims: List[Dict], eob_errors: Iterable[str] = (),
+              claim_errors: Iterable[str] = (), quiet: bool = False) -> Dict:
+    """Build the get_eob_data() result, preferring EOBs over Claims
+
+    'incomplete' lists why the data may be cut short (see _search_incomplete);
+    it is empty when every search used ran to completion. `quiet` skips the
+    progress line (the async client runs many of these concurrently).
+    """
+    incomplete = _search_incomplete('ExplanationOfBenefit', eob_errors)
+    if eobs:
+        result = {'source': 'ExplanationOfBenefit', 'data': eobs, 'count': len(eobs), 'incomplete': incomplete}
+        message = f"✅ Successfully fetched {len(eobs)} EOB records"
+    else:
+        incomplete += _search_incomplete('Claim', claim_errors)
+        if claims:
+            result = {'source': 'Claim', 'data': claims, 'count': len(claims), 'incomplete': incomplete}
+            message = f"✅ Successfully fetched {len(claims)} Claim records"
+        else:
+            result = {'source': 'none', 'data': [], 'count': 0, 'incomplete': incomplete}
+            message = "❌ No EOB or Claim data found"
+    if not quiet:
+        print(message)
+    return result
+
+def _same_origin(url: str, base_url: str) -> bool:
+    a, b = urlsplit(url), urlsplit(base_url)
+    return (a.scheme, a.netloc) == (b.scheme, b.netloc)
+
+def _cache_ttl(resource_type: str, response: requests.Response) -> float:
+    """Freshness lifetime for a response: Cache-Control first, then per-type config"""
+    cache_control = response.headers.get('Cache-Control', '').lower()
+    if 'no-store' in cache_control:
+        return 0
+    for directive in cache_control.split(','):
+        name, _, value = directive.strip().partition('=')
+        if name == 'max-age' and value.isdigit():
+            return float(value)
+    config = FHIR_RESPONSE_CACHE_CONFIG
+    return config['ttl_by_type'].get(resource_type, config['default_ttl'])
+
+def get_cache_stats() -> Dict:
+    """Counters for the client-side caches"""
+    return {
+        'response_cache': _response_cache.stats(),
+        'reference_cache': _reference_cache.stats(),
+        'incremental_sync': _sync_store.stats(),
+        'resource_store': _resource_store.stats() if FHIR_RESOURCE_STORE_CONFIG['enabled'] else {}
+    }
 
 class EpicFHIRClient:
-    def __init__(self, base_url: str, access_token: str):
+    def __init__(self, base_url: str, access_token: str,
+                 patient_id: Optional[str] = None, scope: Optional[str] = None):
         self.base_url = base_url
+        # Connections live in the process-wide pool for this origin; the
+        # client itself only carries the bearer token.
+        self.session = get_session(base_url)
         self.headers = {
             'Authorization': f'Bearer {access_token}',
             'Accept': 'application/fhir+json',
             'Content-Type': 'application/fhir+json'
         }
+        self.token_id = hashlib.sha256(access_token.encode()).hexdigest()
+        # Partition for shared caches: the patient in context plus what the
+        # token may read. Without a patient, fall back to the token itself.
+        if patient_id:
+            self.cache_scope = ('patient', patient_id, scope or '')
+        else:
+            self.cache_scope = ('token', self.token_id)
+    
+    def _resource_type(self, url: str) -> str:
+        """Resource type addressed by a URL under base_url"""
+        path = urlsplit(url).path
+        base_path = urlsplit(self.base_url).path.rstrip('/')
+        if path.startswith(base_path):
+            path = path[len(base_path):]
+        return path.strip('/').split('/')[0]
+    
+    def _store_scope(self, resource_type: str) -> str:
+        """Resource store partition: shared types per server, the rest per cache scope"""
+        if resource_type in FHIR_REFERENCE_CONFIG['shared_types']:
+            return f"{self.base_url}|*"
+        return '|'.join((self.base_url,) + self.cache_scope)
+    
+    def _stored_resource(self, url: str) -> Optional[Dict]:
+        """Serve a plain read ('Type/id') from the resource store"""
+        if not FHIR_RESOURCE_STORE_CONFIG['enabled']:
+            return None
+        path = urlsplit(url).path[len(urlsplit(self.base_url).path):].strip('/').split('/')
+        if len(path) != 2:
+            return None
+        return _resource_store.get(self._store_scope(path[0]), path[0], path[1])
+    
+    def _store_resources(self, body: Dict, params: Optional[Dict] = None):
+        """Write a read result or a search page's resources to the resource store
+        
+        Projected (_elements/_summary) results are partial resources and are
+        never stored.
+        """
+        if not FHIR_RESOURCE_STORE_CONFIG['enabled'] or not isinstance(body, dict) or 'error' in body:
+            return
+        params = params or {}
+        if '_elements' in params or '_summary' in params:
+            return
+        if body.get('resourceType') != 'Bundle':
+            patient = body['id'] if body.get('resourceType') == 'Patient' else None
+            _resource_store.put(self._store_scope(body.get('resourceType')), body, patient)
+            return
+        
+        by_scope: Dict[str, List[Dict]] = {}
+        for entry in body.get('entry', []):
+            resource = entry.get('resource')
+            if resource and resource.get('resourceType'):
+                by_scope.setdefault(self._store_scope(resource['resourceType']), []).append(resource)
+        for scope, resources in by_scope.items():
+            _resource_store.put_many(scope, resources, params.get('patient'))
     
     def _make_request(self, url: str, params: Optional[Dict] = None) -> Dict:
-        """Make HTTP request to FHIR endpoint"""
+        """Make HTTP request to FHIR endpoint
+        
+        Responses are kept in the conditional-request cache: fresh entries
+        are returned without a round trip, stale ones are revalidated and
+        reused when the server answers 304 Not Modified. Identical reads
+        already in flight for the same token share one upstream call. When
+        this request's deadline runs out before the result arrives, a stale
+        entry is served instead.
+        """
+        query = urlencode(sorted((params or {}).items()), doseq=True)
+        cache_key = None
+        cached = None
+        if FHIR_RESPONSE_CACHE_CONFIG['enabled']:
+            cache_key = (self.cache_scope, url, query)
+            cached = _response_cache.lookup(cache_key)
+            if cached is not None and cached.fresh:
+                return cached.body
+        
+        if not params:
+            stored = self._stored_resource(url)
+            if stored is not None:
+                return stored
+        
+        try:
+            if not FHIR_SINGLEFLIGHT_CONFIG['enabled']:
+                return self._fetch(url, params, cache_key, cached)
+            return reads.do((self.token_id, url, query), lambda: self._fetch(url, params, cache_key, cached),
+                            timeout=deadline.remaining())
+        except TimeoutError:
+            # Our fetch, or our wait for another caller's, ran out of budget
+            deadline.note_exceeded()
+            return self._out_of_time(url, cached)
+    
+    def _out_of_time(self, url: str, cached) -> Dict:
+        """Result of a read the deadline cut short: the stale cached copy if there is one"""
+        if cached is not None:
+            print(f"⏱️ Deadline reached, serving stale {url}")
+            return cached.body
+        return {'error': f'request deadline exceeded for {url}'}
+    
+    def _fetch(self, url: str, params: Optional[Dict], cache_key, cached) -> Dict:
+        """Upstream half of _make_request: (re)validate, decode and cache
+
+        Raises DeadlineExceeded when the request deadline cuts it short.
+        """
+        headers = self.headers
+        if cached is not None:
+            headers = {**self.headers, **cached.validator_headers()}
+        
+        host, resource_type = urlsplit(url).netloc, self._resource_type(url)
+        try:
+            response = call_with_retries(
+                host, resource_type,
+                lambda timeout: hedger.call(
+                    host, resource_type,
+                    lambda t: self.session.get(url, headers=headers, params=params, timeout=t), timeout
+                ),
+                transient_errors=_TRANSIENT_ERRORS
+            )
+            if response.status_code == 304 and cached is not None:
+                _response_cache.mark_not_modified(cached, _cache_ttl(resource_type, response))
+                return cached.body
+            response.raise_for_status()
+            body = loads(response.content)
+        except (requests.exceptions.RequestException, CircuitOpenError, ValueError) as e:
+            print(f"FHIR API request failed: {e}")
+            return {'error': str(e)}
+        
+        # Next links carry their search params in the URL itself
+        self._store_resources(body, params or dict(parse_qsl(urlsplit(url).query)))
+        if cache_key is not None:
+            ttl = _cache_ttl(resource_type, response)
+            if ttl > 0:
+                _response_cache.store(
+                    cache_key, body, len(response.content), ttl,
+                    etag=response.headers.get('ETag'),
+                    last_modified=response.headers.get('Last-Modified')
+                )
+        return body
+    
+    def _stream_request(self, url: str, params: Optional[Dict] = None) -> Union[BundleStream, Dict]:
+        """GET a searchset Bundle and parse it incrementally as it arrives
+        
+        Returns a BundleStream (see bundle_stream) or {'error': ...} when
+        the request itself fails. Streamed pages bypass the response cache,
+        which needs the whole body; iter_bundle writes their resources to
+        the resource store as they are read.
+        """
+        host, resource_type = urlsplit(url).netloc, self._resource_type(url)
         try:
-            response = requests.get(url, headers=self.headers, params=params, timeout=30)
+            response = call_with_retries(
+                host, resource_type,
+                lambda timeout: hedger.call(
+                    host, resource_type,
+                    lambda t: self.session.get(url, headers=self.headers, params=params, timeout=t, stream=True),
+                    timeout
+                ),
+                transient_errors=_TRANSIENT_ERRORS
+            )
             response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, CircuitOpenError, deadline.DeadlineExceeded) as e:
             print(f"FHIR API request failed: {e}")
             return {'error': str(e)}
+        
+        return BundleStream(
+            response.iter_content(FHIR_SEARCH_CONFIG['stream_chunk_size']),
+            close=response.close,
+            transport_errors=(requests.exceptions.RequestException,),
+            # Next links carry their search params in the URL itself
+            params=params or dict(parse_qsl(urlsplit(url).query))
+        )
+    
+    def _post_request(self, url: str, body: Dict) -> Dict:
+        """POST a FHIR resource (e.g. a batch Bundle) and return the response body
+        
+        Only batch Bundles of reads are posted, so the call is retried like a GET.
+        """
+        data = dumps(body)
+        try:
+            response = call_with_retries(
+                urlsplit(url).netloc, body.get('type', self._resource_type(url)),
+                lambda timeout: self.session.post(url, headers=self.headers, data=data, timeout=timeout),
+                idempotent=body.get('type') == 'batch',
+                transient_errors=_TRANSIENT_ERRORS
+            )
+            response.raise_for_status()
+            return loads(response.content)
+        except (requests.exceptions.RequestException, CircuitOpenError, ValueError, deadline.DeadlineExceeded) as e:
+            print(f"FHIR API request failed: {e}")
+            return {'error': str(e)}
+    
+    def supports_batch(self) -> bool:
+        """Whether the server's CapabilityStatement advertises the batch interaction"""
+        now = time.monotonic()
+        cached = _batch_support.get(self.base_url)
+        if cached and cached[0] > now:
+            return cached[1]
+        
+        capability = self._make_request(f"{self.base_url}/metadata")
+        if 'error' in capability:
+            # Unknown: use individual reads for now and ask again shortly
+            supported, ttl = False, FHIR_BATCH_CONFIG['capability_retry']
+        else:
+            supported = any(
+                interaction.get('code') == 'batch'
+                for rest in capability.get('rest', [])
+                for interaction in rest.get('interaction', [])
+            )
+            ttl = FHIR_BATCH_CONFIG['capability_ttl']
+            print(f"📋 FHIR server batch support: {supported}")
+        
+        with _batch_support_lock:
+            _batch_support[self.base_url] = (now + ttl, supported)
+        return supported
+    
+    def batch(self, request_specs: List[Union[str, Dict]]) -> List[Union[Dict, List[Dict]]]:
+        """Run several reads/searches in one FHIR batch Bundle round trip
+
+        Each request is either a relative URL ('Patient/123') or a dict
+        {'url': 'ExplanationOfBenefit', 'params': {'patient': '123'}}. A URL
+        naming an instance ('Type/id') is a read and yields that resource;
+        anything else is a search and yields its list of resources, with
+        further pages followed as in iter_search. Failed entries yield
+        {'error': ...}. A search spec may carry 'errors' and 'included'
+        sinks, filled as in iter_search. Results
+        are in request order. When the server does not advertise batch, the
+        requests are sent as concurrent GETs.
+        """
+        specs = []
+        for spec in request_specs:
+            if isinstance(spec, str):
+                spec = {'url': spec}
+            url, _, query = spec['url'].strip('/').partition('?')
+            is_read = '/' in url
+            params = None
+            if not is_read:
+                params = _search_params({**dict(parse_qsl(query)), **spec.get('params', {})}, spec.get('count'))
+            specs.append((url, params, is_read, spec))
+        
+        if not specs:
+            return []
+        if not (FHIR_BATCH_CONFIG['enabled'] and self.supports_batch()):
+            futures = [
+                deadline.submit(_fanout_executor, self._make_request, f"{self.base_url}/{url}")
+                if is_read else
+                deadline.submit(_fanout_executor, lambda u=url, p=params, o=spec: list(self.iter_search(
+                    u, p, errors=o.get('errors'), included=o.get('included'))))
+                for url, params, is_read, spec in specs
+            ]
+            return [future.result() for future in futures]
+        
+        # Reads the resource store can answer don't need to go upstream
+        results: List[Union[Dict, List[Dict]]] = [None] * len(specs)
+        for index, (url, _, is_read, _) in enumerate(specs):
+            if is_read:
+                results[index] = self._stored_resource(f"{self.base_url}/{url}")
+        upstream = [index for index, result in enumerate(results) if result is None]
+        if not upstream:
+            return results
+        
+        bundle = {
+            'resourceType': 'Bundle',
+            'type': 'batch',
+            'entry': [
+                {'request': {'method': 'GET', 'url': f"{url}?{urlencode(params, doseq=True)}" if params else url}}
+                for url, params, _, _ in (specs[index] for index in upstream)
+            ]
+        }
+        response = self._post_request(self.base_url, bundle)
+        if 'error' in response:
+            return [{'error': response['error']} if result is None else result for result in results]
+        
+        entries = response.get('entry', [])
+        if len(entries) != len(upstream):
+            message = f"batch response has {len(entries)} entries for {len(upstream)} requests"
+            print(f"❌ {message}")
+            return [{'error': message} if result is None else result for result in results]
+        
+        for index, entry in zip(upstream, entries):
+            url, params, is_read, spec = specs[index]
+            error = _entry_error(entry)
+            if error:
+                print(f"❌ Batch entry {url} failed: {error}")
+                results[index] = {'error': error}
+                continue
+            self._store_resources(entry.get('resource', {}), params)
+            if is_read:
+                results[index] = entry.get('resource', {})
+            else:
+                results[index] = list(self.iter_bundle(entry.get('resource', {}), url, errors=spec.get('errors'),
+                                                       included=spec.get('included')))
+        return results
     
     def get_patient(self, patient_id: str) -> Dict:
         """Get patient demographics"""
         url = f"{self.base_url}/Patient/{patient_id}"
         return self._make_request(url)
     
-    def get_explanation_of_benefits(self, patient_id: str) -> List[Dict]:
-        """Get EOB resources for patient"""
-        url = f"{self.base_url}/ExplanationOfBenefit"
-        params = {'patient': patient_id}
-        response = self._make_request(url, params)
+    def get_resource(self, resource_type: str, resource_id: str) -> Dict:
+        """Read one resource, from the resource store or response cache when possible"""
+        return self._make_request(f"{self.base_url}/{resource_type}/{resource_id}")
+    
+    def iter_search(self, resource_type: str, params: Optional[Dict] = None,
+                    count: Optional[int] = None, max_pages: Optional[int] = None,
+                    max_resources: Optional[int] = None, prefetch: Optional[bool] = None,
+                    errors: Optional[List[str]] = None,
+                    included: Optional[Dict[str, Dict]] = None,
+                    stream: Optional[bool] = None) -> Iterator[Dict]:
+        """Lazily yield every resource of a search, following link[rel=next]
+
+        Pages are only requested as the caller consumes resources. With
+        `prefetch`, the next page is fetched in the background while the
+        current one is being yielded. `count` sets `_count`; `max_pages` and
+        `max_resources` bound the walk (0 means unbounded). Defaults come
+        from FHIR_SEARCH_CONFIG. Pass an `errors` list to learn whether the
+        walk was cut short by a failed page or a budget. Resources pulled in
+        by _include are not yielded; they go to the `included` dict (keyed
+        'Type/id') and, for shared types, to the process-wide reference cache.
+        With `stream`, pages are parsed incrementally so only one entry at a
+        time is held in memory (see bundle_stream).
+        """
+        stream = FHIR_SEARCH_CONFIG['stream'] if stream is None else stream
+        fetch = self._stream_request if stream else self._make_request
+        page = fetch(f"{self.base_url}/{resource_type}", _search_params(params, count))
+        yield from self.iter_bundle(page, resource_type, max_pages, max_resources, prefetch, errors, included, stream)
+    
+    def iter_bundle(self, page: Dict, resource_type: str, max_pages: Optional[int] = None,
+                    max_resources: Optional[int] = None, prefetch: Optional[bool] = None,
+                    errors: Optional[List[str]] = None,
+                    included: Optional[Dict[str, Dict]] = None,
+                    stream: Optional[bool] = None) -> Iterator[Dict]:
+        """Yield the resources of an already-fetched searchset page and its successors"""
+        config = FHIR_SEARCH_CONFIG
+        max_pages = config['max_pages'] if max_pages is None else max_pages
+        max_resources = config['max_resources'] if max_resources is None else max_resources
+        prefetch = config['prefetch'] if prefetch is None else prefetch
+        stream = config['stream'] if stream is None else stream
+        fetch = self._stream_request if stream else self._make_request
+        
+        pages_read = 0
+        yielded = 0
+        pending: Optional[Future] = None
+        errors = [] if errors is None else errors
+        # Entries of the current streamed page not yet in the resource store
+        unstored: List[Dict] = []
+        
+        def store(page):
+            if unstored:
+                self._store_resources({'resourceType': 'Bundle', 'entry': unstored}, page.params)
+                unstored.clear()
+        
+        try:
+            while True:
+                if 'error' in page:
+                    print(f"❌ {resource_type} search stopped after {pages_read} page(s): {page['error']}")
+                    errors.append(page['error'])
+                    return
+                pages_read += 1
+                
+                # A streamed page only knows its links once they have been
+                # parsed; if they come after the entries, look at them then.
+                streamed = isinstance(page, BundleStream)
+                store_streamed = streamed and FHIR_RESOURCE_STORE_CONFIG['enabled']
+                links_known = not streamed or page.get('link') is not None
+                next_url = self._follow_link(page, resource_type, pages_read, max_pages, errors) if links_known else None
+                if next_url and prefetch:
+                    pending = deadline.submit(_prefetch_executor, fetch, next_url)
+                
+                for entry in page.get('entry', []):
+                    if 'resource' not in entry:
+                        continue
+                    if store_streamed:
+                        # Streamed pages never pass through _fetch; store them in batches as they go by
+                        unstored.append(entry)
+                        if len(unstored) >= FHIR_RESOURCE_STORE_CONFIG['stream_batch']:
+                            store(page)
+                    if entry.get('search', {}).get('mode') == 'include':
+                        self._remember_reference(entry['resource'], included)
+                        continue
+                    if max_resources and yielded >= max_resources:
+                        print(f"⚠️ {resource_type} search truncated at max_resources={max_resources}")
+                        errors.append(f"truncated at max_resources={max_resources}")
+                        return
+                    yield entry['resource']
+                    yielded += 1
+                
+                if store_streamed:
+                    store(page)
+                if streamed and page.error:
+                    print(f"❌ {resource_type} search stopped in page {pages_read}: {page.error}")
+                    errors.append(page.error)
+                    return
+                if not links_known:
+                    next_url = self._follow_link(page, resource_type, pages_read, max_pages, errors)
+                if not next_url:
+                    return
+                
+                # Drop our reference to the consumed page before fetching the next
+                page = None
+                if pending is not None:
+                    page, pending = pending.result(), None
+                else:
+                    page = fetch(next_url)
+        finally:
+            if isinstance(page, BundleStream):
+                # Cut short (truncated, failed or abandoned by the consumer)
+                store(page)
+                page.close()
+            if pending is not None and not pending.cancel():
+                # Already fetched: release a streamed page's connection
+                prefetched = pending.result()
+                if isinstance(prefetched, BundleStream):
+                    prefetched.close()
+    
+    def _follow_link(self, page, resource_type: str, pages_read: int, max_pages: int,
+                     errors: List[str]) -> Optional[str]:
+        """The page's next link, unless it leaves our origin or the page budget"""
+        next_url = _next_link(page)
+        if next_url and not _same_origin(next_url, self.base_url):
+            # Never send the bearer token to a host we were not configured for
+            print(f"⚠️ Ignoring cross-origin next link for {resource_type}: {next_url}")
+            return None
+        if next_url and max_pages and pages_read >= max_pages:
+            print(f"⚠️ {resource_type} search truncated at max_pages={max_pages}")
+            errors.append(f"truncated at max_pages={max_pages}")
+            return None
+        return next_url
+    
+    def sync_resources(self, resource_type: str, patient_id: str,
+                       elements: Optional[List[str]] = None,
+                       errors: Optional[List[str]] = None) -> List[Dict]:
+        """Return all of a patient's resources of one type, fetching only the delta
+
+        The first call pulls the full history; later calls search with
+        _lastUpdated=ge<high-water mark> and merge the changes into the
+        locally held set (see fhir_sync). Projected (`elements`) and full
+        resources are held separately. `errors` is filled as in iter_search.
+        """
+        spec, finish = self._search_plan(resource_type, patient_id, elements, errors)
+        resources = self.iter_search(resource_type, spec['params'], errors=spec['errors'],
+                                     included=spec['included'])
+        return finish(resources)
+    
+    def _search_plan(self, resource_type: str, patient_id: str,
+                     elements: Optional[List[str]] = None, errors: Optional[List[str]] = None):
+        """Patient search spec plus a function folding its result in
+
+        With incremental sync enabled the spec only asks for the delta and
+        the result is merged into the held set; otherwise it is passed
+        through. The spec can be sent on its own or as a batch entry. Its
+        'errors' list (`errors`, when given) says whether the result was cut short.
+        """
+        errors = [] if errors is None else errors
+        
+        def failed(result: Dict) -> List[Dict]:
+            # A failed batch entry never reached iter_bundle
+            errors.append(result.get('error', 'search failed'))
+            return []
         
-        if 'entry' in response:
-            return [entry['resource'] for entry in response['entry']]
-        return []
+        if not FHIR_SYNC_CONFIG['enabled']:
+            spec = {'url': resource_type, 'params': _patient_params(resource_type, patient_id, elements),
+                    'errors': errors, 'included': {}}
+            return spec, lambda result: list(result) if not isinstance(result, dict) else failed(result)
+        
+        key = (self.cache_scope, patient_id, resource_type, tuple(elements) if elements else None)
+        state = _sync_store.state(key)
+        persist = FHIR_RESOURCE_STORE_CONFIG['enabled']
+        store_scope = self._store_scope(resource_type)
+        if elements:
+            # Projected resources are partial; they and their mark get a scope of their own
+            store_scope = f"{store_scope}|_elements={','.join(elements)}"
+        if persist and state.watermark is None:
+            # Resume from a sync another (or a previous) worker completed
+            mark = _resource_store.load_sync_mark(store_scope, patient_id, resource_type)
+            if mark is not None:
+                watermark, full_synced_at, resources = mark
+                state.seed(resources, watermark, time.time() - full_synced_at)
+        full = state.needs_full_sync(FHIR_SYNC_CONFIG['full_resync_interval'])
+        params = {**_patient_params(resource_type, patient_id, elements), **state.search_params(patient_id, full)}
+        spec = {'url': resource_type, 'params': params, 'errors': errors, 'included': {}}
+        
+        def finish(result):
+            # Drain lazy results first so `errors` is final before judging completeness
+            resources = failed(result) if isinstance(result, dict) else list(result)
+            complete = not errors
+            merged = state.merge(resources, complete=complete, full=full)
+            if persist and complete and state.watermark and (full or resources):
+                if elements:
+                    # Full resources were stored as their pages arrived (see _store_resources)
+                    _resource_store.put_many(store_scope, resources, patient_id)
+                full_synced_at = time.time() - (time.monotonic() - state.last_full_sync)
+                _resource_store.save_sync_mark(store_scope, patient_id, resource_type, state.watermark,
+                                               full_synced_at, [resource['id'] for resource in merged])
+            print(f"🔄 {resource_type} {'full' if full else 'incremental'} sync: {len(merged)} held for patient {patient_id}")
+            return merged
+        return spec, finish
+    
+    def get_explanation_of_benefits(self, patient_id: str, elements: Optional[List[str]] = None,
+                                    errors: Optional[List[str]] = None) -> List[Dict]:
+        """Get EOB resources for patient (all pages, optionally projected to `elements`)
+
+        Pass an `errors` list to learn whether the result was cut short (see iter_search).
+        """
+        if FHIR_SYNC_CONFIG['enabled']:
+            return self.sync_resources('ExplanationOfBenefit', patient_id, elements, errors)
+        return list(self.iter_search('ExplanationOfBenefit', _patient_params('ExplanationOfBenefit', patient_id, elements),
+                                     errors=errors))
+    
+    def iter_explanation_of_benefits(self, patient_id: str, **search_options) -> Iterator[Dict]:
+        """Stream EOB resources for patient page by page"""
+        return self.iter_search('ExplanationOfBenefit', {'patient': patient_id}, **search_options)
     
-    def get_claims(self, patient_id: str) -> List[Dict]:
+    def get_claims(self, patient_id: str, elements: Optional[List[str]] = None,
+                   errors: Optional[List[str]] = None) -> List[Dict]:
         """Get Claim resources for patient (fallback for EOB)"""
-        url = f"{self.base_url}/Claim"
-        params = {'patient': patient_id}
-        response = self._make_request(url, params)
-        
-        if 'entry' in response:
-            return [entry['resource'] for entry in response['entry']]
-        return []
+        if FHIR_SYNC_CONFIG['enabled']:
+            return self.sync_resources('Claim', patient_id, elements, errors)
+        return list(self.iter_search('Claim', _patient_params('Claim', patient_id, elements), errors=errors))
+    
+    def iter_claims(self, patient_id: str, **search_options) -> Iterator[Dict]:
+        """Stream Claim resources for patient page by page"""
+        return self.iter_search('Claim', {'patient': patient_id}, **search_options)
     
     def get_eob_data(self, patient_id: str) -> Dict:
         """Get EOB data with fallback strategy"""
@@ -52,100 +694,177 @@ class EpicFHIRClient:
         
         # Try ExplanationOfBenefit first (primary)
         print("📊 Trying ExplanationOfBenefit API...")
-        eobs = self.get_explanation_of_benefits(patient_id)
-        
-        if eobs and len(eobs) > 0:
-            print(f"✅ Successfully fetched {len(eobs)} EOB records")
-            return {
-                'source': 'ExplanationOfBenefit',
-                'data': eobs,
-                'count': len(eobs)
-            }
-        
-        # Fallback to Claim API
-        print("📊 ExplanationOfBenefit empty, trying Claim API...")
-        claims = self.get_claims(patient_id)
-        
-        if claims and len(claims) > 0:
-            print(f"✅ Successfully fetched {len(claims)} Claim records")
-            return {
-                'source': 'Claim',
-                'data': claims,
-                'count': len(claims)
-            }
-        
-        print("❌ No EOB or Claim data found")
+        eob_errors: List[str] = []
+        eobs = self.get_explanation_of_benefits(patient_id, errors=eob_errors)
+        claims: List[Dict] = []
+        claim_errors: List[str] = []
+        
+        if not eobs:
+            # Fallback to Claim API
+            print("📊 ExplanationOfBenefit empty, trying Claim API...")
+            claims = self.get_claims(patient_id, errors=claim_errors)
+        
+        eob_data = _eob_data(eobs, claims, eob_errors, claim_errors)
+        if eob_data['count']:
+            self._with_references(eob_data)
+        return eob_data
+    
+    def get_patient_and_eob_data(self, patient_id: str,
+                                 claim_hedge_delay: Optional[float] = None,
+                                 elements: Optional[Dict[str, List[str]]] = None) -> Tuple[Dict, Dict]:
+        """Fetch Patient and EOB data together, keeping EOB-first precedence
+
+        When the server supports batch, Patient, ExplanationOfBenefit and
+        Claim go out as one batch Bundle. Otherwise Patient and EOB are
+        requested concurrently and the Claim fallback is started after
+        `claim_hedge_delay` seconds unless the EOB search has already come
+        back non-empty; 0 starts all three together, so the worst case is
+        the slowest single call rather than the sum.
+        `elements` maps resource type to the _elements projection to request
+        (e.g. transformers.expense_elements()); omit it to get full resources.
+        Returns (patient, eob_data) with eob_data shaped like get_eob_data().
+        """
+        elements = elements or {}
+        if FHIR_BATCH_CONFIG['enabled'] and self.supports_batch():
+            print(f"🔍 Fetching patient and EOB data in one batch for patient: {patient_id}")
+            plans = [self._search_plan(resource_type, patient_id, elements.get(resource_type))
+                     for resource_type in ('ExplanationOfBenefit', 'Claim')]
+            patient, *searches = self.batch([f"Patient/{patient_id}"] + [spec for spec, _ in plans])
+            eobs, claims = [finish(result) for (_, finish), result in zip(plans, searches)]
+            errors = [spec['errors'] for spec, _ in plans]
+            return patient, self._with_references(_eob_data(eobs, claims, *errors))
+        
+        if claim_hedge_delay is None:
+            claim_hedge_delay = FHIR_FANOUT_CONFIG['claim_hedge_delay']
+        
+        print(f"🔍 Fetching patient and EOB data concurrently for patient: {patient_id}")
+        eob_errors: List[str] = []
+        claim_errors: List[str] = []
+        patient_future = deadline.submit(_fanout_executor, self.get_patient, patient_id)
+        eob_future = deadline.submit(_fanout_executor, self.get_explanation_of_benefits, patient_id,
+                                     elements.get('ExplanationOfBenefit'), eob_errors)
+        claim_future: Optional[Future] = None
+        
+        if claim_hedge_delay > 0:
+            wait([eob_future], timeout=claim_hedge_delay)
+        if claim_hedge_delay <= 0 or not eob_future.done() or not eob_future.result():
+            claim_future = deadline.submit(_fanout_executor, self.get_claims, patient_id, elements.get('Claim'),
+                                           claim_errors)
+        
+        eobs = eob_future.result()
+        if eobs and claim_future is not None:
+            # Too late to stop a running search; its result is simply dropped
+            claim_future.cancel()
+        claims = [] if eobs else claim_future.result()
+        
+        return patient_future.result(), self._with_references(_eob_data(eobs, claims, eob_errors, claim_errors))
+    
+    def get_patient_eob_and_coverage(self, patient_id: str) -> Dict:
+        """Patient, EOB data and Coverage in a single batch round trip when supported"""
+        plans = [self._search_plan(resource_type, patient_id)
+                 for resource_type in ('ExplanationOfBenefit', 'Claim')]
+        patient, *searches, coverage = self.batch(
+            [f"Patient/{patient_id}"]
+            + [spec for spec, _ in plans]
+            + [{'url': 'Coverage', 'params': {'patient': patient_id}}]
+        )
+        eobs, claims = [finish(result) for (_, finish), result in zip(plans, searches)]
+        errors = [spec['errors'] for spec, _ in plans]
         return {
-            'source': 'none',
-            'data': [],
-            'count': 0
+            'patient': patient,
+            'eob_data': self._with_references(_eob_data(eobs, claims, *errors)),
+            'coverage': coverage if isinstance(coverage, list) else []
         }
     
     def get_coverage(self, patient_id: str) -> List[Dict]:
         """Get coverage information"""
-        url = f"{self.base_url}/Coverage"
-        params = {'patient': patient_id}
-        response = self._make_request(url, params)
-        
-        if 'entry' in response:
-            return [entry['resource'] for entry in response['entry']]
-        return []
+        return list(self.iter_search('Coverage', {'patient': patient_id}))
     
     def get_observations(self, patient_id: str) -> List[Dict]:
         """Get observations (labs, vitals, etc.)"""
-        url = f"{self.base_url}/Observation"
-        params = {'patient': patient_id}
-        response = self._make_request(url, params)
-        
-        if 'entry' in response:
-            return [entry['resource'] for entry in response['entry']]
-        return []
+        return list(self.iter_search('Observation', {'patient': patient_id}))
     
     def get_procedures(self, patient_id: str) -> List[Dict]:
         """Get procedures"""
-        url = f"{self.base_url}/Procedure"
-        params = {'patient': patient_id}
-        response = self._make_request(url, params)
-        
-        if 'entry' in response:
-            return [entry['resource'] for entry in response['entry']]
-        return []
+        return list(self.iter_search('Procedure', {'patient': patient_id}))
     
     def get_medication_requests(self, patient_id: str) -> List[Dict]:
         """Get medication requests"""
-        url = f"{self.base_url}/MedicationRequest"
-        params = {'patient': patient_id}
-        response = self._make_request(url, params)
-        
-        if 'entry' in response:
-            return [entry['resource'] for entry in response['entry']]
-        return []
+        return list(self.iter_search('MedicationRequest', {'patient': patient_id}))
     
     def get_conditions(self, patient_id: str) -> List[Dict]:
         """Get conditions (diagnoses)"""
-        url = f"{self.base_url}/Condition"
-        params = {'patient': patient_id}
-        response = self._make_request(url, params)
-        
-        if 'entry' in response:
-            return [entry['resource'] for entry in response['entry']]
-        return []
+        return list(self.iter_search('Condition', {'patient': patient_id}))
     
     def get_organization(self, org_id: str) -> Dict:
         """Get organization details"""
-        url = f"{self.base_url}/Organization/{org_id}"
-        return self._make_request(url)
+        return self._get_shared(f"Organization/{org_id}")
     
     def get_practitioner(self, practitioner_id: str) -> Dict:
         """Get practitioner details"""
-        url = f"{self.base_url}/Practitioner/{practitioner_id}"
-        return self._make_request(url)
+        return self._get_shared(f"Practitioner/{practitioner_id}")
+    
+    def _get_shared(self, reference: str) -> Dict:
+        """Read a shared resource through the process-wide reference cache"""
+        cached = _reference_cache.get((self.base_url, reference))
+        if cached is not None:
+            return cached
+        resource = self._make_request(f"{self.base_url}/{reference}")
+        if 'error' not in resource:
+            self._remember_reference(resource)
+        return resource
+    
+    def _remember_reference(self, resource: Dict, included: Optional[Dict[str, Dict]] = None):
+        """Index an _include'd resource and share it process-wide if it isn't patient data"""
+        resource_type = resource.get('resourceType')
+        if not resource_type or not resource.get('id'):
+            return
+        reference = f"{resource_type}/{resource['id']}"
+        if included is not None:
+            included[reference] = resource
+        if resource_type in FHIR_REFERENCE_CONFIG['shared_types']:
+            _reference_cache.put((self.base_url, reference), resource)
+            if FHIR_RESOURCE_STORE_CONFIG['enabled']:
+                _resource_store.put(self._store_scope(resource_type), resource)
+    
+    def resolve_references(self, resources: List[Dict],
+                           fields: Tuple[str, ...] = ('provider', 'organization')) -> Dict[str, Dict]:
+        """Map 'Type/id' -> resource for the provider references in `resources`
+
+        References are served from the shared cache (filled by _include'd
+        search results). Whatever is still missing is fetched in a single
+        batch round trip, unless FHIR_RESOLVE_MISSING_REFERENCES is off.
+        """
+        references: Dict[str, Dict] = {}
+        missing = []
+        for resource in resources:
+            for field in fields:
+                reference = resource.get(field, {}).get('reference', '')
+                reference = '/'.join(reference.split('/')[-2:])
+                if reference.count('/') != 1 or reference in references or reference in missing:
+                    continue
+                if reference.split('/')[0] not in FHIR_REFERENCE_CONFIG['shared_types']:
+                    continue
+                cached = _reference_cache.get((self.base_url, reference))
+                if cached is None:
+                    cached = self._stored_resource(f"{self.base_url}/{reference}")
+                if cached is not None:
+                    references[reference] = cached
+                else:
+                    missing.append(reference)
+        
+        if missing and FHIR_REFERENCE_CONFIG['resolve_missing']:
+            print(f"🔗 Resolving {len(missing)} uncached provider reference(s)")
+            for reference, resource in zip(missing, self.batch(missing)):
+                if 'error' not in resource:
+                    self._remember_reference(resource)
+                    references[reference] = resource
+        return references
+    
+    def _with_references(self, eob_data: Dict) -> Dict:
+        eob_data['references'] = self.resolve_references(eob_data['data'])
+        return eob_data
     
     def search_patients(self, search_params: Dict) -> List[Dict]:
         """Search for patients"""
-        url = f"{self.base_url}/Patient"
-        response = self._make_request(url, search_params)
-        
-        if 'entry' in response:
-            return [entry['resource'] for entry in response['entry']]
-        return []
+        return list(self.iter_search('Patient', search_params))
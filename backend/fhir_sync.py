@@ -0,0 +1,212 @@
+"""
+Incremental FHIR search sync using _lastUpdated high-water marks.
+
+For every (cache scope, patient, resource type) we keep the resources seen so
+far, keyed by id, and the newest meta.lastUpdated among them. Later syncs only
+ask the server for `_lastUpdated=ge<watermark>` and merge the delta in by id
+and meta.versionId, so steady-state refreshes move only what changed. The
+search is inclusive because lastUpdated is not unique: a resource written in
+the same instant as the watermark, but after our last search, would never
+match `gt`. The versions at the watermark that we already hold come back
+each time and are skipped by the merge.
+
+Searchset Bundles never report hard deletes, so a full pull is forced every
+`full_resync_interval` seconds and replaces the local set wholesale.
+
+Memory is bounded three ways: the number of states (least recently used go
+first), the resources one state may hold, and the resources held by all
+states together. A state over its own cap is emptied, and one evicted to
+bring the total down is dropped; either way the patient's next sync is a
+full pull.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Hashable, Iterable, List, Optional
+
+# Resources in this status are withdrawn and must disappear from the local set
+WITHDRAWN_STATUSES = {'entered-in-error'}
+
+
+def _parse_instant(value: str) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        return None
+
+
+def _newer_version(candidate: Dict, current: Dict) -> bool:
+    """Whether candidate is a later version of current
+
+    Compares meta.versionId, else meta.lastUpdated; when neither is known
+    on both, the candidate counts as newer.
+    """
+    new_meta = candidate.get('meta', {})
+    old_meta = current.get('meta', {})
+    new = new_meta.get('versionId')
+    old = old_meta.get('versionId')
+    if new is not None and old is not None:
+        if new.isdigit() and old.isdigit():
+            return int(new) > int(old)
+        return new != old
+    new = _parse_instant(new_meta.get('lastUpdated'))
+    old = _parse_instant(old_meta.get('lastUpdated'))
+    if new is None or old is None:
+        return True
+    return new > old
+
+
+class ResourceSyncState:
+    """Locally held copy of one patient's resources of one type"""
+
+    def __init__(self, max_resources: int = 0, resized: Optional[Callable[['ResourceSyncState', int], None]] = None):
+        self.lock = threading.Lock()
+        self.resources: Dict[str, Dict] = {}
+        self.watermark: Optional[str] = None
+        self.last_full_sync = 0.0
+        self.syncs = 0
+        self.delta_resources = 0
+        self.overflows = 0
+        self.max_resources = max_resources
+        self._resized = resized
+
+    def _hold(self, resources: Dict[str, Dict]):
+        """Replace the held set (lock held), dropping it when it is over the cap"""
+        before = len(self.resources)
+        if self.max_resources and len(resources) > self.max_resources:
+            print(f"⚠️ Sync state over {self.max_resources} resources; the next sync is a full pull")
+            resources = {}
+            self.watermark = None
+            self.last_full_sync = 0.0
+            self.overflows += 1
+        self.resources = resources
+        if self._resized is not None:
+            self._resized(self, len(resources) - before)
+
+    def needs_full_sync(self, full_resync_interval: float) -> bool:
+        if self.watermark is None:
+            return True
+        return full_resync_interval > 0 and time.monotonic() - self.last_full_sync > full_resync_interval
+
+    def search_params(self, patient_id: str, full: bool) -> Dict:
+        params = {'patient': patient_id}
+        if not full:
+            params['_lastUpdated'] = f"ge{self.watermark}"
+        return params
+
+    def seed(self, resources: Iterable[Dict], watermark: str, full_sync_age: float):
+        """Start from a set persisted by an earlier complete sync (see resource_store)"""
+        with self.lock:
+            if self.watermark is not None:
+                return
+            self.watermark = watermark
+            self.last_full_sync = time.monotonic() - max(0.0, full_sync_age)
+            self._hold({resource['id']: resource for resource in resources})
+
+    def merge(self, resources: Iterable[Dict], complete: bool, full: bool) -> List[Dict]:
+        """Fold a (delta or full) result into the local set and return the set
+
+        The watermark only advances when the result is complete; a search
+        that failed part-way is merged but fetched again next time.
+        """
+        with self.lock:
+            target = {} if full else self.resources
+            newest = _parse_instant(self.watermark) if self.watermark and not full else None
+            newest_raw = None if full else self.watermark
+            received = 0
+
+            for resource in resources:
+                received += 1
+                resource_id = resource.get('id')
+                if not resource_id:
+                    continue
+
+                last_updated = resource.get('meta', {}).get('lastUpdated')
+                parsed = _parse_instant(last_updated) if last_updated else None
+                if parsed is not None and (newest is None or parsed > newest):
+                    newest, newest_raw = parsed, last_updated
+
+                if resource.get('status') in WITHDRAWN_STATUSES:
+                    target.pop(resource_id, None)
+                    continue
+                current = target.get(resource_id)
+                if current is None or _newer_version(resource, current):
+                    target[resource_id] = resource
+
+            if full and not complete:
+                # Keep what we had rather than drop resources we failed to page through
+                for resource_id, resource in self.resources.items():
+                    target.setdefault(resource_id, resource)
+
+            self.syncs += 1
+            self.delta_resources += received
+            if complete:
+                self.watermark = newest_raw
+                if full:
+                    self.last_full_sync = time.monotonic()
+            merged = list(target.values())
+            self._hold(target)
+            return merged
+
+
+class IncrementalSyncStore:
+    """Bounded, thread-safe map of sync states"""
+
+    def __init__(self, max_states: int, max_resources: int = 0, max_resources_per_state: int = 0):
+        self.max_states = max_states
+        self.max_resources = max_resources
+        self.max_resources_per_state = max_resources_per_state
+        self._lock = threading.Lock()
+        self._states: "OrderedDict[Hashable, ResourceSyncState]" = OrderedDict()
+        self._held = 0
+        self.evictions = 0
+
+    def state(self, key: Hashable) -> ResourceSyncState:
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                state = ResourceSyncState(self.max_resources_per_state, self._resized)
+                self._states[key] = state
+                self._evict(lambda: len(self._states) > self.max_states)
+            else:
+                self._states.move_to_end(key)
+            return state
+
+    def _resized(self, state: ResourceSyncState, delta: int):
+        with self._lock:
+            if state._resized is None:
+                return  # already evicted; its resources no longer count
+            self._held += delta
+            if self.max_resources:
+                self._evict(lambda: self._held > self.max_resources)
+
+    def _evict(self, over: Callable[[], bool]):
+        """Drop least recently used states while over a limit (lock held)"""
+        while self._states and over():
+            _, evicted = self._states.popitem(last=False)
+            evicted._resized = None
+            self._held -= len(evicted.resources)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            for state in self._states.values():
+                state._resized = None
+            self._states.clear()
+            self._held = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            states = list(self._states.values())
+            held = self._held
+            evictions = self.evictions
+        return {
+            'states': len(states),
+            'resources': held,
+            'syncs': sum(state.syncs for state in states),
+            'resources_transferred': sum(state.delta_resources for state in states),
+            'overflows': sum(state.overflows for state in states),
+            'evictions': evictions
+        }
@@ -0,0 +1,258 @@
+"""
+A small FHIRPath subset, compiled to Python.
+
+Supported:
+
+    billablePeriod.start                      member navigation
+    item.first().servicedDate                 first()
+    item[1].net.value                         indexing
+    total.where(category.coding.first().code = 'patient-pay').amount.value
+    billablePeriod.start | item.first().servicedDate
+
+where() takes one `path = literal` comparison (string, number, true/false)
+and keeps the first matching element. Every expression yields a single
+value, its first result. `a | b` therefore reads as a fallback: b is only
+evaluated when a is empty. A repeating element has to be narrowed with
+first(), [n] or where() before navigating into it. `item.servicedDate`
+is empty rather than every item's date.
+
+Expressions are parsed once into path tuples (str keys, int indexes, Where
+steps). Those tuples are turned into generated Python, either here for a
+standalone evaluator (compile_expression) or by field_mapping for a whole
+table of fields. Both are cached, so repeated use costs one call per
+resource.
+"""
+
+import re
+from functools import lru_cache
+from itertools import repeat
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+MISSING = object()
+
+# What a malformed resource raises in generated code (e.g. a scalar or null
+# where an object or list was expected); absent elements are tested for
+STEP_ERRORS = (AttributeError, KeyError, IndexError, TypeError)
+
+
+class Where:
+    """Path step: first element of a list whose `path` equals `value`"""
+
+    __slots__ = ('path', 'value')
+
+    def __init__(self, path: Tuple, value: Any):
+        self.path = tuple(path)
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, Where) and (self.path, self.value) == (other.path, other.value)
+
+    def __hash__(self):
+        return hash((self.path, self.value))
+
+    def __repr__(self):
+        return f"where({'.'.join(map(str, self.path))} = {self.value!r})"
+
+
+# -- parsing ------------------------------------------------------------------
+
+_TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<string>'(?:[^'\\]|\\.)*')
+      | (?P<number>-?\d+(?:\.\d+)?)
+      | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+      | (?P<symbol>\(\)|[.()\[\]=|])
+    )""", re.VERBOSE)
+
+
+def _tokenize(expression: str) -> List[Tuple[str, str, int]]:
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if match is None:
+            raise ValueError(f"FHIRPath: unexpected {expression[position:]!r} at {position} in {expression!r}")
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind), match.start(kind)))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.tokens = _tokenize(expression)
+        self.index = 0
+
+    def error(self, message: str):
+        position = self.tokens[self.index][2] if self.index < len(self.tokens) else len(self.expression)
+        raise ValueError(f"FHIRPath: {message} at {position} in {self.expression!r}")
+
+    def peek(self, value: Optional[str] = None) -> bool:
+        if self.index >= len(self.tokens):
+            return False
+        return value is None or self.tokens[self.index][1] == value
+
+    def take(self, kind: Optional[str] = None, value: Optional[str] = None) -> str:
+        if self.index >= len(self.tokens):
+            self.error(f"expected {value or kind}")
+        token_kind, text, _ = self.tokens[self.index]
+        if (kind and token_kind != kind) or (value and text != value):
+            self.error(f"expected {value or kind}, found {text!r}")
+        self.index += 1
+        return text
+
+    def alternatives(self) -> List[Tuple]:
+        found = [self.path(nested=False)]
+        while self.peek('|'):
+            self.take(value='|')
+            found.append(self.path(nested=False))
+        if self.index != len(self.tokens):
+            self.error("unexpected token")
+        return found
+
+    def path(self, nested: bool) -> Tuple:
+        steps: List[Any] = []
+        steps.append(self.take('name'))
+        self.indexes(steps)
+        while self.peek('.'):
+            self.take(value='.')
+            name = self.take('name')
+            if name == 'first':
+                self.take(value='()')
+                steps.append(0)
+            elif name == 'where':
+                if nested:
+                    self.error("where() inside where() is not supported")
+                self.take(value='(')
+                criteria = self.path(nested=True)
+                self.take(value='=')
+                value = self.literal()
+                self.take(value=')')
+                steps.append(Where(criteria, value))
+            else:
+                steps.append(name)
+            self.indexes(steps)
+        return tuple(steps)
+
+    def indexes(self, steps: List[Any]):
+        while self.peek('['):
+            self.take(value='[')
+            steps.append(int(self.take('number')))
+            self.take(value=']')
+
+    def literal(self) -> Any:
+        if self.peek() and self.tokens[self.index][0] == 'string':
+            return re.sub(r"\\(.)", r"\1", self.take('string')[1:-1])
+        if self.peek() and self.tokens[self.index][0] == 'number':
+            text = self.take('number')
+            return float(text) if '.' in text else int(text)
+        if self.peek('true') or self.peek('false'):
+            return self.take('name') == 'true'
+        self.error("expected a literal")
+
+
+@lru_cache(maxsize=None)
+def parse(expression: str) -> Tuple[Tuple, ...]:
+    """Alternatives of `expression` as path tuples (cached)"""
+    return tuple(_Parser(expression).alternatives())
+
+
+def dotted(path: Tuple) -> str:
+    """Element path without indexes or where(), e.g. 'item.adjudication.amount'"""
+    return '.'.join(step for step in path if isinstance(step, str))
+
+
+# -- code generation ----------------------------------------------------------
+#
+# A path becomes nested tests that read the way a hand-written accessor
+# would (`if 'key' in node`, a list length check, an inline loop for
+# where()) instead of raising on absent elements, since a missing first
+# alternative is the common case for fallbacks. E only catches malformed
+# resources, e.g. a scalar where an object was expected.
+
+def walk(lines: List[str], indent: str, node: str, steps: Tuple, namespace: Dict[str, Any],
+         leaf: Callable[[str, str], None]):
+    """Append nested tests walking `steps` from local `node`
+
+    leaf(indent, expression) appends the code run when the whole path is
+    present. Intermediate nodes are kept in local t.
+    """
+    for index, step in enumerate(steps):
+        if isinstance(step, Where):
+            # Inline scan: w is the first element whose criteria path matches.
+            # Criteria are nearly always present, so they are subscripted directly.
+            value = f"where{len(namespace)}"
+            namespace[value] = step.value
+            criteria = ''.join(f"[{part!r}]" for part in step.path)
+            lines.extend([f"{indent}w = M",
+                          f"{indent}if {node}.__class__ is list:",
+                          f"{indent}    for e in {node}:",
+                          f"{indent}        try:",
+                          f"{indent}            if e{criteria} == {value}:",
+                          f"{indent}                w = e",
+                          f"{indent}                break",
+                          f"{indent}        except E:",
+                          f"{indent}            pass"])
+            test, child = "w is not M", 'w'
+        elif isinstance(step, str):
+            test, child = f"{step!r} in {node}", f"{node}[{step!r}]"
+        elif isinstance(step, int):
+            test = f"{node}.__class__ is list and {node if step == 0 else f'len({node}) > {step}'}"
+            child = f"{node}[{step}]"
+        else:
+            raise TypeError(f"unsupported path step {step!r}")
+        lines.append(f"{indent}if {test}:")
+        indent += "    "
+        if index < len(steps) - 1:
+            lines.append(f"{indent}t = {child}")
+            node = 't'
+        else:
+            leaf(indent, child)
+    if not steps:
+        leaf(indent, node)
+
+
+def assign(lines: List[str], indent: str, target: str, node: str, steps: Tuple, namespace: Dict[str, Any]):
+    """Append statements setting `target` to `steps` applied to local `node`, or M when absent"""
+    lines.extend([f"{indent}try:", f"{indent}    {target} = M"])
+    inner = indent + "    "
+    if node != 'r':  # the resource itself is never M; shared locals may be
+        lines.append(f"{inner}if {node} is not M:")
+        inner += "    "
+    walk(lines, inner, node, steps, namespace, lambda at, value: lines.append(f"{at}{target} = {value}"))
+    lines.extend([f"{indent}except E:", f"{indent}    {target} = M"])
+
+
+def new_namespace() -> Dict[str, Any]:
+    return {'M': MISSING, 'E': STEP_ERRORS}
+
+
+@lru_cache(maxsize=None)
+def compile_expression(expression: str) -> Callable[..., Any]:
+    """Evaluator for `expression` (cached)
+
+    evaluator(resource, default=MISSING) returns the first result, or
+    `default` when the expression is empty.
+    """
+    namespace = new_namespace()
+    lines = ["def evaluate(r, d=M):"]
+    for path in parse(expression):
+        # Alternatives in order; the first present value is returned
+        lines.append("    try:")
+        walk(lines, "        ", 'r', path, namespace, lambda at, value: lines.append(f"{at}return {value}"))
+        lines.extend(["    except E:", "        pass"])
+    lines.append("    return d")
+    exec(compile('\n'.join(lines) + '\n', f"<fhirpath {expression!r}>", 'exec'), namespace)
+    return namespace['evaluate']
+
+
+def evaluate(expression: str, resource: Any, default: Any = None) -> Any:
+    """First result of `expression` on `resource`, or `default` when empty"""
+    return compile_expression(expression)(resource, default)
+
+
+def select(expression: str, resources: Iterable[Any], default: Any = None) -> Iterator[Any]:
+    """evaluate() over a stream of resources, compiling the expression once"""
+    return map(compile_expression(expression), resources, repeat(default))
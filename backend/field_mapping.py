@@ -0,0 +1,193 @@
+"""
+Declarative field mappings compiled into one-pass extractors.
+
+A mapping is an ordered table of output field -> Field. A Field lists the
+FHIRPath expressions (see fhirpath) to try in order, plus an optional
+lookup table, conversion, fallback and default:
+
+    'amount': Field("total.where(category.coding.first().code = 'patient-pay').amount.value",
+                    "item.first().adjudication.where(category.coding.first().code = 'patient-pay').amount.value",
+                    convert=float, default=0.0)
+
+compile_mapping() turns the table, once, into the source of a single
+specialised function. Each path node is bound to a local the first time it
+is needed, so a prefix shared by many fields (item[0], total) is resolved
+once per resource. Nodes that only a fallback alternative reads are walked
+only when that fallback runs. The resource is visited once, with no
+per-field helper calls and no repeated walks.
+"""
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from fhirpath import assign, dotted, new_namespace, parse
+
+class Field:
+    """How one output field is filled
+
+    paths: FHIRPath expressions (or path tuples) tried in order; the first
+        present value wins. An expression's own `a | b` alternatives count
+        as separate paths.
+    lookup: maps the value through a dict; values not in it count as missing.
+    convert: applied to the value that won (e.g. float).
+    fallback: fallback(resource, out, context) when every path missed; may
+        return None to fall through to the default. `out` holds the fields
+        listed in needs.
+    default: value (or zero-argument callable) used when nothing matched.
+    reads: extra paths the fallback reads, for _elements projections.
+    needs: earlier output fields the fallback reads from `out`; they are
+        built even when only this field is selected.
+    """
+
+    __slots__ = ('paths', 'lookup', 'convert', 'fallback', 'default', 'reads', 'needs')
+
+    def __init__(self, *paths: Union[str, Tuple], lookup: Optional[Dict] = None, convert: Optional[Callable] = None,
+                 fallback: Optional[Callable] = None, default: Any = None, reads: Tuple[str, ...] = (),
+                 needs: Tuple[str, ...] = ()):
+        self.paths = []
+        for path in paths:
+            self.paths.extend(parse(path) if isinstance(path, str) else [tuple(path)])
+        self.lookup = lookup
+        self.convert = convert
+        self.fallback = fallback
+        self.default = default
+        self.reads = reads
+        self.needs = needs
+
+
+class Context:
+    """Output field taken from the per-call context instead of the resource"""
+
+    __slots__ = ('name',)
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+SOURCE = Context('__source__')  # the resource itself (fhir_data)
+
+
+class Extractor:
+    """Compiled mapping: extract(resource, context) returns the output dict (or record)
+
+    `source` is the generated function's code, for debugging.
+    """
+
+    def __init__(self, extract: Callable[[Dict, Dict], Dict], source: str, paths: List[str]):
+        self.extract = extract
+        self.source = source
+        self.paths = paths
+
+    def __call__(self, resource: Dict, context: Optional[Dict] = None) -> Dict:
+        return self.extract(resource, context or {})
+
+
+def compile_mapping(mapping: Dict[str, Any], name: str = 'extract',
+                    fields: Optional[Iterable[str]] = None, record: Optional[type] = None) -> Extractor:
+    """Compile an ordered {output field: Field | Context} table into an Extractor
+
+    The table becomes the source of one function. Fields are filled in table
+    order; each path node is bound to a local the first time it is needed and
+    reused by every later field, while nodes only needed by a fallback
+    alternative are walked inside that branch alone.
+
+    `fields` selects a subset of the table (default: all of it). Unselected
+    fields are not built at all, except where a selected field's fallback
+    needs them, and only the selected ones are returned.
+
+    With `record` (a records.record_type class whose fields are the selected
+    fields in table order) the function returns record(...) instead of a dict.
+    """
+    selected = list(mapping) if fields is None else list(fields)
+    unknown = [field_name for field_name in selected if field_name not in mapping]
+    if unknown:
+        raise KeyError(f"unknown fields {unknown}")
+    wanted = set(selected)
+    pending = list(selected)
+    while pending:
+        spec = mapping[pending.pop()]
+        for needed in getattr(spec, 'needs', ()):
+            if needed not in wanted:
+                wanted.add(needed)
+                pending.append(needed)
+    returned = set(selected)
+    mapping = {field_name: spec for field_name, spec in mapping.items() if field_name in wanted}
+
+    namespace = new_namespace()
+    lines = [f"def {name}(r, c):"]
+    paths: List[str] = []
+
+    # Prefixes read by more than one path get a local of their own
+    uses: Dict[Tuple, int] = {}
+    for spec in mapping.values():
+        if isinstance(spec, Field):
+            for path in spec.paths:
+                for end in range(1, len(path)):
+                    uses[path[:end]] = uses.get(path[:end], 0) + 1
+    local_of = {prefix: f"n{i}" for i, prefix in enumerate(p for p, count in uses.items() if count > 1)}
+    bound = set()  # shared prefixes already assigned on every code path
+
+    def reach(path: Tuple, indent: str, branch: set) -> Tuple[str, Tuple]:
+        """(local, remaining steps) for `path`, binding the shared prefixes it goes through on first use"""
+        for end in range(len(path) - 1, 0, -1):
+            prefix = path[:end]
+            if prefix in local_of:
+                if prefix not in bound and prefix not in branch:
+                    assign(lines, indent, local_of[prefix], *reach(prefix, indent, branch), namespace)
+                    (bound if indent == "    " else branch).add(prefix)
+                return local_of[prefix], path[end:]
+        return 'r', path
+
+    names = list(mapping)
+    for index, (field_name, spec) in enumerate(mapping.items()):
+        target = f"f{index}"
+        if isinstance(spec, Context):
+            lines.append(f"    {target} = r" if spec is SOURCE else f"    {target} = c.get({spec.name!r})")
+            continue
+
+        for element_path in [dotted(path) for path in spec.paths] + list(spec.reads):
+            if element_path not in paths:
+                paths.append(element_path)
+        lookup = None
+        if spec.lookup is not None:
+            lookup = namespace[f"lookup{index}"] = spec.lookup
+        indent = "    "
+        branch = set()
+        for alternative, path in enumerate(spec.paths):
+            if alternative:
+                # Later alternatives only run when the earlier ones missed
+                lines.append(f"{indent}if {target} is M:")
+                indent += "    "
+            assign(lines, indent, target, *reach(path, indent, branch), namespace)
+            if lookup is not None:
+                lines.append(f"{indent}if {target} is not M:")
+                lines.append(f"{indent}    {target} = lookup{index}.get({target}, M)")
+        if not spec.paths:
+            lines.append(f"    {target} = M")
+
+        if spec.convert is not None:
+            namespace[f"convert{index}"] = spec.convert
+            lines.append(f"    if {target} is not M:")
+            lines.append(f"        {target} = convert{index}({target})")
+        if spec.fallback is not None:
+            namespace[f"fallback{index}"] = spec.fallback
+            so_far = ', '.join(f"{needed!r}: f{names.index(needed)}" for needed in spec.needs)
+            lines.append(f"    if {target} is M:")
+            lines.append(f"        {target} = fallback{index}(r, {{{so_far}}}, c)")
+            lines.append(f"        if {target} is None:")
+            lines.append(f"            {target} = M")
+        namespace[f"default{index}"] = spec.default
+        default = f"default{index}()" if callable(spec.default) else f"default{index}"
+        lines.append(f"    if {target} is M:")
+        lines.append(f"        {target} = {default}")
+
+    output = [(field_name, f"f{index}") for index, field_name in enumerate(names) if field_name in returned]
+    if record is None:
+        lines.append(f"    return {{{', '.join(f'{field_name!r}: {local}' for field_name, local in output)}}}")
+    else:
+        if tuple(field_name for field_name, _ in output) != record.fields:
+            raise ValueError(f"record fields {record.fields} do not match the selected fields")
+        namespace['record'] = record
+        lines.append(f"    return record({', '.join(local for _, local in output)})")
+    source = '\n'.join(lines) + '\n'
+    exec(compile(source, f"<field mapping {name}>", 'exec'), namespace)
+    return Extractor(namespace[name], source, paths)
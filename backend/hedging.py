@@ -0,0 +1,398 @@
+"""
+Hedged requests for idempotent FHIR reads.
+
+Epic search latency has a long tail. With hedging on, a read that has not
+completed after the hedge delay gets a duplicate; whichever finishes first
+wins and the other is abandoned. The hedge delay is a percentile (p95 by
+default) of the latencies observed for the same (host, resource type),
+kept in a log-bucketed histogram that halves its counts every `window`
+samples so it follows the upstream as it drifts.
+
+A global budget bounds the extra traffic: every read earns `budget_ratio`
+of a hedge (up to `budget_burst` saved up) and every hedge spends one, so
+hedges never exceed budget_ratio of reads plus the burst.
+
+The primary attempt of a blocking read runs on the calling thread and only
+hedges go to the hedge pool, so hedging never caps how many reads run at
+once. A single timer thread launches each hedge at its due time. When the
+hedge wins, the primary is aborted through the hook its connection
+registered (see abortable(); http_pool shuts the pooled socket down). A
+primary with no hook, such as a connection still being set up or the
+HTTP/2 transport, runs to the end and the caller then takes the hedge's
+response. A losing hedge that has not started is cancelled; otherwise its
+response is closed when it arrives. Async losers are cancelled outright.
+
+Every primary outcome is recorded in the latency histogram: successes,
+failures and timeouts at their full duration, and aborted primaries at
+the time they were abandoned (a lower bound). Otherwise the percentile
+would lean towards the fast responses.
+"""
+
+import asyncio
+import bisect
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import deadline
+from env_config import FHIR_HEDGING_CONFIG
+
+# Histogram bucket upper bounds: 5ms growing by 25% per bucket to ~60s
+_BOUNDS: List[float] = [0.005 * 1.25 ** i for i in range(43)]
+
+
+class LatencyHistogram:
+    """Log-bucketed latency histogram with exponential aging"""
+
+    def __init__(self, window: int):
+        self.window = window
+        self._lock = threading.Lock()
+        self._counts = [0.0] * (len(_BOUNDS) + 1)
+        self._total = 0.0
+        self._since_decay = 0
+        self.samples = 0
+
+    def record(self, seconds: float):
+        index = bisect.bisect_left(_BOUNDS, seconds)
+        with self._lock:
+            self._counts[index] += 1
+            self._total += 1
+            self.samples += 1
+            self._since_decay += 1
+            if self._since_decay >= self.window:
+                self._counts = [count / 2 for count in self._counts]
+                self._total /= 2
+                self._since_decay = 0
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Upper bound of the bucket holding the p-th percentile, or None when empty"""
+        with self._lock:
+            if not self._total:
+                return None
+            target = self._total * p / 100
+            running = 0.0
+            for index, count in enumerate(self._counts):
+                running += count
+                if running >= target:
+                    return _BOUNDS[min(index, len(_BOUNDS) - 1)]
+            return _BOUNDS[-1]
+
+
+class HedgeBudget:
+    """Token bucket: reads deposit `ratio` tokens, each hedge withdraws one"""
+
+    def __init__(self, ratio: float, burst: float):
+        self.ratio = ratio
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._tokens = burst
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def available(self) -> bool:
+        with self._lock:
+            return self._tokens >= 1
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    @property
+    def tokens(self) -> float:
+        with self._lock:
+            return self._tokens
+
+
+def _discard(future: Future):
+    """Abandon a losing attempt: cancel it, or close its response once it arrives"""
+    if not future.cancel():
+        future.add_done_callback(_close_result)
+
+
+def _close_result(future: Future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+class _Attempt:
+    """A hedged read's primary attempt, running on the calling thread"""
+
+    __slots__ = ('lock', 'hooks', 'done', 'hedge')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hooks: List[Callable[[], None]] = []
+        self.done = False
+        self.hedge: Optional[Future] = None
+
+    def abort(self):
+        """The hedge won: interrupt the primary if it is still running"""
+        with self.lock:
+            if not self.done:
+                for hook in self.hooks:
+                    hook()
+
+    def release(self, hook: Callable[[], None]):
+        with self.lock:
+            if hook in self.hooks:
+                self.hooks.remove(hook)
+
+    def finish(self) -> Optional[Future]:
+        """Mark the primary finished; returns the hedge, if one was launched"""
+        with self.lock:
+            self.done = True
+            self.hooks.clear()
+            return self.hedge
+
+
+# The primary attempt running on each thread, if any
+_current = threading.local()
+
+
+def abortable(hook: Callable[[], None]) -> Optional[_Attempt]:
+    """Let a winning hedge abort the calling thread's primary attempt by calling `hook`
+
+    Called by the transport once it has the connection the attempt uses.
+    Returns the attempt to release(hook) on once that connection is handed
+    back (the hook must not fire on a connection reused by another read),
+    or None when the thread is not running a hedged primary.
+    """
+    attempt = getattr(_current, 'attempt', None)
+    if attempt is not None:
+        with attempt.lock:
+            if attempt.done:
+                return None
+            attempt.hooks.append(hook)
+    return attempt
+
+
+class _Timer:
+    """One daemon thread running callbacks at their due time"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap: List[Tuple[float, int, Callable[[], None]]] = []
+        self._sequence = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+
+    def at(self, due: float, callback: Callable[[], None]):
+        with self._cond:
+            heapq.heappush(self._heap, (due, next(self._sequence), callback))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='fhir-hedge-timer', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, callback = heapq.heappop(self._heap)
+            try:
+                callback()
+            except Exception as e:
+                print(f"⚠️ Hedge launch failed: {e}")
+
+
+class Hedger:
+    """Hedging policy, latency histograms and counters shared by all clients"""
+
+    def __init__(self, config: Dict):
+        self.config = config
+        self.budget = HedgeBudget(config['budget_ratio'], config['budget_burst'])
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._timer = _Timer()
+        self.reads = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+
+    def histogram(self, host: str, resource_type: str) -> LatencyHistogram:
+        key = (host, resource_type)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LatencyHistogram(self.config['window'])
+            return histogram
+
+    def delay(self, host: str, resource_type: str) -> Optional[float]:
+        """Hedge delay for (host, resource type), or None while there are too few samples"""
+        histogram = self.histogram(host, resource_type)
+        if histogram.samples < self.config['min_samples']:
+            return None
+        value = histogram.percentile(self.config['percentile'])
+        return min(self.config['max_delay'], max(self.config['min_delay'], value))
+
+    def _plan(self, host: str, resource_type: str) -> Optional[float]:
+        """Count a read and return its hedge delay, or None to send it unhedged"""
+        if not self.config['enabled'] or resource_type not in self.config['resource_types']:
+            return None
+        with self._lock:
+            self.reads += 1
+        self.budget.deposit()
+        delay = self.delay(host, resource_type)
+        if delay is None:
+            return None
+        if not self.budget.available():
+            with self._lock:
+                self.budget_denied += 1
+            return None
+        left = deadline.remaining()
+        if left is not None and left <= delay:
+            return None
+        return delay
+
+    def _timed(self, histogram: LatencyHistogram, send: Callable, timeout):
+        started = time.monotonic()
+        try:
+            return send(timeout)
+        finally:
+            histogram.record(time.monotonic() - started)
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.config['max_workers'],
+                                                    thread_name_prefix='fhir-hedge')
+            return self._executor
+
+    def _start_hedge(self) -> bool:
+        if not self.budget.withdraw():
+            with self._lock:
+                self.budget_denied += 1
+            return False
+        with self._lock:
+            self.hedged += 1
+        return True
+
+    def _won_by_hedge(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def call(self, host: str, resource_type: str, send: Callable[[Tuple[float, float]], object],
+             timeout: Tuple[float, float]):
+        """send(timeout), duplicated after the hedge delay if it has not answered yet"""
+        histogram = self.histogram(host, resource_type)
+        delay = self._plan(host, resource_type)
+        if delay is None:
+            return self._timed(histogram, send, timeout)
+
+        attempt = _Attempt()
+        # The hedge runs in a copy of our context, so under the same deadline
+        context = contextvars.copy_context()
+        self._timer.at(time.monotonic() + delay, lambda: self._launch_hedge(attempt, context, send, timeout))
+        _current.attempt = attempt
+        error = None
+        try:
+            response = self._timed(histogram, send, timeout)
+        except Exception as e:
+            error = e
+        finally:
+            _current.attempt = None
+            hedge = attempt.finish()
+
+        if hedge is None:
+            if error is not None:
+                raise error
+            return response
+        if error is None:
+            _discard(hedge)
+            return response
+        # The primary failed, or was aborted because the hedge won
+        try:
+            response = hedge.result()
+        except Exception:
+            raise error
+        self._won_by_hedge()
+        return response
+
+    def _launch_hedge(self, attempt: _Attempt, context: contextvars.Context, send: Callable, timeout):
+        """Timer callback: send the hedge if the primary is still running"""
+        with attempt.lock:
+            if attempt.done or not self._start_hedge():
+                return
+            attempt.hedge = self._pool().submit(context.run, self._send_hedge, send, timeout)
+        attempt.hedge.add_done_callback(
+            lambda hedge: attempt.abort() if not hedge.cancelled() and hedge.exception() is None else None)
+
+    @staticmethod
+    def _send_hedge(send: Callable, timeout: Tuple[float, float]):
+        return send(deadline.timeout_for(timeout))
+
+    async def acall(self, host: str, resource_type: str, send: Callable[[Tuple[float, float]], Awaitable],
+                    timeout: Tuple[float, float]):
+        """asyncio version of call; `send` is a coroutine function"""
+        histogram = self.histogram(host, resource_type)
+        delay = self._plan(host, resource_type)
+        started = time.monotonic()
+        if delay is None:
+            try:
+                return await send(timeout)
+            finally:
+                histogram.record(time.monotonic() - started)
+
+        primary = asyncio.ensure_future(send(timeout))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self._start_hedge():
+                try:
+                    tasks.add(asyncio.ensure_future(send(deadline.timeout_for(timeout))))
+                except deadline.DeadlineExceeded:
+                    pass
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._won_by_hedge()
+                        return task.result()
+            return primary.result()
+        finally:
+            # Primary latency on every outcome; a primary beaten by the hedge counts up to now
+            histogram.record(time.monotonic() - started)
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            histograms = dict(self._histograms)
+            counters = {
+                'enabled': self.config['enabled'],
+                'reads': self.reads,
+                'hedged': self.hedged,
+                'hedge_wins': self.hedge_wins,
+                'budget_denied': self.budget_denied,
+                'hedge_rate': round(self.hedged / self.reads, 4) if self.reads else 0.0
+            }
+        counters['budget_tokens'] = round(self.budget.tokens, 2)
+        counters['latency'] = {
+            f"{host} {resource_type or '*'}": {
+                'samples': histogram.samples,
+                'p50_ms': round((histogram.percentile(50) or 0) * 1000, 1),
+                'p95_ms': round((histogram.percentile(95) or 0) * 1000, 1),
+                'hedge_delay_ms': round((self.delay(host, resource_type) or 0) * 1000, 1)
+            }
+            for (host, resource_type), histogram in histograms.items()
+        }
+        return counters
+
+
+hedger = Hedger(FHIR_HEDGING_CONFIG)
+
+
+def get_hedging_stats() -> Dict:
+    return hedger.stats()
@@ -0,0 +1,205 @@
+"""
+Optional HTTP/2 transport for upstream FHIR calls.
+
+With FHIR_HTTP2=true, every concurrent read to an https origin goes over a
+single multiplexed HTTP/2 connection instead of one HTTP/1.1 connection per
+parallel request. That covers the per-patient fan-out (Patient, EOB, Claim,
+Coverage, Organization), prefetches and hedges. HTTP/2 comes from httpx's
+http2 support and needs the `h2` package (pip install 'httpx[http2]').
+
+EpicFHIRClient sends through requests, so HTTP2Adapter is a requests
+transport adapter backed by one shared httpx.Client per origin (one per
+verify/cert/proxy combination, as requests' own adapter keys its pools on
+them). Call sites, retries and cassettes are unchanged, and the origin's pool stats gain
+http2_streams / http1_requests so the negotiated protocol is visible in
+/metrics. AsyncEpicFHIRClient asks http2_settings() for the same flags when
+it builds its httpx.AsyncClient.
+
+Fallback is automatic. h2 is offered through ALPN alongside http/1.1, and a
+server that does not pick h2 is spoken to over HTTP/1.1 on the same pooled
+client. If h2 is not installed, the regular urllib3 pool is used.
+
+To test against a local stand-in over plain http (h2c), set
+FHIR_HTTP2_PRIOR_KNOWLEDGE=true so HTTP/2 is spoken without negotiation,
+e.g. against `hypercorn app:app --bind 127.0.0.1:8443` or any h2c server.
+"""
+
+import importlib.util
+import os
+import ssl
+import threading
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers, select_proxy
+
+from env_config import HTTP_POOL_CONFIG
+
+_HOP_BY_HOP = {'connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'upgrade'}
+
+_warned = set()
+_warn_lock = threading.Lock()
+
+
+def h2_available() -> bool:
+    return importlib.util.find_spec('h2') is not None
+
+
+def http2_settings(origin: str) -> Dict[str, bool]:
+    """httpx client flags (http1/http2) for `origin` under HTTP_POOL_CONFIG"""
+    config = HTTP_POOL_CONFIG
+    scheme = urlsplit(origin).scheme
+    wanted = config['http2'] and (scheme == 'https' or config['http2_prior_knowledge'])
+    if not wanted:
+        return {'http1': True, 'http2': False}
+    if not h2_available():
+        with _warn_lock:
+            if origin not in _warned:
+                _warned.add(origin)
+                print(f"⚠️ HTTP/2 requested for {origin} but the h2 package is not installed; using HTTP/1.1")
+        return {'http1': True, 'http2': False}
+    # Prior knowledge (h2c) applies to plain http only; TLS negotiates via ALPN
+    return {'http1': not (scheme == 'http' and config['http2_prior_knowledge']), 'http2': True}
+
+
+def _timeout(timeout) -> httpx.Timeout:
+    """requests timeout (None, seconds or (connect, read)) as an httpx.Timeout"""
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+
+def _ssl_context(verify, cert) -> ssl.SSLContext:
+    """requests' verify (bool or CA bundle path) and cert (path or (cert, key)) as an SSLContext"""
+    if isinstance(verify, str):
+        context = ssl.create_default_context(**{'capath' if os.path.isdir(verify) else 'cafile': verify})
+    else:
+        context = httpx.create_ssl_context(verify=bool(verify), trust_env=False)
+    if cert:
+        context.load_cert_chain(*((cert,) if isinstance(cert, str) else cert))
+    return context
+
+
+def _as_requests_error(e: httpx.HTTPError, request: requests.PreparedRequest) -> requests.RequestException:
+    """Map an httpx transport error onto the requests exception callers catch"""
+    if isinstance(e, httpx.ConnectTimeout):
+        return requests.exceptions.ConnectTimeout(e, request=request)
+    if isinstance(e, httpx.TimeoutException):
+        return requests.exceptions.ReadTimeout(e, request=request)
+    if isinstance(e, httpx.TransportError):
+        return requests.exceptions.ConnectionError(e, request=request)
+    return requests.exceptions.RequestException(e, request=request)
+
+
+class _StreamingBody:
+    """Just enough of urllib3's HTTPResponse for requests' iter_content/close"""
+
+    def __init__(self, response: httpx.Response, request: requests.PreparedRequest):
+        self._response = response
+        self._request = request
+
+    def stream(self, chunk_size: int, decode_content: bool = True):
+        try:
+            yield from self._response.iter_bytes(chunk_size)
+        except httpx.HTTPError as e:
+            raise _as_requests_error(e, self._request) from e
+
+    def read(self, amt: Optional[int] = None, **kwargs) -> bytes:
+        return b''.join(self.stream(amt or 65536))
+
+    def close(self):
+        self._response.close()
+
+    def release_conn(self):
+        self._response.close()
+
+
+class HTTP2Adapter(BaseAdapter):
+    """requests adapter that sends through a pooled httpx.Client (HTTP/2 when negotiated)"""
+
+    def __init__(self, stats, http1: bool = True, http2: bool = True,
+                 transport: Optional[httpx.BaseTransport] = None):
+        super().__init__()
+        config = HTTP_POOL_CONFIG
+        self.stats = stats
+        self._settings = dict(
+            http1=http1,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=config['pool_maxsize'],
+                max_keepalive_connections=config['pool_maxsize'],
+                keepalive_expiry=config['keepalive_idle_timeout']
+            ),
+            follow_redirects=False,
+            # requests already merged the environment into verify/proxies
+            trust_env=False,
+            transport=transport
+        )
+        self._clients: Dict[Tuple, httpx.Client] = {}
+        self._lock = threading.Lock()
+
+    def client(self, verify=True, cert=None, proxy: Optional[str] = None) -> httpx.Client:
+        """The pooled client for one verify/cert/proxy combination"""
+        key = (verify, cert if cert is None or isinstance(cert, str) else tuple(cert), proxy)
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = httpx.Client(verify=_ssl_context(verify, cert), proxy=proxy, **self._settings)
+                    self._clients[key] = client
+        return client
+
+    def send(self, request: requests.PreparedRequest, stream=False, timeout=None, verify=True,
+             cert=None, proxies=None):
+        client = self.client(verify, cert, select_proxy(request.url, proxies))
+        opened = []
+
+        def trace(event: str, info: Dict):
+            if event == 'connection.connect_tcp.complete':
+                opened.append(event)
+
+        outgoing = client.build_request(
+            request.method, request.url,
+            # Connection-specific headers are illegal in HTTP/2 and httpx manages its own
+            headers=[(name, value) for name, value in request.headers.items() if name.lower() not in _HOP_BY_HOP],
+            content=request.body,
+            timeout=_timeout(timeout),
+            extensions={'trace': trace}
+        )
+        try:
+            upstream = client.send(outgoing, stream=True)
+        except httpx.HTTPError as e:
+            raise _as_requests_error(e, request) from e
+        self.stats.incr('new_connections' if opened else 'hits')
+        self.stats.incr('http2_streams' if upstream.http_version == 'HTTP/2' else 'http1_requests')
+
+        response = requests.Response()
+        response.status_code = upstream.status_code
+        response.reason = upstream.reason_phrase
+        response.headers = CaseInsensitiveDict(upstream.headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = _StreamingBody(upstream, request)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        if not stream:
+            try:
+                response._content = upstream.read()
+            except httpx.HTTPError as e:
+                raise _as_requests_error(e, request) from e
+            finally:
+                upstream.close()
+            response._content_consumed = True
+        return response
+
+    def close(self):
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            client.close()
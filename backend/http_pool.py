@@ -0,0 +1,344 @@
+"""
+Process-wide HTTP connection pooling for upstream FHIR/OAuth calls.
+
+One requests.Session is kept per upstream origin (scheme + host + port) and
+shared by every EpicFHIRClient, so TCP+TLS handshakes are paid once per
+pooled connection instead of once per FHIR read. Per-request state (the
+bearer token) is passed as request headers and never stored on the session.
+"""
+
+import socket
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool, PoolManager
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.exceptions import ConnectTimeoutError, EmptyPoolError, NameResolutionError, NewConnectionError
+from urllib3.util import connection as urllib3_connection
+
+import deadline
+from cassette import wrap_adapter
+from env_config import HTTP_POOL_CONFIG
+from hedging import abortable
+from http2_transport import HTTP2Adapter, http2_settings
+
+
+class PoolStats:
+    """Thread-safe counters for one upstream origin"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.new_connections = 0
+        self.waits = 0
+        self.idle_closed = 0
+        self.dns_lookups = 0
+        self.dns_cache_hits = 0
+        self.http2_streams = 0
+        self.http1_requests = 0
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'new_connections': self.new_connections,
+                'waits': self.waits,
+                'idle_closed': self.idle_closed,
+                'dns_lookups': self.dns_lookups,
+                'dns_cache_hits': self.dns_cache_hits,
+                'http2_streams': self.http2_streams,
+                'http1_requests': self.http1_requests
+            }
+
+
+class DNSCache:
+    """Small TTL cache in front of socket.getaddrinfo"""
+
+    def __init__(self, ttl: float, stats: PoolStats):
+        self.ttl = ttl
+        self.stats = stats
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, int], Tuple[float, List[str]]] = {}
+
+    def resolve(self, host: str, port: int) -> List[str]:
+        """Return the cached addresses for host:port, resolving if stale"""
+        if self.ttl <= 0:
+            return [host]
+
+        key = (host, port)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached and cached[0] > now:
+                self.stats.incr('dns_cache_hits')
+                return cached[1]
+
+        infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        addresses = []
+        for info in infos:
+            address = info[4][0]
+            if address not in addresses:
+                addresses.append(address)
+
+        self.stats.incr('dns_lookups')
+        with self._lock:
+            self._entries[key] = (now + self.ttl, addresses)
+        return addresses
+
+    def forget(self, host: str, port: int):
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+
+class _PooledConnectionMixin:
+    """Opens sockets through the origin's DNS cache and counts handshakes"""
+
+    pool_stats: Optional[PoolStats] = None
+    dns_cache: Optional[DNSCache] = None
+    last_used: float = 0.0
+
+    def _new_conn(self) -> socket.socket:
+        if self.dns_cache is None:
+            sock = super()._new_conn()
+        else:
+            sock = self._new_cached_conn()
+
+        if self.pool_stats is not None:
+            self.pool_stats.incr('new_connections')
+        return sock
+
+    def _new_cached_conn(self) -> socket.socket:
+        try:
+            addresses = self.dns_cache.resolve(self._dns_host, self.port)
+        except socket.gaierror as e:
+            raise NameResolutionError(self.host, self, e) from e
+
+        last_error: Optional[OSError] = None
+        for address in addresses:
+            try:
+                return urllib3_connection.create_connection(
+                    (address, self.port),
+                    self.timeout,
+                    source_address=self.source_address,
+                    socket_options=self.socket_options,
+                )
+            except socket.timeout as e:
+                last_error = e
+            except OSError as e:
+                last_error = e
+
+        # Every cached address failed - the record may have moved
+        self.dns_cache.forget(self._dns_host, self.port)
+        if isinstance(last_error, socket.timeout):
+            raise ConnectTimeoutError(
+                self, f"Connection to {self.host} timed out. (connect timeout={self.timeout})"
+            ) from last_error
+        raise NewConnectionError(self, f"Failed to establish a new connection: {last_error}") from last_error
+
+
+class PooledHTTPConnection(_PooledConnectionMixin, HTTPConnection):
+    pass
+
+
+class PooledHTTPSConnection(_PooledConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _PooledConnectionPoolMixin:
+    """Tracks reuse, waits and closes connections idle past keep-alive"""
+
+    pool_stats: Optional[PoolStats] = None
+    dns_cache: Optional[DNSCache] = None
+    idle_timeout: float = 0.0
+
+    def _new_conn(self):
+        conn = super()._new_conn()
+        conn.pool_stats = self.pool_stats
+        conn.dns_cache = self.dns_cache
+        return conn
+
+    def _get_conn(self, timeout: Optional[float] = None):
+        if self.block:
+            # requests never passes a pool timeout: bound the wait ourselves
+            waits = [wait for wait in (timeout, HTTP_POOL_CONFIG['pool_timeout'], deadline.remaining())
+                     if wait is not None]
+            timeout = max(0.0, min(waits)) if waits else None
+            if self.pool is not None and self.pool.empty():
+                self.pool_stats.incr('waits')
+
+        conn = super()._get_conn(timeout=timeout)
+
+        if getattr(conn, 'sock', None) is not None:
+            idle_for = time.monotonic() - conn.last_used
+            if self.idle_timeout > 0 and idle_for > self.idle_timeout:
+                # The server has most likely dropped it already; reconnect
+                # up front instead of failing on the first write.
+                conn.close()
+                self.pool_stats.incr('idle_closed')
+            else:
+                self.pool_stats.incr('hits')
+
+        # A winning hedge may abort this read (see hedging) until the connection comes back
+        hook = lambda: _abort_read(conn)
+        attempt = abortable(hook)
+        conn.hedge_hold = (attempt, hook) if attempt is not None else None
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn.last_used = time.monotonic()
+            hold = getattr(conn, 'hedge_hold', None)
+            if hold is not None:
+                conn.hedge_hold = None
+                hold[0].release(hold[1])
+        super()._put_conn(conn)
+
+
+def _abort_read(conn):
+    """Make a read blocked on `conn` fail now; urllib3 then discards the connection"""
+    sock = getattr(conn, 'sock', None)
+    if sock is not None:
+        try:
+            # socket.socket's own shutdown: SSLSocket.shutdown would drop the SSL object under the reader
+            socket.socket.shutdown(sock, socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class PooledHTTPConnectionPool(_PooledConnectionPoolMixin, HTTPConnectionPool):
+    ConnectionCls = PooledHTTPConnection
+
+
+class PooledHTTPSConnectionPool(_PooledConnectionPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = PooledHTTPSConnection
+
+
+class PooledPoolManager(PoolManager):
+    """PoolManager that wires stats, DNS cache and idle timeout into its pools"""
+
+    def __init__(self, pool_stats: PoolStats, dns_cache: DNSCache, idle_timeout: float, **kwargs):
+        super().__init__(**kwargs)
+        self.pool_stats = pool_stats
+        self.dns_cache = dns_cache
+        self.idle_timeout = idle_timeout
+        self.pool_classes_by_scheme = {
+            'http': PooledHTTPConnectionPool,
+            'https': PooledHTTPSConnectionPool
+        }
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        pool = super()._new_pool(scheme, host, port, request_context=request_context)
+        pool.pool_stats = self.pool_stats
+        pool.dns_cache = self.dns_cache
+        pool.idle_timeout = self.idle_timeout
+        return pool
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """requests adapter backed by a PooledPoolManager"""
+
+    def __init__(self, pool_stats: PoolStats, dns_cache: DNSCache, idle_timeout: float, **kwargs):
+        self.pool_stats = pool_stats
+        self.dns_cache = dns_cache
+        self.idle_timeout = idle_timeout
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = PooledPoolManager(
+            self.pool_stats,
+            self.dns_cache,
+            self.idle_timeout,
+            num_pools=connections,
+            maxsize=maxsize,
+            block=block,
+            **pool_kwargs
+        )
+
+    def send(self, request, *args, **kwargs):
+        try:
+            return super().send(request, *args, **kwargs)
+        except EmptyPoolError as e:
+            # Waited the bounded time for a pooled connection: a (retryable) connect timeout
+            raise requests.exceptions.ConnectTimeout(e, request=request)
+
+
+_sessions: Dict[str, requests.Session] = {}
+_stats: Dict[str, PoolStats] = {}
+_sessions_lock = threading.Lock()
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _build_session(origin: str, stats: PoolStats) -> requests.Session:
+    config = HTTP_POOL_CONFIG
+    session = requests.Session()
+
+    # The session is shared by every user of the process: never let a
+    # Set-Cookie from one user's response ride along on another's request.
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+    protocols = http2_settings(origin)
+    if protocols['http2']:
+        # One multiplexed connection carries the concurrent reads (see http2_transport)
+        adapter = HTTP2Adapter(stats, **protocols)
+    else:
+        adapter = PooledHTTPAdapter(
+            stats,
+            DNSCache(config['dns_cache_ttl'], stats),
+            config['keepalive_idle_timeout'],
+            pool_connections=1,
+            pool_maxsize=config['pool_maxsize'],
+            pool_block=config['pool_block']
+        )
+    # Record/replay for offline load tests (see cassette); no-op by default
+    session.mount(f"{origin}/", wrap_adapter(adapter))
+    return session
+
+
+def get_session(url: str) -> requests.Session:
+    """Return the shared, pooled session for the origin of `url`"""
+    origin = _origin(url)
+    session = _sessions.get(origin)
+    if session is not None:
+        return session
+
+    with _sessions_lock:
+        session = _sessions.get(origin)
+        if session is None:
+            stats = PoolStats()
+            session = _build_session(origin, stats)
+            _stats[origin] = stats
+            _sessions[origin] = session
+            protocol = 'HTTP/2' if http2_settings(origin)['http2'] else 'HTTP/1.1'
+            print(f"🔌 Created pooled {protocol} session for {origin} (maxsize={HTTP_POOL_CONFIG['pool_maxsize']})")
+    return session
+
+
+def get_pool_stats() -> Dict[str, Dict]:
+    """Return per-origin pool counters"""
+    with _sessions_lock:
+        return {origin: stats.snapshot() for origin, stats in _stats.items()}
+
+
+def close_all_sessions():
+    """Close every pooled session (tests, worker shutdown)"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _stats.clear()
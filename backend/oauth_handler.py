@@ -4,6 +4,9 @@ import secrets
 import json
 from typing import Dict, Optional
 
+import deadline
+from http_pool import get_session
+
 class EpicOAuthHandler:
     def __init__(self, config: Dict):
         self.config = config
@@ -40,15 +43,15 @@ class EpicOAuthHandler:
         }
         
         try:
-            response = requests.post(
+            response = get_session(self.config['token_url']).post(
                 self.config['token_url'], 
                 data=data, 
                 headers=headers,
-                timeout=30
+                timeout=deadline.timeout_for(self.config['token_timeout'])
             )
             response.raise_for_status()
             return response.json()
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, deadline.DeadlineExceeded) as e:
             print(f"Token exchange failed: {e}")
             return {'error': str(e)}
     
@@ -0,0 +1,142 @@
+"""
+Parallel expense transforms over worker processes, for offline backfills.
+
+The transforms in transformers are pure functions over dicts, but they run
+under the GIL. iter_transform_payloads() spreads raw JSON (searchset Bundle
+pages or NDJSON bulk-export chunks) over a worker pool: bytes pickle as a
+plain copy and the workers decode as well as transform, so both steps scale
+with cores. Results are yielded in order, with a bounded number of chunks in
+flight.
+
+Parsed, in-memory resources (eob_data in the Flask app) are transformed
+in-process instead. Shipping one to a worker (encoding it, and decoding the
+expense that comes back) costs about as much as the ~5us transform itself.
+
+There is one pool per process, started on first use and kept for the
+process's lifetime. Its workers start via forkserver (spawn where that is
+unavailable), never by forking the calling process, whose other threads
+may hold locks. They re-import __main__, so scripts using this need the
+usual `if __name__ == '__main__':` guard. Every wait for a chunk is
+bounded by the request deadline, or TRANSFORM_POOL_CONFIG['task_timeout']
+without one.
+"""
+
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from itertools import chain, islice
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import deadline
+from env_config import TRANSFORM_POOL_CONFIG
+from json_codec import loads
+from transformers import EXPENSE_FIELDS, expense_extractor, expense_fields, extract_patient_name
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _decode(payload: bytes, resource_type: str, ndjson: bool) -> List[Dict]:
+    if ndjson:
+        resources = [loads(line) for line in payload.splitlines() if line.strip()]
+    else:
+        resources = [entry.get('resource', {}) for entry in loads(payload).get('entry', [])]
+    return [resource for resource in resources if resource.get('resourceType') == resource_type]
+
+
+def _transform_payloads(payloads: List[bytes], resource_type: str, fields: Tuple[str, ...],
+                        context: Dict, ndjson: bool) -> List[Dict]:
+    """Worker: decode raw payloads and transform their resources"""
+    extract = expense_extractor(resource_type, fields).extract
+    return [extract(resource, context) for payload in payloads
+            for resource in _decode(payload, resource_type, ndjson)]
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """The process-wide transform pool (started on first use)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            _pool = ProcessPoolExecutor(TRANSFORM_POOL_CONFIG['workers'], mp_context=context)
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    """Drop a pool that lost a worker; the next call starts a fresh one"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _result(future, resource_type: str) -> List[Dict]:
+    left = deadline.remaining()
+    try:
+        return future.result(timeout=TRANSFORM_POOL_CONFIG['task_timeout'] if left is None else max(0.0, left))
+    except FutureTimeoutError:
+        if left is not None:
+            deadline.note_exceeded()
+            raise deadline.DeadlineExceeded(f"parallel {resource_type} transform ran out of time")
+        raise TimeoutError(f"parallel {resource_type} transform chunk took over "
+                           f"{TRANSFORM_POOL_CONFIG['task_timeout']}s")
+
+
+def iter_transform_payloads(payloads: Iterable[bytes], resource_type: str,
+                            fields: Optional[Sequence[str]] = None, patient: Optional[Dict] = None,
+                            ndjson: bool = False) -> Iterator[Dict]:
+    """Expenses from raw JSON payloads, in input order, for offline backfills
+
+    `payloads` are searchset Bundle pages, or NDJSON chunks (one resource per
+    line, as in a bulk export) with ndjson=True. Payloads are grouped into
+    tasks of about chunk_bytes, and at most two tasks per worker are in
+    flight. fhir_data cannot be selected, since these sources are not kept
+    in memory. Input that fits in one task, or a pool of one worker, is
+    transformed in-process. Raises TimeoutError (DeadlineExceeded under a
+    deadline) when a task takes too long.
+    """
+    config = TRANSFORM_POOL_CONFIG
+    fields = tuple(field for field in (expense_fields(fields) if fields is not None else EXPENSE_FIELDS)
+                   if field != 'fhir_data')
+    context = {'patient_name': extract_patient_name(patient or {}), 'references': None}
+
+    def chunks() -> Iterator[List[bytes]]:
+        chunk, size = [], 0
+        for payload in payloads:
+            chunk.append(payload)
+            size += len(payload)
+            if size >= config['chunk_bytes']:
+                yield chunk
+                chunk, size = [], 0
+        if chunk:
+            yield chunk
+
+    tasks = chunks()
+    head = list(islice(tasks, 2))
+    if len(head) < 2 or config['workers'] <= 1:
+        # Everything fits in one task (or there is one worker): no pool needed
+        for chunk in chain(head, tasks):
+            yield from _transform_payloads(chunk, resource_type, fields, context, ndjson)
+        return
+
+    pool = get_pool()
+    in_flight: deque = deque()
+    try:
+        for chunk in chain(head, tasks):
+            if len(in_flight) >= 2 * config['workers']:
+                yield from _result(in_flight.popleft(), resource_type)
+            in_flight.append(pool.submit(_transform_payloads, chunk, resource_type, fields, context, ndjson))
+        while in_flight:
+            yield from _result(in_flight.popleft(), resource_type)
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+    finally:
+        # Abandoned, failed or timed out: don't leave queued chunks running
+        for future in in_flight:
+            future.cancel()
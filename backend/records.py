@@ -0,0 +1,144 @@
+"""
+Compact records for expenses and patient summaries.
+
+A dict per expense pays for a hash table plus its keys (~270 bytes for a
+list-view expense). record_type() generates a class with one __slots__
+entry per field instead (~100 bytes), along with:
+
+- __json__(): the record as JSON text, written by one %-format of a
+  template whose keys are pre-encoded. Strings go through the C string
+  escaper and numbers through float repr, with no intermediate dict.
+  Values of other types (None, ints, nested objects) are written by the
+  slower per-value path. NaN and infinities, which JSON cannot represent,
+  are written as null. json_codec writes record lists this way with the
+  stdlib backend (see json_codec).
+- to_dict(): the dict form, for callers that still want one.
+- Read access by field name (record['amount'], get, keys), so code that
+  only reads expense dicts (and dict(record)) works unchanged.
+
+Record classes are cached per (name, fields, ...), so every record of one
+field selection shares a class, and records pickle by field values (for
+worker processes).
+"""
+
+import keyword
+import math
+from functools import lru_cache
+from json.encoder import encode_basestring
+from typing import Any, Tuple
+
+from json_codec import dumps_str
+
+
+def json_value(value: Any) -> str:
+    """JSON text for any one value (the slow path of __json__)"""
+    if value.__class__ is str:
+        return encode_basestring(value)
+    if value is None:
+        return 'null'
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if value.__class__ is int:
+        return int.__repr__(value)
+    if value.__class__ is float:
+        return float.__repr__(value) if math.isfinite(value) else 'null'
+    if hasattr(value.__class__, '__json__'):
+        return value.__json__()
+    return dumps_str(value)
+
+
+def finite_number(value: float) -> str:
+    """JSON text for a finite float (the fast path of __json__); TypeError for anything else"""
+    if math.isfinite(value):
+        return float.__repr__(value)
+    raise TypeError('not a finite float')
+
+
+class Record:
+    """Base of the generated record classes; see record_type()"""
+
+    __slots__ = ()
+    fields: Tuple[str, ...] = ()
+    spec: Tuple = ()
+
+    def keys(self) -> Tuple[str, ...]:
+        return self.fields
+
+    def __getitem__(self, field: str) -> Any:
+        if field not in self.fields:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def get(self, field: str, default: Any = None) -> Any:
+        return getattr(self, field) if field in self.fields else default
+
+    def __eq__(self, other: Any) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self.values() == other.values()
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({', '.join(f'{field}={value!r}' for field, value in zip(self.fields, self.values()))})"
+
+    def __reduce__(self):
+        return _restore, (self.spec, self.values())
+
+    def to_json(self) -> bytes:
+        """The record as UTF-8 JSON bytes"""
+        return self.__json__().encode('utf-8')
+
+
+def _restore(spec: Tuple, values: Tuple) -> Record:
+    return record_type(*spec)(*values)
+
+
+def record_type(name: str, fields: Tuple[str, ...], numbers: Tuple[str, ...] = (),
+                objects: Tuple[str, ...] = ()) -> type:
+    """Record class with one slot per field, in order (cached per arguments)
+
+    Fields are expected to hold strings, except `numbers` (finite floats, as
+    parsed FHIR decimals are) and `objects` (any value json_codec encodes).
+    Any field may also be None or hold another type; that record is then
+    written by the per-value path.
+    """
+    return _record_type(name, tuple(fields), tuple(numbers), tuple(objects))
+
+
+@lru_cache(maxsize=None)
+def _record_type(name: str, fields: Tuple[str, ...], numbers: Tuple[str, ...], objects: Tuple[str, ...]) -> type:
+    reserved = set(dir(Record)) | {'values', 'to_dict'}
+    for field in fields:
+        if not field.isidentifier() or keyword.iskeyword(field) or field in reserved:
+            raise ValueError(f"{field!r} cannot be a record field")
+
+    # Field names are identifiers, so the keys need no escaping for JSON or %
+    template = '{' + ','.join(f'"{field}":%s' for field in fields) + '}'
+    namespace = {'Record': Record, 'TEMPLATE': template, 'S': encode_basestring, 'N': finite_number,
+                 'O': dumps_str, 'V': json_value}
+    fast = {**{field: 'S' for field in fields}, **{field: 'N' for field in numbers}, **{field: 'O' for field in objects}}
+    attributes = [f"self.{field}" for field in fields]
+    lines = [
+        f"class {name}(Record):",
+        f"    __slots__ = {fields!r}",
+        f"    fields = {fields!r}",
+        f"    def __init__(self, {', '.join(fields)}):",
+        *[f"        self.{field} = {field}" for field in fields],
+        "    def values(self):",
+        f"        return ({''.join(f'{attribute}, ' for attribute in attributes)})",
+        "    def to_dict(self):",
+        f"        return {{{', '.join(f'{field!r}: self.{field}' for field in fields)}}}",
+        "    def __json__(self):",
+        "        try:",
+        f"            return TEMPLATE % ({''.join(f'{fast[field]}(self.{field}), ' for field in fields)})",
+        "        except TypeError:",
+        f"            return TEMPLATE % ({''.join(f'V(self.{field}), ' for field in fields)})",
+    ]
+    exec(compile('\n'.join(lines) + '\n', f"<record {name}>", 'exec'), namespace)
+    cls = namespace[name]
+    cls.spec = (name, fields, numbers, objects)
+    cls.__module__ = __name__
+    return cls
@@ -0,0 +1,322 @@
+"""
+Retry, backoff and circuit breaking for upstream FHIR calls.
+
+Policies are resolved per (host, resource type) from FHIR_RESILIENCE_CONFIG:
+the defaults, overlaid with any per-host entry, overlaid with any per-resource
+type entry. Idempotent requests are retried with exponential backoff and full
+jitter; 429/503 responses are retried after their Retry-After delay. Each
+(host, resource type) pair has a circuit breaker that fails fast once the
+upstream keeps failing and lets a few probe calls through after a cool-down.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import deadline
+from env_config import FHIR_RESILIENCE_CONFIG
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open"""
+
+    def __init__(self, key: Tuple[str, str], retry_in: float):
+        self.key = key
+        self.retry_in = retry_in
+        super().__init__(f"circuit open for {key[0]} {key[1] or '*'}; retry in {retry_in:.1f}s")
+
+
+class RetryPolicy:
+    """Retry/timeout settings for one (host, resource type)"""
+
+    def __init__(self, settings: Dict):
+        self.max_attempts = max(1, int(settings['max_attempts']))
+        self.backoff_base = float(settings['backoff_base'])
+        self.backoff_max = float(settings['backoff_max'])
+        self.retry_statuses = set(settings['retry_statuses'])
+        self.max_retry_after = float(settings['max_retry_after'])
+        self.connect_timeout = float(settings['connect_timeout'])
+        self.read_timeout = float(settings['read_timeout'])
+
+    @property
+    def timeout(self) -> Tuple[float, float]:
+        return (self.connect_timeout, self.read_timeout)
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff before retry number `attempt` (1-based)"""
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+    def retry_delay(self, attempt: int, headers) -> Optional[float]:
+        """Delay before retrying a retryable response, or None to give up
+
+        Retry-After (seconds or HTTP date) wins over backoff; a server
+        asking for longer than max_retry_after is not retried at all.
+        """
+        retry_after = headers.get('Retry-After') if headers is not None else None
+        if retry_after:
+            delay = parse_retry_after(retry_after)
+            if delay is not None:
+                return delay if delay <= self.max_retry_after else None
+        return self.backoff(attempt)
+
+
+def parse_retry_after(value: str) -> Optional[float]:
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """closed -> open after N consecutive failures -> half-open after a cool-down"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, key: Tuple[str, str], settings: Dict):
+        self.key = key
+        self.failure_threshold = int(settings['failure_threshold'])
+        self.reset_timeout = float(settings['reset_timeout'])
+        self.half_open_max_calls = int(settings['half_open_max_calls'])
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.half_open_in_flight = 0
+        self.times_opened = 0
+        self.short_circuited = 0
+        self.successes = 0
+        self.failures = 0
+
+    def before_call(self):
+        """Reserve a call slot or raise CircuitOpenError"""
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self.opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    self.short_circuited += 1
+                    raise CircuitOpenError(self.key, remaining)
+                self.state = self.HALF_OPEN
+                self.half_open_in_flight = 0
+                print(f"🟡 Circuit half-open for {self.key}")
+
+            if self.state == self.HALF_OPEN:
+                if self.half_open_in_flight >= self.half_open_max_calls:
+                    self.short_circuited += 1
+                    raise CircuitOpenError(self.key, 0.0)
+                self.half_open_in_flight += 1
+
+    def release(self):
+        """Give back a call slot whose outcome says nothing about the upstream"""
+        with self._lock:
+            if self.state == self.HALF_OPEN and self.half_open_in_flight > 0:
+                self.half_open_in_flight -= 1
+
+    def record_success(self):
+        with self._lock:
+            self.successes += 1
+            self.consecutive_failures = 0
+            if self.state == self.HALF_OPEN:
+                print(f"🟢 Circuit closed for {self.key}")
+                self.state = self.CLOSED
+                self.half_open_in_flight = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                    print(f"🔴 Circuit opened for {self.key} after {self.consecutive_failures} failure(s)")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.half_open_in_flight = 0
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'times_opened': self.times_opened,
+                'short_circuited': self.short_circuited,
+                'successes': self.successes,
+                'failures': self.failures
+            }
+
+
+class ResilienceRegistry:
+    """Resolves policies and owns the breakers for every (host, resource type)"""
+
+    def __init__(self, config: Dict):
+        self.config = config
+        self._lock = threading.Lock()
+        self._policies: Dict[Tuple[str, str], RetryPolicy] = {}
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self.retries = 0
+
+    def _settings(self, host: str, resource_type: str) -> Dict:
+        settings = dict(self.config['default'])
+        settings.update(self.config['hosts'].get(host, {}))
+        settings.update(self.config['resource_types'].get(resource_type, {}))
+        return settings
+
+    def policy(self, host: str, resource_type: str) -> RetryPolicy:
+        key = (host, resource_type)
+        policy = self._policies.get(key)
+        if policy is None:
+            with self._lock:
+                policy = self._policies.setdefault(key, RetryPolicy(self._settings(host, resource_type)))
+        return policy
+
+    def breaker(self, host: str, resource_type: str) -> CircuitBreaker:
+        key = (host, resource_type)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(key)
+                if breaker is None:
+                    breaker = CircuitBreaker(key, self._settings(host, resource_type))
+                    self._breakers[key] = breaker
+        return breaker
+
+    def count_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            breakers = list(self._breakers.values())
+            retries = self.retries
+        return {
+            'retries': retries,
+            'breakers': {f"{b.key[0]} {b.key[1] or '*'}": b.snapshot() for b in breakers}
+        }
+
+
+def is_breaker_failure(status_code: int) -> bool:
+    """Upstream trouble (5xx) trips the breaker; 4xx incl. 429 means it is answering"""
+    return status_code >= 500
+
+
+def _retry_delay(registry: ResilienceRegistry, policy: RetryPolicy, breaker: CircuitBreaker,
+                 attempt: int, attempts: int, response=None) -> Optional[float]:
+    """Record the outcome of one attempt; return the delay before the next one, or None to stop
+
+    `response` is None when the attempt raised a transient error.
+    """
+    if response is None:
+        breaker.record_failure()
+        delay = policy.backoff(attempt) if attempt < attempts else None
+    else:
+        if is_breaker_failure(response.status_code):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        if response.status_code not in policy.retry_statuses or attempt == attempts:
+            return None
+        delay = policy.retry_delay(attempt, response.headers)
+
+    left = deadline.remaining()
+    if delay is not None and left is not None and delay >= left:
+        # The next attempt would not fit in the request's budget
+        deadline.note_exceeded()
+        delay = None
+    if delay is not None:
+        registry.count_retry()
+        print(f"🔁 Retrying {breaker.key[1] or breaker.key[0]} in {delay:.2f}s (attempt {attempt + 1}/{attempts})")
+    return delay
+
+
+def _cut_by_deadline(breaker: CircuitBreaker, timeout: Tuple[float, float], policy: RetryPolicy) -> bool:
+    """Whether a timeout came from our shortened deadline rather than the upstream"""
+    if timeout == policy.timeout or (deadline.remaining() or 0) > 0.05:
+        return False
+    breaker.release()
+    deadline.note_exceeded()
+    return True
+
+
+def call_with_retries(host: str, resource_type: str, send: Callable[[Tuple[float, float]], object],
+                      idempotent: bool = True, transient_errors: Tuple[type, ...] = ()):
+    """Run `send(timeout)` under the (host, resource type) retry policy and breaker
+
+    `send` returns a response with status_code/headers or raises one of
+    `transient_errors` (connection failures, timeouts), which are retried
+    for idempotent calls. The last response is returned even if it is still
+    retryable and the last transient error is re-raised. Raises
+    CircuitOpenError when the breaker refuses the call. Each attempt's
+    timeout is clamped to the request deadline (see deadline); once the
+    budget is spent, DeadlineExceeded is raised instead of trying again.
+    """
+    policy = registry.policy(host, resource_type)
+    breaker = registry.breaker(host, resource_type)
+    attempts = policy.max_attempts if idempotent else 1
+
+    for attempt in range(1, attempts + 1):
+        timeout = deadline.timeout_for(policy.timeout)
+        breaker.before_call()
+        try:
+            response = send(timeout)
+        except transient_errors as e:
+            if _cut_by_deadline(breaker, timeout, policy):
+                raise deadline.DeadlineExceeded('request deadline exceeded') from e
+            delay = _retry_delay(registry, policy, breaker, attempt, attempts)
+            if delay is None:
+                raise
+        except BaseException:
+            # Not an upstream outcome (a bug, cancellation); a half-open slot must not leak
+            breaker.release()
+            raise
+        else:
+            delay = _retry_delay(registry, policy, breaker, attempt, attempts, response)
+            if delay is None:
+                return response
+            # Give the connection back before waiting (matters for streamed responses)
+            response.close()
+        time.sleep(delay)
+
+
+async def acall_with_retries(host: str, resource_type: str, send: Callable[[Tuple[float, float]], Awaitable],
+                             idempotent: bool = True, transient_errors: Tuple[type, ...] = ()):
+    """asyncio version of call_with_retries; `send` is a coroutine function"""
+    policy = registry.policy(host, resource_type)
+    breaker = registry.breaker(host, resource_type)
+    attempts = policy.max_attempts if idempotent else 1
+
+    for attempt in range(1, attempts + 1):
+        timeout = deadline.timeout_for(policy.timeout)
+        breaker.before_call()
+        try:
+            response = await send(timeout)
+        except transient_errors as e:
+            if _cut_by_deadline(breaker, timeout, policy):
+                raise deadline.DeadlineExceeded('request deadline exceeded') from e
+            delay = _retry_delay(registry, policy, breaker, attempt, attempts)
+            if delay is None:
+                raise
+        except BaseException:
+            breaker.release()
+            raise
+        else:
+            delay = _retry_delay(registry, policy, breaker, attempt, attempts, response)
+            if delay is None:
+                return response
+        await asyncio.sleep(delay)
+
+
+# Shared by the sync and async clients so both see the same breaker state
+registry = ResilienceRegistry(FHIR_RESILIENCE_CONFIG)
+
+
+def get_resilience_stats() -> Dict:
+    """Retry count and per-(host, resource type) breaker state"""
+    return registry.stats()
@@ -0,0 +1,368 @@
+"""
+Two-tier FHIR resource cache: an in-process LRU in front of a SQLite file.
+
+Resources are stored by (scope, resource type, id) together with their
+meta.versionId. `scope` gates access: patient data is stored under the
+caller's cache scope (base URL + patient + token scope) and only served back
+to the same scope; shared resources (Organization, Practitioner) use the
+base URL's shared scope. Each resource type has its own TTL.
+
+The disk tier uses WAL mode so several worker processes on one host can
+share it, and it survives restarts. Besides resources it keeps a "sync mark"
+per patient search (watermark + ids of a complete incremental sync) so a
+restarted worker can resume _lastUpdated deltas instead of re-pulling every
+patient's full history from Epic. Projected (_elements) searches are
+partial resources: they are stored, with their own sync marks, under a scope
+of their own and never served as full resources.
+
+The file holds patient data, so the store creates its directory 0700 and
+the database 0600 before SQLite opens it (SQLite's -wal/-shm files copy the
+database's permissions); an existing file is narrowed to 0600.
+
+Both tiers are bounded by entry count and bytes; the disk tier drops
+expired rows first, then the least recently used. Any SQLite error degrades
+to a cache miss. A file that cannot be created or opened disables the disk
+tier for the life of the process, with one warning.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+from json_codec import dumps, loads
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS resources (
+        scope TEXT NOT NULL,
+        resource_type TEXT NOT NULL,
+        id TEXT NOT NULL,
+        version_id TEXT,
+        patient TEXT,
+        body BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        stored_at REAL NOT NULL,
+        expires_at REAL NOT NULL,
+        accessed_at REAL NOT NULL,
+        PRIMARY KEY (scope, resource_type, id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS resources_by_patient ON resources (scope, patient, resource_type)",
+    "CREATE INDEX IF NOT EXISTS resources_by_access ON resources (accessed_at)",
+    """CREATE TABLE IF NOT EXISTS sync_marks (
+        scope TEXT NOT NULL,
+        patient TEXT NOT NULL,
+        resource_type TEXT NOT NULL,
+        watermark TEXT NOT NULL,
+        full_synced_at REAL NOT NULL,
+        ids BLOB NOT NULL,
+        PRIMARY KEY (scope, patient, resource_type)
+    )"""
+)
+
+
+class _MemoryEntry:
+    __slots__ = ('body', 'version_id', 'size', 'expires_at')
+
+    def __init__(self, body: Dict, version_id: Optional[str], size: int, expires_at: float):
+        self.body = body
+        self.version_id = version_id
+        self.size = size
+        self.expires_at = expires_at
+
+
+class ResourceStore:
+    """LRU (memory) + SQLite (disk) cache of individual FHIR resources"""
+
+    def __init__(self, path: str, ttl_by_type: Dict[str, float], default_ttl: float,
+                 memory_max_entries: int, memory_max_bytes: int,
+                 disk_max_entries: int, disk_max_bytes: int, prune_every: int = 500):
+        self.path = path
+        self.ttl_by_type = ttl_by_type
+        self.default_ttl = default_ttl
+        self.memory_max_entries = memory_max_entries
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_entries = disk_max_entries
+        self.disk_max_bytes = disk_max_bytes
+        self.prune_every = prune_every
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[Hashable, _MemoryEntry]" = OrderedDict()
+        self._memory_bytes = 0
+        self._local = threading.local()
+        self._puts_since_prune = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.memory_evictions = 0
+        self.disk_evictions = 0
+        self.disk_errors = 0
+        self.disk_disabled = False
+
+    # -- SQLite plumbing ------------------------------------------------------
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        """This thread's connection (sqlite3 connections are not shared across threads)
+
+        None when there is no disk tier: no path, or the file could not be
+        opened, after which the store stays memory-only.
+        """
+        if not self.path or self.disk_disabled:
+            return None
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            try:
+                self._create_private()
+                conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('PRAGMA synchronous=NORMAL')
+                for statement in _SCHEMA:
+                    conn.execute(statement)
+            except (OSError, sqlite3.Error) as e:
+                if conn is not None:
+                    conn.close()
+                self._disable_disk(e)
+                return None
+            self._local.conn = conn
+        return conn
+
+    def _disable_disk(self, e: Exception):
+        """Opening the file failed: stop trying (and warning) on every call"""
+        with self._lock:
+            if self.disk_disabled:
+                return
+            self.disk_disabled = True
+            self.disk_errors += 1
+        print(f"⚠️ Resource store cannot open {self.path} ({e}); keeping resources in memory only")
+
+    def _create_private(self):
+        """Create the directory (0700) and database file (0600) with owner-only access"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            os.fchmod(fd, 0o600)
+        finally:
+            os.close(fd)
+
+    def _disk_failed(self, e: Exception):
+        with self._lock:
+            self.disk_errors += 1
+        print(f"⚠️ Resource store disk tier unavailable: {e}")
+
+    # -- memory tier ----------------------------------------------------------
+
+    def _remember(self, key: Tuple, entry: _MemoryEntry):
+        if entry.size > self.memory_max_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= previous.size
+            self._memory[key] = entry
+            self._memory_bytes += entry.size
+            while self._memory and (len(self._memory) > self.memory_max_entries
+                                    or self._memory_bytes > self.memory_max_bytes):
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted.size
+                self.memory_evictions += 1
+
+    def ttl(self, resource_type: str) -> float:
+        return self.ttl_by_type.get(resource_type, self.default_ttl)
+
+    # -- public API -----------------------------------------------------------
+
+    def get(self, scope: str, resource_type: str, resource_id: str,
+            version_id: Optional[str] = None) -> Optional[Dict]:
+        """Fresh copy of a resource stored under `scope`, or None
+
+        With `version_id`, only that exact version is returned.
+        """
+        key = (scope, resource_type, resource_id)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry.expires_at > now and version_id in (None, entry.version_id):
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return entry.body
+
+        row = None
+        try:
+            db = self._db()
+            if db is not None:
+                row = db.execute(
+                    "SELECT body, version_id, size, expires_at FROM resources "
+                    "WHERE scope = ? AND resource_type = ? AND id = ? AND expires_at > ?",
+                    key + (now,)
+                ).fetchone()
+                if row is not None and version_id in (None, row[1]):
+                    db.execute("UPDATE resources SET accessed_at = ? WHERE scope = ? AND resource_type = ? AND id = ?",
+                               (now,) + key)
+        except sqlite3.Error as e:
+            self._disk_failed(e)
+            row = None
+
+        if row is None or version_id not in (None, row[1]):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        body = loads(row[0])
+        self._remember(key, _MemoryEntry(body, row[1], row[2], row[3]))
+        with self._lock:
+            self.disk_hits += 1
+        return body
+
+    def put_many(self, scope: str, resources: Iterable[Dict], patient: Optional[str] = None):
+        """Store resources under `scope` (write-through to both tiers)"""
+        now = time.time()
+        rows = []
+        for resource in resources:
+            resource_type = resource.get('resourceType')
+            resource_id = resource.get('id')
+            ttl = self.ttl(resource_type)
+            if not resource_type or not resource_id or ttl <= 0:
+                continue
+            body = dumps(resource)
+            version_id = resource.get('meta', {}).get('versionId')
+            self._remember((scope, resource_type, resource_id),
+                           _MemoryEntry(resource, version_id, len(body), now + ttl))
+            rows.append((scope, resource_type, resource_id, version_id, patient, body, len(body), now, now + ttl, now))
+        if not rows:
+            return
+
+        try:
+            db = self._db()
+            if db is None:
+                return
+            db.executemany(
+                "INSERT OR REPLACE INTO resources "
+                "(scope, resource_type, id, version_id, patient, body, size, stored_at, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        except sqlite3.Error as e:
+            self._disk_failed(e)
+            return
+
+        with self._lock:
+            self._puts_since_prune += len(rows)
+            due = self._puts_since_prune >= self.prune_every
+            if due:
+                self._puts_since_prune = 0
+        if due:
+            self.prune()
+
+    def put(self, scope: str, resource: Dict, patient: Optional[str] = None):
+        self.put_many(scope, [resource], patient)
+
+    def prune(self):
+        """Bring the disk tier back under its entry and byte limits"""
+        try:
+            db = self._db()
+            if db is None:
+                return
+            count, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM resources").fetchone()
+            if count <= self.disk_max_entries and total <= self.disk_max_bytes:
+                return
+
+            excess_count = count - self.disk_max_entries
+            excess_bytes = total - self.disk_max_bytes
+            victims = []
+            # Expired rows go first, then least recently used
+            for rowid, size in db.execute(
+                    "SELECT rowid, size FROM resources ORDER BY expires_at > ?, accessed_at", (time.time(),)):
+                if excess_count <= 0 and excess_bytes <= 0:
+                    break
+                victims.append((rowid,))
+                excess_count -= 1
+                excess_bytes -= size
+            db.executemany("DELETE FROM resources WHERE rowid = ?", victims)
+        except sqlite3.Error as e:
+            self._disk_failed(e)
+            return
+        with self._lock:
+            self.disk_evictions += len(victims)
+        print(f"🧹 Resource store pruned {len(victims)} row(s)")
+
+    def save_sync_mark(self, scope: str, patient: str, resource_type: str, watermark: str,
+                       full_synced_at: float, ids: List[str]):
+        """Record a complete incremental sync so another process can resume from it"""
+        try:
+            db = self._db()
+            if db is not None:
+                db.execute("INSERT OR REPLACE INTO sync_marks VALUES (?, ?, ?, ?, ?, ?)",
+                           (scope, patient, resource_type, watermark, full_synced_at, dumps(sorted(ids))))
+        except sqlite3.Error as e:
+            self._disk_failed(e)
+
+    def load_sync_mark(self, scope: str, patient: str, resource_type: str) -> Optional[Tuple[str, float, List[Dict]]]:
+        """(watermark, full_synced_at, resources) of the last complete sync, if every resource is still stored
+
+        Stored rows are used regardless of TTL: the caller only treats them as
+        a baseline for a _lastUpdated delta.
+        """
+        try:
+            db = self._db()
+            if db is None:
+                return None
+            mark = db.execute(
+                "SELECT watermark, full_synced_at, ids FROM sync_marks "
+                "WHERE scope = ? AND patient = ? AND resource_type = ?",
+                (scope, patient, resource_type)
+            ).fetchone()
+            if mark is None:
+                return None
+            ids = set(loads(mark[2]))
+            rows = db.execute(
+                "SELECT id, body FROM resources WHERE scope = ? AND patient = ? AND resource_type = ?",
+                (scope, patient, resource_type)
+            ).fetchall()
+        except sqlite3.Error as e:
+            self._disk_failed(e)
+            return None
+
+        resources = [loads(body) for resource_id, body in rows if resource_id in ids]
+        if len(resources) != len(ids):
+            # Part of the set was evicted; a full sync is needed
+            return None
+        return mark[0], mark[1], resources
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        try:
+            db = self._db()
+            if db is not None:
+                db.execute("DELETE FROM resources")
+                db.execute("DELETE FROM sync_marks")
+        except sqlite3.Error as e:
+            self._disk_failed(e)
+
+    def stats(self) -> Dict:
+        disk = {'entries': 0, 'bytes': 0}
+        try:
+            db = self._db()
+            if db is not None:
+                disk['entries'], disk['bytes'] = db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM resources").fetchone()
+        except sqlite3.Error as e:
+            self._disk_failed(e)
+        with self._lock:
+            return {
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'disk_entries': disk['entries'],
+                'disk_bytes': disk['bytes'],
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'memory_evictions': self.memory_evictions,
+                'disk_evictions': self.disk_evictions,
+                'disk_errors': self.disk_errors,
+                'disk_disabled': self.disk_disabled
+            }
@@ -1,17 +1,27 @@
-from flask import Flask, jsonify, request, Response, session, redirect, url_for, make_response
+from flask import Flask, jsonify, request, Response, session, redirect, url_for, make_response, g
 from flask_cors import CORS
-import json
+import re
 import time
 import threading
 import os
 
 # Import our new modules
-from env_config import EPIC_CONFIG, TEST_PATIENTS, TEST_USERS, DEMO_CONFIG
+import deadline
+from env_config import EPIC_CONFIG, TEST_PATIENTS, TEST_USERS, DEMO_CONFIG, DEADLINE_CONFIG
 from oauth_handler import EpicOAuthHandler
-from fhir_client import EpicFHIRClient
-from transformers import transform_any_eob_data_to_expenses, transform_patient_data
+from fhir_client import EpicFHIRClient, get_cache_stats
+from cassette import get_cassette_stats
+from categorization import get_categorization_stats
+from hedging import get_hedging_stats
+from http_pool import get_pool_stats
+from json_codec import CodecJSONProvider, dumps_str
+from resilience import get_resilience_stats
+from singleflight import get_singleflight_stats
+from transformers import (DEFAULT_EXPENSE_FIELDS, EXPENSE_MAPPINGS, expense_elements, expense_fields, patient_summary,
+                          transform_any_eob_data_to_expenses)
 
 app = Flask(__name__)
+app.json = CodecJSONProvider(app)
 CORS(app, supports_credentials=True)
 
 # Configure session
@@ -27,6 +37,27 @@ mock_state = {
     'current_user': None
 }
 
+@app.before_request
+def start_deadline():
+    """Start the request's deadline budget: the client's header (capped) or the route default"""
+    config = DEADLINE_CONFIG
+    if not config['enabled'] or request.endpoint in (None, 'events', 'static'):
+        return
+    seconds = config['routes'].get(request.endpoint, config['default_seconds'])
+    requested = request.headers.get(config['header'])
+    if requested:
+        try:
+            seconds = float(requested) / 1000
+        except ValueError:
+            pass
+    g.deadline_token = deadline.start(max(0.0, min(seconds, config['max_seconds'])))
+
+@app.teardown_request
+def end_deadline(exc=None):
+    token = g.pop('deadline_token', None)
+    if token is not None:
+        deadline.end(token)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -38,6 +69,20 @@ def health_check():
         'epic_sandbox': 'configured'
     })
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Upstream transport metrics"""
+    return jsonify({
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'http_pool': get_pool_stats(),
+        'caches': get_cache_stats(),
+        'resilience': get_resilience_stats(),
+        'singleflight': get_singleflight_stats(),
+        'hedging': get_hedging_stats(),
+        'cassette': get_cassette_stats(),
+        'categorization': get_categorization_stats()
+    })
+
 @app.route('/auth/epic', methods=['GET'])
 def epic_auth():
     """Initiate Epic OAuth flow - returns OAuth URL for frontend to open in new window"""
@@ -58,6 +103,7 @@ def epic_auth():
             # Store mock token info in session
             session['access_token'] = mock_token_info['access_token']
             session['patient_id'] = mock_token_info['patient_id']
+            session['token_scope'] = mock_token_info['scope']
             session['token_expires'] = time.time() + mock_token_info['expires_in']
             
             print(f"✅ Mock OAuth successful - Patient ID: {mock_token_info['patient_id']}")
@@ -134,6 +180,7 @@ def epic_oauth_callback():
         # Store token in session
         session['access_token'] = token_info['access_token']
         session['patient_id'] = token_info.get('patient_id', DEMO_CONFIG['mock_patient_id'])
+        session['token_scope'] = token_info.get('scope')
         session['token_expires'] = time.time() + token_info.get('expires_in', 3600)
         
         print(f"✅ OAuth successful - Patient ID: {session['patient_id']}")
@@ -432,6 +479,7 @@ def auth_callback():
         token_info = oauth_handler.get_token_info(token_response)
         session['access_token'] = token_info['access_token']
         session['patient_id'] = token_info['patient_id']
+        session['token_scope'] = token_info.get('scope')
         session['token_expires'] = time.time() + token_info['expires_in']
         
         print(f"✅ OAuth successful - Patient ID: {token_info['patient_id']}")
@@ -464,29 +512,67 @@ def get_expenses():
         print(f"🔍 Fetching EOB data for patient: {patient_id}")
         
         # Initialize FHIR client
-        fhir_client = EpicFHIRClient(EPIC_CONFIG['fhir_base_url'], access_token)
-        
-        # Fetch patient data first
-        patient = fhir_client.get_patient(patient_id)
+        fhir_client = EpicFHIRClient(
+            EPIC_CONFIG['fhir_base_url'],
+            access_token,
+            patient_id=patient_id,
+            scope=session.get('token_scope')
+        )
+        
+        # Sparse fieldset: ?fields=id,date,amount. The raw resource (fhir_data)
+        # is opt-in, via fields or include_fhir_data=true; otherwise only the
+        # elements the selected fields read are requested upstream
+        requested = [name.strip() for name in request.args.get('fields', '').split(',') if name.strip()]
+        requested = requested or list(DEFAULT_EXPENSE_FIELDS)
+        if request.args.get('include_fhir_data', 'false').lower() == 'true':
+            requested.append('fhir_data')
+        try:
+            fields = expense_fields(requested)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # FOCUSED APPROACH: Patient, EOB and Claim fallback fetched concurrently
+        patient, eob_data = fhir_client.get_patient_and_eob_data(
+            patient_id,
+            elements=expense_elements(fields)
+        )
         if 'error' in patient:
             print(f"❌ Failed to fetch patient: {patient['error']}")
+            if deadline.exceeded():
+                return jsonify({'error': 'Upstream request deadline exceeded'}), 504
             return jsonify({'error': 'Failed to fetch patient data'}), 500
         
-        # FOCUSED APPROACH: Get EOB data with fallback strategy
-        eob_data = fhir_client.get_eob_data(patient_id)
+        if eob_data['count'] == 0 and deadline.exceeded():
+            print("⏱️ Deadline reached before any EOB or Claim data arrived")
+            return jsonify({
+                'error': 'Upstream request deadline exceeded',
+                'patient': patient_summary(patient),
+                'expenses': [],
+                'source': 'none',
+                'partial': True
+            }), 504
+        
+        # Why the history may be cut short: a search truncated at its page or
+        # resource budget, a failed page, or the request deadline
+        partial_reasons = list(eob_data.get('incomplete', []))
+        if deadline.exceeded():
+            partial_reasons.append('request deadline exceeded')
         
         if eob_data['count'] == 0:
             print("❌ No EOB or Claim data found")
             return jsonify({
                 'error': 'No EOB data available',
-                'patient': transform_patient_data(patient),
+                'patient': patient_summary(patient),
                 'expenses': [],
-                'source': 'none'
+                'source': 'none',
+                'partial': bool(partial_reasons),
+                'partial_reasons': partial_reasons
             }), 404
         
-        # Transform EOB data to expenses
-        expenses = transform_any_eob_data_to_expenses(eob_data, patient)
-        patient_info = transform_patient_data(patient)
+        # Transform EOB data to expense records; jsonify writes them straight
+        # to JSON (see records)
+        expenses = transform_any_eob_data_to_expenses(eob_data, patient, fields, records=True)
+        patient_info = patient_summary(patient)
         
         print(f"✅ Successfully processed {len(expenses)} expenses from {eob_data['source']}")
         
@@ -495,6 +581,9 @@ def get_expenses():
             'expenses': expenses,
             'source': eob_data['source'],
             'count': eob_data['count'],
+            # True when stale or incomplete data was used; see partial_reasons
+            'partial': bool(partial_reasons),
+            'partial_reasons': partial_reasons,
             'fhir_patient_id': patient_id,
             'message': f'Successfully fetched {len(expenses)} expenses from {eob_data["source"]}'
         })
@@ -503,6 +592,55 @@ def get_expenses():
         print(f"❌ Error fetching expenses: {e}")
         return jsonify({'error': 'Failed to fetch expenses'}), 500
 
+FHIR_ID = re.compile(r'^[A-Za-z0-9\-.]{1,64}$')
+
+@app.route('/api/expenses/<expense_id>/fhir', methods=['GET'])
+def get_expense_fhir(expense_id):
+    """Raw FHIR resource behind one expense (its fhir_data), fetched on demand
+    
+    ?source= is the expense list's source (ExplanationOfBenefit or Claim).
+    Reads are served from the resource store or response cache when the
+    resource was fetched recently, and revalidated upstream otherwise.
+    """
+    try:
+        access_token = session.get('access_token')
+        patient_id = session.get('patient_id')
+        
+        if not access_token or not patient_id:
+            return jsonify({'error': 'Not authenticated'}), 401
+        
+        if time.time() > session.get('token_expires', 0):
+            session.clear()
+            return jsonify({'error': 'Token expired'}), 401
+        
+        source = request.args.get('source', 'ExplanationOfBenefit')
+        if source not in EXPENSE_MAPPINGS or not FHIR_ID.match(expense_id):
+            return jsonify({'error': 'Unknown expense'}), 400
+        
+        fhir_client = EpicFHIRClient(
+            EPIC_CONFIG['fhir_base_url'],
+            access_token,
+            patient_id=patient_id,
+            scope=session.get('token_scope')
+        )
+        resource = fhir_client.get_resource(source, expense_id)
+        if 'error' in resource:
+            print(f"❌ Failed to fetch {source}/{expense_id}: {resource['error']}")
+            if deadline.exceeded():
+                return jsonify({'error': 'Upstream request deadline exceeded'}), 504
+            return jsonify({'error': 'Expense not found'}), 404
+        
+        # Only the signed-in patient's own resources
+        reference = resource.get('patient', {}).get('reference', '')
+        if reference.split('/')[-2:] != ['Patient', patient_id]:
+            return jsonify({'error': 'Expense not found'}), 404
+        
+        return jsonify(resource)
+        
+    except Exception as e:
+        print(f"❌ Error fetching expense FHIR data: {e}")
+        return jsonify({'error': 'Failed to fetch expense FHIR data'}), 500
+
 @app.route('/api/test-eob', methods=['GET'])
 def test_eob_apis():
     """Test EOB APIs specifically for debugging"""
@@ -518,7 +656,12 @@ def test_eob_apis():
         print(f"🧪 Testing EOB APIs for patient: {patient_id}")
         
         # Initialize FHIR client
-        fhir_client = EpicFHIRClient(EPIC_CONFIG['fhir_base_url'], access_token)
+        fhir_client = EpicFHIRClient(
+            EPIC_CONFIG['fhir_base_url'],
+            access_token,
+            patient_id=patient_id,
+            scope=session.get('token_scope')
+        )
         
         # Test ExplanationOfBenefit API
         print("📊 Testing ExplanationOfBenefit API...")
@@ -707,7 +850,7 @@ def events():
                 'source': 'Verified by Provider'
             }
         }
-        yield f"data: {json.dumps(event_data)}\n\n"
+        yield f"data: {dumps_str(event_data)}\n\n"
     
     return Response(generate(), mimetype='text/event-stream')
 
@@ -0,0 +1,142 @@
+"""
+Request coalescing ("singleflight") for identical in-flight FHIR reads.
+
+When several callers ask for the same key while a call for it is already
+running, only the first (the leader) starts the work; everyone waits for it
+and receives the same result or exception. Nothing is cached once the call
+finishes - that is the response cache's job.
+
+The leader's call runs under the leader's deadline, so no call outlives the
+budget of the request that made it. Followers wait at most their own
+timeout. When the leader runs out of time (TimeoutError, which includes
+DeadlineExceeded), that result is not shared: a follower with time left
+becomes the next leader and calls again under its own deadline.
+
+`reads` serves the threaded EpicFHIRClient and `async_reads` the asyncio
+client; keys are (token identity, url, params).
+"""
+
+import asyncio
+import threading
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _FlightStats:
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def _count(self, leader: bool):
+        with self._stats_lock:
+            if leader:
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            calls = self.leaders + self.followers
+            return {
+                'upstream_calls': self.leaders,
+                'coalesced': self.followers,
+                'coalescing_rate': round(self.followers / calls, 4) if calls else 0.0
+            }
+
+
+class SingleFlight(_FlightStats):
+    """Thread-based singleflight"""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """Run fn() once for all concurrent callers of `key`
+
+        The leader runs fn() on its own thread, under its own deadline.
+        Followers wait at most `timeout` seconds and raise TimeoutError after
+        that. A TimeoutError from the leader's call only says the leader ran
+        out of time, so followers still waiting take over and call again.
+        """
+        expires_at = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+            self._count(leader)
+
+            if leader:
+                try:
+                    call.result = fn()
+                    return call.result
+                except BaseException as e:
+                    call.error = e
+                    raise
+                finally:
+                    with self._lock:
+                        del self._calls[key]
+                    call.done.set()
+
+            wait = None if expires_at is None else max(0.0, expires_at - time.monotonic())
+            if not call.done.wait(wait):
+                raise TimeoutError(f"timed out waiting for in-flight call {key!r}")
+            if isinstance(call.error, TimeoutError):
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+
+class AsyncSingleFlight(_FlightStats):
+    """asyncio singleflight; in-flight calls are tracked per event loop"""
+
+    def __init__(self):
+        super().__init__()
+        self._calls: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Hashable, asyncio.Task]]" = weakref.WeakKeyDictionary()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable], timeout: Optional[float] = None) -> Any:
+        """async version of SingleFlight.do"""
+        loop = asyncio.get_running_loop()
+        calls = self._calls.setdefault(loop, {})
+        expires_at = None if timeout is None else loop.time() + timeout
+        while True:
+            task = calls.get(key)
+            leader = task is None
+            if leader:
+                # The work runs as its own task (in the leader's context, so
+                # under its deadline) so that cancelling the leader does not
+                # cancel it for the others.
+                task = calls[key] = asyncio.ensure_future(fn())
+                task.add_done_callback(lambda done, key=key: calls.pop(key, None) if calls.get(key) is done else None)
+            self._count(leader)
+            try:
+                if expires_at is None:
+                    return await asyncio.shield(task)
+                return await asyncio.wait_for(asyncio.shield(task), max(0.0, expires_at - loop.time()))
+            except TimeoutError:
+                if leader or not task.done() or task.cancelled() or not isinstance(task.exception(), TimeoutError):
+                    raise
+
+
+reads = SingleFlight()
+async_reads = AsyncSingleFlight()
+
+
+def get_singleflight_stats() -> Dict:
+    """Coalescing counters for the threaded and async clients"""
+    return {'threaded': reads.stats(), 'async': async_reads.stats()}
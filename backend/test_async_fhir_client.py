@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Test AsyncEpicFHIRClient
+Runs searches and fan-out against an in-process httpx mock upstream
+"""
+
+import asyncio
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+
+import async_fhir_client
+from async_fhir_client import AsyncEpicFHIRClient, close_async_clients
+from env_config import FHIR_SEARCH_CONFIG
+
+
+def searchset(origin: str, request: httpx.Request, total: int, page_size: int = 5):
+    """One page of a paged searchset of EOBs, with a next link while more remain"""
+    offset = int(parse_qs(urlsplit(str(request.url)).query).get('_offset', ['0'])[0])
+    bundle = {
+        'resourceType': 'Bundle',
+        'type': 'searchset',
+        'entry': [{'resource': {'resourceType': 'ExplanationOfBenefit', 'id': f'eob{i}'}}
+                  for i in range(offset, min(offset + page_size, total))],
+        'link': []
+    }
+    if offset + page_size < total:
+        bundle['link'].append({'relation': 'next',
+                               'url': f"{origin}/fhir/ExplanationOfBenefit?patient=p1&_offset={offset + page_size}"})
+    return httpx.Response(200, json=bundle)
+
+
+def run(origin: str, handler, scenario):
+    """Run scenario(client) with the pooled client for `origin` answered by `handler`"""
+    async def main():
+        upstream = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        async_fhir_client._clients[asyncio.get_running_loop()] = {origin: upstream}
+        try:
+            return await scenario(AsyncEpicFHIRClient(f"{origin}/fhir", 'token'))
+        finally:
+            await close_async_clients()
+    return asyncio.run(main())
+
+
+def test_search_follows_next_links():
+    origin = 'https://paging.fhir.test'
+    eobs = run(origin, lambda request: searchset(origin, request, total=12),
+               lambda client: client.get_explanation_of_benefits('p1'))
+    assert [eob['id'] for eob in eobs] == [f'eob{i}' for i in range(12)]
+
+
+def test_search_truncation_is_reported():
+    origin = 'https://truncated.fhir.test'
+    handler = lambda request: searchset(origin, request, total=30)
+
+    async def scenario(client):
+        by_resources, by_pages = [], []
+        resources = [eob async for eob in client.iter_search('ExplanationOfBenefit', {'patient': 'p1'},
+                                                              max_resources=7, errors=by_resources)]
+        pages = [eob async for eob in client.iter_search('ExplanationOfBenefit', {'patient': 'p1'},
+                                                          max_pages=2, errors=by_pages)]
+        return resources, by_resources, pages, by_pages
+
+    resources, by_resources, pages, by_pages = run(origin, handler, scenario)
+    assert len(resources) == 7 and by_resources == ['truncated at max_resources=7']
+    assert len(pages) == 10 and by_pages == ['truncated at max_pages=2']
+
+    original = FHIR_SEARCH_CONFIG['max_resources']
+    FHIR_SEARCH_CONFIG['max_resources'] = 7
+    try:
+        eob_data = run(origin, handler, lambda client: client.get_eob_data('p1'))
+    finally:
+        FHIR_SEARCH_CONFIG['max_resources'] = original
+    assert eob_data['count'] == 7
+    assert eob_data['incomplete'] == ['ExplanationOfBenefit search truncated at max_resources=7']
+
+
+def test_failed_page_stops_search_with_error():
+    origin = 'https://failing.fhir.test'
+
+    def handler(request):
+        if '_offset=5' in str(request.url):
+            return httpx.Response(404, json={'resourceType': 'OperationOutcome'})
+        return searchset(origin, request, total=12)
+
+    errors = []
+    eobs = run(origin, handler, lambda client: client.get_explanation_of_benefits('p1', errors))
+    assert len(eobs) == 5
+    assert len(errors) == 1 and '404' in errors[0]
+
+
+def test_transient_errors_are_retried():
+    origin = 'https://flaky.fhir.test'
+    calls = []
+
+    def handler(request):
+        calls.append(request.url)
+        if len(calls) == 1:
+            raise httpx.ConnectError('connection refused', request=request)
+        return httpx.Response(200, json={'resourceType': 'Patient', 'id': 'p1'})
+
+    patient = run(origin, handler, lambda client: client.get_patient('p1'))
+    assert patient['id'] == 'p1'
+    assert len(calls) == 2
+
+
+def test_gather_keeps_going_when_one_type_fails():
+    origin = 'https://gather.fhir.test'
+
+    def handler(request):
+        if '/Patient/' in str(request.url):
+            return httpx.Response(500, json={'resourceType': 'OperationOutcome'})
+        return searchset(origin, request, total=3)
+
+    gathered = run(origin, handler, lambda client: client.gather_patient_resources(
+        'p1', ('Patient', 'ExplanationOfBenefit', 'Unknown')))
+    assert 'error' in gathered['Patient']
+    assert [eob['id'] for eob in gathered['ExplanationOfBenefit']] == ['eob0', 'eob1', 'eob2']
+    assert gathered['Unknown'] == {'error': 'Unsupported resource type: Unknown'}
+
+
+def test_eob_fallback_prints_nothing(capsys):
+    origin = 'https://quiet.fhir.test'
+
+    def handler(request):
+        if '/Claim' in str(request.url):
+            return httpx.Response(200, json={'resourceType': 'Bundle', 'type': 'searchset', 'entry': [
+                {'resource': {'resourceType': 'Claim', 'id': 'claim1'}}]})
+        return httpx.Response(200, json={'resourceType': 'Bundle', 'type': 'searchset', 'entry': []})
+
+    eob_data = run(origin, handler, lambda client: client.get_eob_data('p1'))
+    assert eob_data['source'] == 'Claim' and eob_data['count'] == 1
+    assert capsys.readouterr().out == ''
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Test incremental Bundle parsing
+BundleStream entries, top-level fields on either side of them and mid-stream failures
+"""
+
+import json
+
+from bundle_stream import BundleStream
+from fhir_client import EpicFHIRClient
+
+ENTRIES = [{'resource': {'resourceType': 'ExplanationOfBenefit', 'id': f'eob{i}',
+                         'provider': {'display': 'Clínica “Sonrisa” \\ Dental'}}} for i in range(3)]
+
+
+def chunked(document, size=7):
+    data = json.dumps(document, ensure_ascii=False).encode()
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_entries_come_one_at_a_time_across_chunk_boundaries():
+    # 7-byte chunks split multi-byte characters and escapes
+    stream = BundleStream(chunked({'resourceType': 'Bundle', 'total': 3, 'entry': ENTRIES}))
+
+    assert stream.get('total') == 3
+    entries = stream.get('entry')
+    assert next(entries) == ENTRIES[0] and stream.entries_read == 1
+    assert list(entries) == ENTRIES[1:]
+    assert 'error' not in stream
+
+
+def test_fields_after_the_entries_are_known_once_they_are_read():
+    next_link = [{'relation': 'next', 'url': 'https://fhir.example/ExplanationOfBenefit?page=2'}]
+    stream = BundleStream(chunked({'resourceType': 'Bundle', 'entry': ENTRIES, 'link': next_link}))
+
+    assert stream.get('resourceType') == 'Bundle'
+    assert stream.get('link') is None
+    assert list(stream.get('entry')) == ENTRIES
+    assert stream.get('link') == next_link
+
+
+def test_truncated_body_stops_with_an_error():
+    closed = []
+    chunks = chunked({'resourceType': 'Bundle', 'entry': ENTRIES})
+    stream = BundleStream(chunks[:len(chunks) // 2], close=lambda: closed.append(True))
+
+    entries = list(stream.get('entry'))
+
+    assert entries == ENTRIES[:len(entries)] and len(entries) < len(ENTRIES)
+    assert 'error' in stream and stream.error.startswith(f"Bundle stream failed after {len(entries)} entries")
+    assert closed == [True]
+
+
+def test_transport_errors_mid_stream_are_reported():
+    class Reset(Exception):
+        pass
+
+    def chunks():
+        yield from chunked({'resourceType': 'Bundle', 'entry': ENTRIES})[:5]
+        raise Reset('connection reset')
+
+    stream = BundleStream(chunks(), transport_errors=(Reset,))
+    assert list(stream.get('entry')) == []
+    assert 'connection reset' in stream.error
+
+
+def test_streamed_search_follows_links_after_entries(fake_fhir):
+    eobs = [entry['resource'] for entry in ENTRIES]
+    fake_fhir.route = lambda request: fake_fhir.searchset(request, eobs)
+    client = EpicFHIRClient(fake_fhir.base_url, 'token', 'p1')
+
+    # searchset writes 'link' after 'entry', so each next link is only seen at the end of its page
+    assert list(client.iter_search('ExplanationOfBenefit', {'patient': 'p1'}, count=2, stream=True)) == eobs
+    assert len(fake_fhir.searches('ExplanationOfBenefit')) == 2
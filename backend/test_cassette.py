@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Test cassette recording
+Demographics are scrubbed before anything is written, and scrubbed sessions still replay
+"""
+
+import gzip
+import json
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+import cassette
+from cassette import Cassette, CassetteAdapter
+
+BASE = 'https://fhir.example.test/api/FHIR/R4'
+TOKEN_URL = 'https://fhir.example.test/oauth2/token'
+PATIENT_ID = 'eRealPatient123'
+NAMES = ('Camila', 'Lopez', 'Mateo')
+MEMBER_ID = 'MBR-998877'
+
+PATIENT_REFERENCE = {'reference': f'Patient/{PATIENT_ID}', 'display': 'Camila Lopez'}
+RESPONSES = {
+    TOKEN_URL: {'access_token': 'secret-token', 'token_type': 'Bearer', 'patient': PATIENT_ID},
+    f'{BASE}/Patient/{PATIENT_ID}': {
+        'resourceType': 'Patient', 'id': PATIENT_ID, 'birthDate': '1988-04-12',
+        'name': [{'given': ['Camila'], 'family': 'Lopez'}],
+        'identifier': [{'system': 'urn:oid:mrn', 'value': 'MRN-424242'}],
+        'telecom': [{'system': 'phone', 'value': '555-0100'}]
+    },
+    f'{BASE}/ExplanationOfBenefit?patient={PATIENT_ID}': {
+        'resourceType': 'Bundle', 'type': 'searchset',
+        'link': [{'relation': 'next', 'url': f'{BASE}/ExplanationOfBenefit?patient={PATIENT_ID}&page=2'}],
+        'entry': [
+            {'fullUrl': f'{BASE}/ExplanationOfBenefit/eob1', 'resource': {
+                'resourceType': 'ExplanationOfBenefit', 'id': 'eob1', 'patient': dict(PATIENT_REFERENCE),
+                'type': {'coding': [{'system': 'http://terminology.hl7.org/CodeSystem/claim-type',
+                                     'code': 'oral', 'display': 'Oral'}]},
+                'provider': {'reference': 'Organization/org1', 'display': 'Smile Dental'}}},
+            {'resource': {
+                'resourceType': 'Claim', 'id': 'claim1', 'patient': dict(PATIENT_REFERENCE)}},
+            {'resource': {
+                'resourceType': 'Coverage', 'id': 'cov1', 'subscriberId': MEMBER_ID,
+                'subscriber': {'display': 'Mateo Lopez', 'identifier': {'value': MEMBER_ID}},
+                'beneficiary': dict(PATIENT_REFERENCE)}}
+        ]
+    }
+}
+
+
+class CannedAdapter(BaseAdapter):
+    """Answers each known URL with its canned JSON"""
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'application/json'
+        response._content = json.dumps(RESPONSES[request.url]).encode()
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def recorded(tmp_path, monkeypatch):
+    monkeypatch.setattr(cassette, '_patient_ids', {})
+    path = str(tmp_path / 'epic.jsonl.gz')
+    session = requests.Session()
+    session.mount('https://', CassetteAdapter(
+        Cassette(path, ['code', 'state'], ['credentials', 'demographics']), 'record', CannedAdapter()))
+    session.post(TOKEN_URL, data={'grant_type': 'authorization_code', 'code': 'abc'})
+    session.get(f'{BASE}/Patient/{PATIENT_ID}')
+    session.get(f'{BASE}/ExplanationOfBenefit', params={'patient': PATIENT_ID})
+    return path
+
+
+def test_names_and_ids_are_not_written(recorded):
+    with gzip.open(recorded, 'rt', encoding='utf-8') as f:
+        text = f.read()
+    for secret in NAMES + (PATIENT_ID, MEMBER_ID, 'MRN-424242', '555-0100', 'secret-token'):
+        assert secret not in text
+    # Codings are not References: their display is kept, as are non-patient references
+    assert '"display":"Oral"' in text and 'Organization/org1' in text
+
+
+def test_scrubbed_session_replays(recorded):
+    replay = Cassette(recorded, ['code', 'state'], [])
+    replay.load()
+    session = requests.Session()
+    session.mount('https://', CassetteAdapter(replay, 'replay', latency_ms=0))
+
+    patient_id = session.post(TOKEN_URL, data={'grant_type': 'authorization_code', 'code': 'xyz'}).json()['patient']
+    patient = session.get(f'{BASE}/Patient/{patient_id}').json()
+    bundle = session.get(f'{BASE}/ExplanationOfBenefit', params={'patient': patient_id}).json()
+
+    assert patient['id'] == patient_id != PATIENT_ID
+    assert patient['name'][0]['family'].startswith('Member-')
+    resources = [entry['resource'] for entry in bundle['entry']]
+    assert [resource['patient']['reference'] for resource in resources[:2]] == [f'Patient/{patient_id}'] * 2
+    assert resources[2]['beneficiary']['reference'] == f'Patient/{patient_id}'
+    # Every reference to the patient shows the name the Patient itself was given
+    assert resources[0]['patient']['display'] == f"Test {patient['name'][0]['family']}"
+    assert patient_id in bundle['link'][0]['url']
+    assert replay.stats()['misses'] == 0
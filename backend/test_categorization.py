@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Test expense categorization precedence
+Code rows, then claim type, then whole-system rows, then description keywords
+"""
+
+import threading
+
+import pytest
+
+from categorization import CategorizationEngine
+from env_config import CATEGORIZATION_CONFIG
+
+CDT = 'http://www.ada.org/cdt'
+CPT = 'http://www.ama-assn.org/go/cpt'
+HCPCS = 'https://www.cms.gov/Medicare/Coding/HCPCSReleaseCodeSets'
+NDC = 'http://hl7.org/fhir/sid/ndc'
+
+engine = CategorizationEngine.from_table(CATEGORIZATION_CONFIG['table'])
+
+
+def coding(system, code):
+    return {'system': system, 'code': code}
+
+
+@pytest.mark.parametrize('codings, type_code, description, category, rule', [
+    # An exact code beats a prefix, and a longer prefix beats a shorter one
+    ([coding(CPT, '70300')], 'medical', 'X-ray', 'Dental', 'code:cpt:70300'),
+    ([coding(CPT, '92004')], 'medical', 'Office visit', 'Vision', 'code:cpt:920*'),
+    ([coding(HCPCS, 'S0500')], None, None, 'Vision', 'code:hcpcs:S05*'),
+    # A code row beats the claim type and the description
+    ([coding(CDT, 'D1110')], 'vision', 'Eye exam', 'Dental', 'code:cdt:D*'),
+    ([coding(HCPCS, 'J1100')], 'oral', 'Dental visit', 'Prescription', 'code:hcpcs:J*'),
+    # The first coding a row covers wins
+    ([coding('http://example.org/local', 'X1'), coding(CPT, '92004'), coding(CDT, 'D1110')],
+     None, None, 'Vision', 'code:cpt:920*'),
+    # The claim type beats a whole-system row
+    ([coding(CPT, '99213')], 'vision', 'Eye exam', 'Vision', 'type:vision'),
+    ([coding(NDC, '0002-1433-80')], 'medical', 'Injection', 'Medical', 'type:medical'),
+    ([coding(HCPCS, 'A4253')], 'oral', None, 'Dental', 'type:oral'),
+    # A whole-system row beats the description
+    ([coding(NDC, '0002-1433-80')], None, 'Eye drops', 'Prescription', 'code:ndc:*'),
+    ([coding(CPT, '99213')], 'professional', 'Dental consult', 'Medical', 'code:cpt:*'),
+    # Unknown systems and types fall through to the description
+    ([coding('http://example.org/local', 'X1')], 'institutional', 'Prescription refill', 'Prescription',
+     'description:Prescription'),
+    (None, None, 'Vision screening', 'Vision', 'description:Vision'),
+    # Keywords match at word starts, and the earlier category wins
+    (None, None, 'Accidental injury', 'Medical', 'default'),
+    (None, None, 'Eye exam after tooth extraction', 'Dental', 'description:Dental'),
+    (None, None, 'Prescription glasses', 'Vision', 'description:Vision'),
+    (None, None, None, 'Medical', 'default'),
+])
+def test_categorization_precedence(codings, type_code, description, category, rule):
+    before = engine.stats()['hits'][rule]
+    assert engine.categorize(codings, type_code, description) == category
+    assert engine.stats()['hits'][rule] == before + 1
+
+
+def test_repeated_codes_use_the_same_rule():
+    codings = [coding(CPT, '99213')]
+    assert [engine.categorize(codings, None, None) for _ in range(3)] == ['Medical'] * 3
+    assert engine.categorize(codings, 'vision', None) == 'Vision'
+
+
+@pytest.mark.parametrize('description, category', [
+    ('accidental', None),
+    ('Accidental injury', None),
+    ('Toothache', 'Dental'),
+    ('Non-dental anesthesia', 'Dental'),
+    ('Eyeglass frames', 'Vision'),
+    ('Keyeye', None),
+])
+def test_keywords_match_at_word_starts(description, category):
+    assert engine.description_category(description) == category
+
+
+def test_hits_from_many_threads_are_all_counted():
+    counter = CategorizationEngine([], type_categories={}, description_keywords={'Dental': ['dental']})
+
+    def work():
+        for _ in range(500):
+            counter.categorize(None, None, 'Dental cleaning')
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Finished threads' counts are folded in; the calling thread's still run live
+    work()
+    stats = counter.stats()
+    assert stats['hits'] == {'description:Dental': 4500, 'default': 0}
+    assert stats['categorized'] == 4500
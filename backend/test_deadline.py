@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Test the per-request deadline
+The X-Request-Timeout-Ms header, its cap and route defaults, and the 504 when the budget runs out
+"""
+
+import time
+
+import pytest
+
+import deadline
+import server
+from env_config import DEADLINE_CONFIG
+
+
+def budget_for(path, headers=None):
+    """Seconds of budget server.start_deadline gives a request to `path`"""
+    with server.app.test_request_context(path, headers=headers or {}):
+        server.app.preprocess_request()
+        try:
+            return deadline.remaining()
+        finally:
+            server.end_deadline()
+
+
+def test_header_sets_the_budget():
+    assert budget_for('/api/expenses', {'X-Request-Timeout-Ms': '1500'}) == pytest.approx(1.5, abs=0.1)
+
+
+def test_header_is_capped_at_max_seconds(monkeypatch):
+    monkeypatch.setitem(DEADLINE_CONFIG, 'max_seconds', 5)
+    assert budget_for('/api/expenses', {'X-Request-Timeout-Ms': '3600000'}) == pytest.approx(5, abs=0.1)
+    assert budget_for('/api/expenses', {'X-Request-Timeout-Ms': '-50'}) <= 0
+
+
+def test_route_default_without_a_usable_header():
+    assert budget_for('/api/expenses') == pytest.approx(DEADLINE_CONFIG['routes']['get_expenses'], abs=0.1)
+    assert budget_for('/api/expenses', {'X-Request-Timeout-Ms': 'soon'}) == pytest.approx(
+        DEADLINE_CONFIG['routes']['get_expenses'], abs=0.1)
+    assert budget_for('/health') == pytest.approx(DEADLINE_CONFIG['default_seconds'], abs=0.1)
+
+
+def test_spent_budget_answers_504(fake_fhir, monkeypatch):
+    monkeypatch.setitem(server.EPIC_CONFIG, 'fhir_base_url', fake_fhir.base_url)
+    client = server.app.test_client()
+    with client.session_transaction() as session:
+        session.update(access_token='token', patient_id='p1', token_expires=time.time() + 60)
+
+    response = client.get('/api/expenses', headers={'X-Request-Timeout-Ms': '0'})
+
+    assert response.status_code == 504
+    assert response.get_json()['error'] == 'Upstream request deadline exceeded'
+    # No upstream call was started without budget
+    assert fake_fhir.requests == []
+    assert deadline.remaining() is None
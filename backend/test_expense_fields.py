@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Test expense field selection
+/api/expenses?fields=... and the on-demand raw resource at /api/expenses/<id>/fhir
+"""
+
+import time
+
+import pytest
+
+import server
+from env_config import FHIR_BATCH_CONFIG
+
+PATIENT = {'resourceType': 'Patient', 'id': 'p1', 'name': [{'given': ['Camila'], 'family': 'Lopez'}]}
+EOB = {'resourceType': 'ExplanationOfBenefit', 'id': 'eob1', 'status': 'active',
+       'patient': {'reference': 'Patient/p1'}, 'billablePeriod': {'start': '2025-08-19'},
+       'careTeam': [{'sequence': 1}],
+       'total': [{'category': {'coding': [{'code': 'patient-pay'}]}, 'amount': {'value': 42.5, 'currency': 'USD'}}]}
+OTHER_EOB = {**EOB, 'id': 'eob2', 'patient': {'reference': 'Patient/p2'}}
+
+
+@pytest.fixture
+def api(fake_fhir, monkeypatch):
+    """Signed-in test client for patient p1 against fake_fhir"""
+    monkeypatch.setitem(FHIR_BATCH_CONFIG, 'enabled', False)
+    monkeypatch.setitem(server.EPIC_CONFIG, 'fhir_base_url', fake_fhir.base_url)
+
+    def route(request):
+        if request.path == 'Patient/p1':
+            return 200, PATIENT, {}
+        if request.path == 'ExplanationOfBenefit':
+            elements = request.params.get('_elements')
+            keep = elements.split(',') + ['resourceType', 'id'] if elements else EOB
+            return fake_fhir.searchset(request, [{name: value for name, value in EOB.items() if name in keep}])
+        if request.path in ('ExplanationOfBenefit/eob1', 'ExplanationOfBenefit/eob2'):
+            return 200, EOB if request.path.endswith('eob1') else OTHER_EOB, {}
+        if request.path == 'Claim':
+            return fake_fhir.searchset(request, [])
+        return 404, {'resourceType': 'OperationOutcome'}, {}
+
+    fake_fhir.route = route
+    client = server.app.test_client()
+    with client.session_transaction() as session:
+        session.update(access_token='token', patient_id='p1', token_expires=time.time() + 60)
+    return client, fake_fhir
+
+
+def test_fields_select_the_expense_keys_and_elements(api):
+    client, fake_fhir = api
+
+    response = client.get('/api/expenses?fields=id,amount,date')
+
+    assert response.status_code == 200
+    assert response.get_json()['expenses'] == [{'id': 'eob1', 'date': '2025-08-19', 'amount': 42.5}]
+    requested = fake_fhir.searches('ExplanationOfBenefit')[0].params['_elements'].split(',')
+    assert set(requested) == {'id', 'billablePeriod', 'item', 'total', 'meta'}
+
+
+def test_raw_resource_is_opt_in(api):
+    client, fake_fhir = api
+
+    default = client.get('/api/expenses').get_json()['expenses'][0]
+    assert 'fhir_data' not in default and default['provider'] == 'Unknown Provider'
+
+    [expense] = client.get('/api/expenses?fields=id,fhir_data').get_json()['expenses']
+    assert expense == {'id': 'eob1', 'fhir_data': EOB}
+    # The full resource needs an unprojected search
+    assert '_elements' not in fake_fhir.searches('ExplanationOfBenefit')[-1].params
+
+
+def test_unknown_fields_are_rejected(api):
+    client, fake_fhir = api
+
+    response = client.get('/api/expenses?fields=id,ssn')
+
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Unknown expense fields: ssn'}
+    assert fake_fhir.requests == []
+
+
+def test_raw_resource_by_id(api):
+    client, _ = api
+
+    response = client.get('/api/expenses/eob1/fhir?source=ExplanationOfBenefit')
+
+    assert response.status_code == 200 and response.get_json() == EOB
+
+
+@pytest.mark.parametrize('path, status', [
+    ('/api/expenses/eob1/fhir?source=Patient', 400),
+    ('/api/expenses/eob1%3B%20drop/fhir', 400),
+    ('/api/expenses/eob2/fhir', 404),
+    ('/api/expenses/missing/fhir', 404)
+])
+def test_raw_resource_validation(api, path, status):
+    client, fake_fhir = api
+
+    response = client.get(path)
+
+    assert response.status_code == status
+    # Bad sources and ids never reach the FHIR server
+    assert bool(fake_fhir.requests) == (status == 404)
+
+
+def test_raw_resource_needs_a_session(fake_fhir):
+    assert server.app.test_client().get('/api/expenses/eob1/fhir').status_code == 401
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Test the columnar expense transform
+transform_any_eob_data_to_table agrees with the row transform, in one chunk or many
+"""
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from transformers import EXPENSE_TABLE_FIELDS, transform_any_eob_data_to_expenses, transform_any_eob_data_to_table
+
+PROVIDERS = ['Smile Dental', 'Clear View Optics', 'Smile Dental', 'City Pharmacy', 'Clear View Optics']
+SERVICES = ['Adult Dental Prophylaxis', 'Eye exam', 'Dental filling', 'Prescription', 'Contact lenses']
+
+
+def eob(i):
+    return {
+        'resourceType': 'ExplanationOfBenefit', 'id': f'eob{i}', 'status': ['active', 'draft'][i % 2],
+        'billablePeriod': {'start': f'2025-0{i + 1}-1{i}'},
+        'provider': {'display': PROVIDERS[i]},
+        'item': [{'productOrService': {'text': SERVICES[i]}}],
+        'total': [{'category': {'coding': [{'code': 'patient-pay'}]},
+                   'amount': {'value': round(10.05 * (i + 1), 2), 'currency': 'USD'}}]
+    }
+
+
+EOB_DATA = {'source': 'ExplanationOfBenefit',
+            'data': [eob(i) for i in range(5)] + [{'resourceType': 'OperationOutcome', 'id': 'oo1'}]}
+
+
+def rows(eob_data):
+    return [{field: expense[field] for field in EXPENSE_TABLE_FIELDS}
+            for expense in transform_any_eob_data_to_expenses(eob_data, {}, EXPENSE_TABLE_FIELDS)]
+
+
+@pytest.mark.parametrize('chunk_size', [10000, 2, 1])
+def test_table_matches_the_row_transform(chunk_size):
+    table = transform_any_eob_data_to_table(EOB_DATA, chunk_size=chunk_size)
+
+    assert len(table) == 5
+    assert table.to_dicts() == rows(EOB_DATA)
+    # Chunks with different labels are re-coded onto one label set
+    assert table.providers == ('Smile Dental', 'Clear View Optics', 'City Pharmacy')
+
+
+def test_aggregates_match_the_rows():
+    table = transform_any_eob_data_to_table(EOB_DATA, chunk_size=2)
+    expenses = rows(EOB_DATA)
+
+    assert table.total() == round(sum(expense['amount'] for expense in expenses) * 100)
+    by_provider = {}
+    for expense in expenses:
+        by_provider[expense['provider']] = by_provider.get(expense['provider'], 0) + round(expense['amount'] * 100)
+    assert table.totals_by('provider') == by_provider
+    assert table.counts_by('status') == {'Approved': 3, 'Pending': 2}
+    assert [expense['id'] for expense in table.between('2025-02-01', '2025-04-30').to_dicts()] == ['eob1', 'eob2', 'eob3']
+
+
+def test_no_data_gives_an_empty_table():
+    assert len(transform_any_eob_data_to_table({'source': 'none', 'data': []})) == 0
+    assert transform_any_eob_data_to_table({'source': 'Claim', 'data': []}).to_dicts() == []
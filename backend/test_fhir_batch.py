@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Test FHIR batch Bundles
+Several reads and searches in one round trip, with a GET fallback
+"""
+
+import pytest
+
+from fhir_client import EpicFHIRClient
+
+PATIENT = {'resourceType': 'Patient', 'id': 'p1', 'meta': {'versionId': '1'}}
+EOBS = [{'resourceType': 'ExplanationOfBenefit', 'id': f'eob{i}'} for i in range(3)]
+
+
+@pytest.fixture
+def server(fake_fhir):
+    """fake_fhir with Patient/p1 and three EOBs in pages of two; batch support set in `capability`"""
+    capability = {'batch': True}
+
+    def read(request):
+        if request.path == 'metadata':
+            interactions = [{'code': 'batch'}] if capability['batch'] else []
+            return 200, {'resourceType': 'CapabilityStatement', 'rest': [{'interaction': interactions}]}, {}
+        if request.path == 'Patient/p1':
+            return 200, PATIENT, {}
+        if request.path == 'ExplanationOfBenefit':
+            return fake_fhir.searchset(request._replace(params={**request.params, '_count': '2'}), EOBS)
+        return 404, {'resourceType': 'OperationOutcome', 'issue': [{'diagnostics': 'not found'}]}, {}
+
+    def route(request):
+        if request.method == 'POST':
+            entries = []
+            for entry in request.body['entry']:
+                path, _, query = entry['request']['url'].partition('?')
+                params = dict(item.split('=', 1) for item in query.split('&') if item)
+                status, body, _ = read(request._replace(method='GET', path=path, params=params))
+                entries.append({'resource': body, 'response': {'status': f'{status} {"OK" if status == 200 else "Not Found"}'}})
+            return 200, {'resourceType': 'Bundle', 'type': 'batch-response', 'entry': entries}, {}
+        return read(request)
+
+    fake_fhir.route = route
+    return fake_fhir, capability
+
+
+REQUESTS = ['Patient/p1', {'url': 'ExplanationOfBenefit', 'params': {'patient': 'p1'}}, 'Patient/missing']
+
+
+def test_reads_and_searches_share_one_round_trip(server):
+    fake_fhir, _ = server
+    client = EpicFHIRClient(fake_fhir.base_url, 'token')
+
+    patient, eobs, missing = client.batch(REQUESTS)
+
+    assert patient == PATIENT
+    # The search's second page is followed with a plain GET
+    assert eobs == EOBS
+    assert missing == {'error': '404 Not Found: not found'}
+    assert [request.method for request in fake_fhir.requests if request.path != 'metadata'] == ['POST', 'GET']
+
+
+def test_stored_reads_stay_local(server):
+    fake_fhir, _ = server
+    client = EpicFHIRClient(fake_fhir.base_url, 'token')
+    client.batch(['Patient/p1'])
+    posts = len([request for request in fake_fhir.requests if request.method == 'POST'])
+
+    assert client.batch(['Patient/p1']) == [PATIENT]
+    assert len([request for request in fake_fhir.requests if request.method == 'POST']) == posts
+
+
+def test_without_batch_support_requests_go_out_individually(server):
+    fake_fhir, capability = server
+    capability['batch'] = False
+    client = EpicFHIRClient(fake_fhir.base_url, 'token')
+
+    patient, eobs, missing = client.batch(REQUESTS)
+
+    assert patient == PATIENT and eobs == EOBS and 'error' in missing
+    assert not [request for request in fake_fhir.requests if request.method == 'POST']
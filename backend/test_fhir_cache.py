@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Test the conditional-request cache
+Fresh hits, ETag revalidation with 304 Not Modified, scoping and the byte bound
+"""
+
+import pytest
+
+import fhir_client
+from fhir_cache import ConditionalRequestCache
+from fhir_client import EpicFHIRClient
+
+COVERAGE = {'resourceType': 'Bundle', 'type': 'searchset',
+            'entry': [{'resource': {'resourceType': 'Coverage', 'id': 'cov1'}}]}
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = ConditionalRequestCache(1024 * 1024)
+    monkeypatch.setattr(fhir_client, '_response_cache', cache)
+    return cache
+
+
+@pytest.fixture
+def coverage_server(fake_fhir):
+    def route(request):
+        if request.headers.get('If-None-Match') == 'W/"2"':
+            return 304, None, {}
+        return 200, COVERAGE, {'ETag': 'W/"2"'}
+
+    fake_fhir.route = route
+    return fake_fhir
+
+
+def test_fresh_entries_skip_the_round_trip(coverage_server, cache):
+    client = EpicFHIRClient(coverage_server.base_url, 'token', 'p1')
+    url = f"{coverage_server.base_url}/Coverage"
+
+    assert client._make_request(url, {'patient': 'p1'}) == COVERAGE
+    assert client._make_request(url, {'patient': 'p1'}) == COVERAGE
+    assert len(coverage_server.requests) == 1
+    assert cache.stats()['hits'] == 1
+
+
+def test_stale_entries_are_revalidated(coverage_server, cache):
+    client = EpicFHIRClient(coverage_server.base_url, 'token', 'p1')
+    url = f"{coverage_server.base_url}/Coverage"
+    client._make_request(url, {'patient': 'p1'})
+    for entry in cache._entries.values():
+        entry.expires_at = 0
+
+    assert client._make_request(url, {'patient': 'p1'}) == COVERAGE
+    revalidation = coverage_server.requests[-1]
+    assert revalidation.headers['If-None-Match'] == 'W/"2"'
+    assert cache.stats()['not_modified'] == 1
+    # The 304 made the entry fresh again
+    client._make_request(url, {'patient': 'p1'})
+    assert len(coverage_server.requests) == 2
+
+
+def test_entries_are_scoped_to_patient_and_token_scope(coverage_server, cache):
+    url = f"{coverage_server.base_url}/Coverage"
+    for token, patient, scope in [('token-a', 'p1', 'patient/*.read'), ('token-b', 'p2', 'patient/*.read'),
+                                  ('token-c', 'p1', 'patient/Coverage.read')]:
+        EpicFHIRClient(coverage_server.base_url, token, patient, scope)._make_request(url, {'patient': 'p1'})
+    assert len(coverage_server.requests) == 3
+    assert not any('If-None-Match' in request.headers for request in coverage_server.requests)
+
+
+def test_cache_is_bounded_by_bytes():
+    cache = ConditionalRequestCache(100)
+    for key in 'abc':
+        cache.store(key, {'meta': {'versionId': '7'}}, 40, ttl=60)
+
+    assert cache.lookup('a') is None
+    assert cache.stats()['bytes'] == 80 and cache.stats()['evictions'] == 1
+    # Without an ETag the versionId stands in for it
+    assert cache.lookup('c').validator_headers() == {'If-None-Match': 'W/"7"'}
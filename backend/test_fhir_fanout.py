@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Test the concurrent Patient + EOB + Claim fetch
+get_patient_and_eob_data without batch: overlapped reads, EOB-first precedence
+"""
+
+import threading
+import time
+
+import pytest
+
+from env_config import FHIR_BATCH_CONFIG
+from fhir_client import EpicFHIRClient
+
+PATIENT = {'resourceType': 'Patient', 'id': 'p1', 'name': [{'given': ['Camila'], 'family': 'Lopez'}]}
+EOB = {'resourceType': 'ExplanationOfBenefit', 'id': 'eob1'}
+CLAIM = {'resourceType': 'Claim', 'id': 'claim1'}
+
+
+@pytest.fixture
+def fanout(fake_fhir, monkeypatch):
+    """fake_fhir answering each read after `delay`, with EOBs as set in `results`"""
+    monkeypatch.setitem(FHIR_BATCH_CONFIG, 'enabled', False)
+    results = {'ExplanationOfBenefit': [EOB], 'Claim': [CLAIM], 'delay': 0.3}
+    in_flight, peak = [], [0]
+    lock = threading.Lock()
+
+    def route(request):
+        with lock:
+            in_flight.append(request.path)
+            peak[0] = max(peak[0], len(in_flight))
+        time.sleep(results['delay'])
+        with lock:
+            in_flight.remove(request.path)
+        if request.path == 'Patient/p1':
+            return 200, PATIENT, {}
+        return fake_fhir.searchset(request, results[request.path])
+
+    fake_fhir.route = route
+    return fake_fhir, results, peak
+
+
+def test_reads_overlap_and_eobs_win(fanout):
+    fake_fhir, _, peak = fanout
+    client = EpicFHIRClient(fake_fhir.base_url, 'token-a')
+
+    started = time.monotonic()
+    patient, eob_data = client.get_patient_and_eob_data('p1', claim_hedge_delay=0)
+
+    # Three 0.3s reads at once: the slowest one, not the sum
+    assert time.monotonic() - started < 0.8
+    assert peak[0] == 3
+    assert patient == PATIENT
+    assert eob_data['source'] == 'ExplanationOfBenefit' and eob_data['data'] == [EOB]
+
+
+def test_claims_are_used_when_there_are_no_eobs(fanout):
+    fake_fhir, results, _ = fanout
+    results['ExplanationOfBenefit'] = []
+    client = EpicFHIRClient(fake_fhir.base_url, 'token-b')
+
+    _, eob_data = client.get_patient_and_eob_data('p1', claim_hedge_delay=0)
+    assert eob_data['source'] == 'Claim' and eob_data['data'] == [CLAIM]
+
+
+def test_claim_search_waits_for_the_hedge_delay(fanout):
+    fake_fhir, results, _ = fanout
+    results['delay'] = 0.05
+    client = EpicFHIRClient(fake_fhir.base_url, 'token-c')
+
+    # EOBs arrive within the delay: the Claim fallback is never sent
+    _, eob_data = client.get_patient_and_eob_data('p1', claim_hedge_delay=1)
+    assert eob_data['source'] == 'ExplanationOfBenefit'
+    assert fake_fhir.searches('Claim') == []
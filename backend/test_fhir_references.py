@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Test _include reference resolution
+Providers arrive in the search Bundle and are shared through the reference cache
+"""
+
+import pytest
+
+import fhir_client
+from env_config import FHIR_REFERENCE_CONFIG
+from fhir_cache import ReferenceCache
+from fhir_client import EpicFHIRClient
+from transformers import transform_eobs_to_expenses
+
+ORGANIZATION = {'resourceType': 'Organization', 'id': 'org1', 'name': 'Smile Dental'}
+PATIENT = {'resourceType': 'Patient', 'id': 'p1'}
+EOBS = [{'resourceType': 'ExplanationOfBenefit', 'id': f'eob{i}', 'provider': {'reference': 'Organization/org1'}}
+        for i in range(2)]
+
+
+@pytest.fixture
+def references(fake_fhir, monkeypatch):
+    cache = ReferenceCache(FHIR_REFERENCE_CONFIG['ttl'], FHIR_REFERENCE_CONFIG['max_entries'])
+    monkeypatch.setattr(fhir_client, '_reference_cache', cache)
+
+    def route(request):
+        if request.path == 'ExplanationOfBenefit':
+            included = [ORGANIZATION] if request.params.get('_include') else []
+            return fake_fhir.searchset(request, EOBS, included)
+        if request.path == 'Organization/org1':
+            return 200, ORGANIZATION, {}
+        return 404, {'resourceType': 'OperationOutcome'}, {}
+
+    fake_fhir.route = route
+    return fake_fhir, cache
+
+
+def test_included_providers_are_not_yielded(references):
+    fake_fhir, cache = references
+    client = EpicFHIRClient(fake_fhir.base_url, 'token', 'p1')
+    included = {}
+
+    eobs = list(client.iter_search('ExplanationOfBenefit', {'patient': 'p1', '_include': 'ExplanationOfBenefit:provider'},
+                                   included=included))
+
+    assert eobs == EOBS
+    assert included == {'Organization/org1': ORGANIZATION}
+    assert cache.get((fake_fhir.base_url, 'Organization/org1')) == ORGANIZATION
+
+
+def test_included_providers_resolve_without_another_request(references):
+    fake_fhir, _ = references
+    client = EpicFHIRClient(fake_fhir.base_url, 'token', 'p1')
+
+    eobs = client.get_explanation_of_benefits('p1')
+    resolved = client.resolve_references(eobs)
+
+    assert fake_fhir.searches('ExplanationOfBenefit')[0].params['_include'] == 'ExplanationOfBenefit:provider'
+    assert resolved == {'Organization/org1': ORGANIZATION}
+    assert not [request for request in fake_fhir.requests if request.path.startswith('Organization')]
+    expenses = transform_eobs_to_expenses(eobs, PATIENT, ('id', 'provider'), resolved)
+    assert [expense['provider'] for expense in expenses] == ['Smile Dental', 'Smile Dental']
+
+
+def test_missing_providers_are_fetched_once(references, monkeypatch):
+    fake_fhir, _ = references
+    monkeypatch.setitem(FHIR_REFERENCE_CONFIG, 'include_enabled', False)
+    client = EpicFHIRClient(fake_fhir.base_url, 'token', 'p1')
+    eobs = client.get_explanation_of_benefits('p1')
+
+    assert client.resolve_references(eobs) == {'Organization/org1': ORGANIZATION}
+    # The second patient's client finds it in the shared cache
+    assert EpicFHIRClient(fake_fhir.base_url, 'token-2', 'p2').resolve_references(eobs) == {'Organization/org1': ORGANIZATION}
+    assert len([request for request in fake_fhir.requests if request.path == 'Organization/org1']) == 1
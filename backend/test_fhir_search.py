@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Test paged FHIR searches
+iter_search follows next links lazily and reports why a walk was cut short
+"""
+
+from fhir_client import EpicFHIRClient
+
+
+def eobs(n):
+    return [{'resourceType': 'ExplanationOfBenefit', 'id': f'eob{i}'} for i in range(n)]
+
+
+def test_pages_are_fetched_as_they_are_consumed(fake_fhir):
+    fake_fhir.route = lambda request: fake_fhir.searchset(request, eobs(25))
+    client = EpicFHIRClient(fake_fhir.base_url, 'token')
+
+    resources = client.iter_search('ExplanationOfBenefit', {'patient': 'p1'}, count=10, prefetch=False)
+    assert [next(resources)['id'] for _ in range(10)] == [f'eob{i}' for i in range(10)]
+    assert len(fake_fhir.searches('ExplanationOfBenefit')) == 1
+    assert [resource['id'] for resource in resources] == [f'eob{i}' for i in range(10, 25)]
+    assert [request.params.get('_offset') for request in fake_fhir.searches('ExplanationOfBenefit')] == [None, '10', '20']
+
+
+def test_budgets_report_truncation(fake_fhir):
+    fake_fhir.route = lambda request: fake_fhir.searchset(request, eobs(25))
+    client = EpicFHIRClient(fake_fhir.base_url, 'token')
+
+    by_pages, by_resources = [], []
+    assert len(list(client.iter_search('ExplanationOfBenefit', count=10, max_pages=2, errors=by_pages))) == 20
+    assert len(list(client.iter_search('ExplanationOfBenefit', count=10, max_resources=12, errors=by_resources))) == 12
+    assert by_pages == ['truncated at max_pages=2']
+    assert by_resources == ['truncated at max_resources=12']
+
+
+def test_failed_page_and_foreign_links_stop_the_walk(fake_fhir):
+    def route(request):
+        if request.params.get('_offset') == '10':
+            return 404, {'resourceType': 'OperationOutcome'}, {}
+        status, bundle, headers = fake_fhir.searchset(request, eobs(25))
+        if request.params.get('patient') == 'p2':
+            bundle['link'][0]['url'] = 'https://elsewhere.example.test/fhir/ExplanationOfBenefit?page=2'
+        return status, bundle, headers
+
+    fake_fhir.route = route
+    client = EpicFHIRClient(fake_fhir.base_url, 'token')
+
+    errors = []
+    assert len(list(client.iter_search('ExplanationOfBenefit', {'patient': 'p1'}, count=10, errors=errors))) == 10
+    assert len(errors) == 1 and '404' in errors[0]
+
+    # The bearer token never follows a next link to another origin
+    assert len(list(client.iter_search('ExplanationOfBenefit', {'patient': 'p2'}, count=10))) == 10
+    assert len([request for request in fake_fhir.requests if request.params.get('patient') == 'p2']) == 1
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test incremental sync merges
+Full pulls, _lastUpdated deltas, the watermark of ResourceSyncState and the memory caps
+"""
+
+from fhir_sync import IncrementalSyncStore, ResourceSyncState
+
+
+def eob(resource_id, version, last_updated, status='active'):
+    return {'resourceType': 'ExplanationOfBenefit', 'id': resource_id, 'status': status,
+            'meta': {'versionId': str(version), 'lastUpdated': last_updated}}
+
+
+def ids_and_versions(resources):
+    return sorted((resource['id'], resource['meta']['versionId']) for resource in resources)
+
+
+def synced_state():
+    state = ResourceSyncState()
+    assert state.needs_full_sync(0)
+    assert state.search_params('p1', full=True) == {'patient': 'p1'}
+    state.merge([eob('a', 1, '2025-01-01T00:00:00Z'), eob('b', 1, '2025-01-02T00:00:00Z')],
+                complete=True, full=True)
+    return state
+
+
+def test_delta_search_is_inclusive_of_the_watermark():
+    state = synced_state()
+    assert not state.needs_full_sync(0)
+    assert state.search_params('p1', full=False) == {'patient': 'p1', '_lastUpdated': 'ge2025-01-02T00:00:00Z'}
+
+
+def test_redelivered_versions_are_deduplicated():
+    state = synced_state()
+    held = state.resources['b']
+    # ge hands back what we already hold at the watermark, plus anything written in that same instant
+    merged = state.merge([eob('b', 1, '2025-01-02T00:00:00Z'), eob('c', 1, '2025-01-02T00:00:00Z')],
+                         complete=True, full=False)
+    assert ids_and_versions(merged) == [('a', '1'), ('b', '1'), ('c', '1')]
+    assert state.resources['b'] is held
+    assert state.watermark == '2025-01-02T00:00:00Z'
+
+
+def test_delta_merges_new_versions_and_withdrawals():
+    state = synced_state()
+    merged = state.merge([eob('a', 2, '2025-01-03T00:00:00Z'),
+                          eob('b', 2, '2025-01-04T00:00:00Z', status='entered-in-error'),
+                          eob('a', 1, '2025-01-01T00:00:00Z')],
+                         complete=True, full=False)
+    assert ids_and_versions(merged) == [('a', '2')]
+    assert state.watermark == '2025-01-04T00:00:00Z'
+
+
+def test_versions_without_version_ids_compare_by_last_updated():
+    state = ResourceSyncState()
+    state.merge([{'id': 'a', 'meta': {'lastUpdated': '2025-01-02T00:00:00Z'}, 'total': 1}], complete=True, full=True)
+    state.merge([{'id': 'a', 'meta': {'lastUpdated': '2025-01-01T00:00:00Z'}, 'total': 0}], complete=True, full=False)
+    assert state.resources['a']['total'] == 1
+    state.merge([{'id': 'a', 'meta': {'lastUpdated': '2025-01-03T00:00:00Z'}, 'total': 2}], complete=True, full=False)
+    assert state.resources['a']['total'] == 2
+
+
+def test_incomplete_delta_keeps_the_watermark():
+    state = synced_state()
+    merged = state.merge([eob('c', 1, '2025-01-05T00:00:00Z')], complete=False, full=False)
+    assert ids_and_versions(merged) == [('a', '1'), ('b', '1'), ('c', '1')]
+    assert state.watermark == '2025-01-02T00:00:00Z'
+
+
+def test_incomplete_full_sync_keeps_resources_it_did_not_reach():
+    state = synced_state()
+    merged = state.merge([eob('b', 2, '2025-01-06T00:00:00Z')], complete=False, full=True)
+    assert ids_and_versions(merged) == [('a', '1'), ('b', '2')]
+    assert state.watermark == '2025-01-02T00:00:00Z'
+
+
+def test_state_over_its_cap_falls_back_to_full_pulls():
+    store = IncrementalSyncStore(10, max_resources_per_state=2)
+    state = store.state('p1')
+    merged = state.merge([eob(name, 1, '2025-01-01T00:00:00Z') for name in 'abc'], complete=True, full=True)
+
+    # This caller still gets its result, but nothing is held and the next sync starts over
+    assert len(merged) == 3
+    assert state.resources == {} and state.needs_full_sync(0)
+    assert store.stats()['resources'] == 0 and store.stats()['overflows'] == 1
+
+
+def test_total_cap_evicts_least_recently_used_states():
+    store = IncrementalSyncStore(10, max_resources=5)
+    for patient in ('p1', 'p2', 'p3'):
+        store.state(patient).merge([eob(f'{patient}-{i}', 1, '2025-01-01T00:00:00Z') for i in range(2)],
+                                   complete=True, full=True)
+
+    stats = store.stats()
+    assert stats['states'] == 2 and stats['resources'] == 4 and stats['evictions'] == 1
+    # p1 was evicted: asking for it again starts with a full pull
+    assert store.state('p1').needs_full_sync(0)
+    assert not store.state('p3').needs_full_sync(0)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Test the FHIRPath subset
+Parsing, compiled evaluation, and where() keeping only the first match
+"""
+
+import pytest
+
+from fhirpath import Where, compile_expression, dotted, evaluate, parse, select
+
+EOB = {
+    'billablePeriod': {'start': '2025-08-19'},
+    'item': [{'sequence': 1, 'servicedDate': '2025-08-18', 'net': {'value': 120.0}},
+             {'sequence': 2, 'servicedDate': '2025-08-19', 'net': {'value': 30.0}}],
+    'total': [{'category': {'coding': [{'code': 'benefit'}]}, 'amount': {'value': 75.0}},
+              {'category': {'coding': [{'code': 'patient-pay'}]}, 'amount': {'value': 20.0}},
+              {'category': {'coding': [{'code': 'patient-pay'}]}, 'amount': {'value': 5.0}}],
+    'insurance': [{'focal': False, 'sequence': 1}, {'focal': True, 'sequence': 2}]
+}
+
+
+def test_expressions_parse_to_path_tuples():
+    assert parse("item.first().net.value | item[1].net.value") == (('item', 0, 'net', 'value'),
+                                                                   ('item', 1, 'net', 'value'))
+    [path] = parse("total.where(category.coding.first().code = 'patient-pay').amount.value")
+    assert path == ('total', Where(('category', 'coding', 0, 'code'), 'patient-pay'), 'amount', 'value')
+    assert dotted(path) == 'total.amount.value'
+
+
+def test_navigation_first_and_indexes():
+    assert evaluate("billablePeriod.start", EOB) == '2025-08-19'
+    assert evaluate("item.first().net.value", EOB) == 120.0
+    assert evaluate("item[1].servicedDate", EOB) == '2025-08-19'
+    assert evaluate("item[5].servicedDate", EOB, 'none') == 'none'
+    # A repeating element has to be narrowed first
+    assert evaluate("item.servicedDate", EOB) is None
+
+
+def test_where_keeps_the_first_match():
+    # Full FHIRPath would give both patient-pay totals; this subset yields one value, the first
+    assert evaluate("total.where(category.coding.first().code = 'patient-pay').amount.value", EOB) == 20.0
+    assert evaluate("insurance.where(focal = true).sequence", EOB) == 2
+    assert evaluate("item.where(sequence = 2).net.value", EOB) == 30.0
+    assert evaluate("item.where(sequence = 3).net.value", EOB, 0.0) == 0.0
+
+
+def test_union_is_a_fallback():
+    assert evaluate("billablePeriod.start | item.first().servicedDate", EOB) == '2025-08-19'
+    assert evaluate("billablePeriod.end | item.first().servicedDate", EOB) == '2025-08-18'
+    assert evaluate("billablePeriod.end | created", EOB, 'today') == 'today'
+
+
+def test_malformed_resources_read_as_empty():
+    evaluator = compile_expression("item.first().net.value | total.first().amount.value")
+    assert evaluator({'item': 'not a list', 'total': [{'amount': {'value': 1.0}}]}) == 1.0
+    assert evaluator({'item': [None], 'total': None}, None) is None
+    assert list(select("billablePeriod.start", [EOB, {}, {'billablePeriod': 3}], '-')) == ['2025-08-19', '-', '-']
+
+
+@pytest.mark.parametrize('expression', ["item.where(net.where(value = 1).value = 2)", "item..net", "item.net = 3",
+                                        "item.where(sequence = )", "total.amount.value $"])
+def test_unsupported_expressions_are_rejected(expression):
+    with pytest.raises(ValueError, match='FHIRPath'):
+        parse(expression)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Test compiled field mappings
+Alternatives, lookups, fallbacks and field selection, plus the EOB/Claim expense tables
+"""
+
+import pytest
+
+from field_mapping import SOURCE, Context, Field, compile_mapping
+from transformers import expense_extractor, transform_claims_to_expenses
+
+MAPPING = {
+    'id': Field("id", default='unknown'),
+    'code': Field("item.first().code | item.first().alias", default='none'),
+    'status': Field("status", lookup={'active': 'Open'}, default='Closed'),
+    'amount': Field("item.first().net.value", convert=float, default=lambda: 0.0),
+    'label': Field(fallback=lambda resource, out, context: f"{out['code']}:{context.get('suffix')}", needs=('code',)),
+    'raw': SOURCE,
+    'who': Context('who')
+}
+
+
+def test_alternatives_lookup_convert_and_defaults():
+    extract = compile_mapping(MAPPING)
+    full = {'id': 'r1', 'status': 'active', 'item': [{'code': 'A', 'alias': 'B', 'net': {'value': '12.5'}}]}
+
+    assert extract(full, {'who': 'Camila', 'suffix': 'x'}) == {
+        'id': 'r1', 'code': 'A', 'status': 'Open', 'amount': 12.5, 'label': 'A:x', 'raw': full, 'who': 'Camila'}
+    # The second alternative only when the first misses; unknown lookups count as missing
+    sparse = {'status': 'unknown', 'item': [{'alias': 'B'}]}
+    assert extract(sparse) == {
+        'id': 'unknown', 'code': 'B', 'status': 'Closed', 'amount': 0.0, 'label': 'B:None', 'raw': sparse, 'who': None}
+    assert extract({})['code'] == 'none'
+
+
+def test_selected_fields_build_what_their_fallbacks_need():
+    extract = compile_mapping(MAPPING, fields=['label'])
+
+    assert extract({'item': [{'code': 'A'}]}, {'suffix': 'y'}) == {'label': 'A:y'}
+    # Only the needed field's paths are read, e.g. for _elements
+    assert extract.paths == ['item.code', 'item.alias']
+    with pytest.raises(KeyError):
+        compile_mapping(MAPPING, fields=['id', 'nope'])
+
+
+def test_claim_total_is_a_single_money():
+    # R4 Claim.total is Money, not a list; reading it as one used to raise KeyError
+    claim = {'resourceType': 'Claim', 'id': 'c1', 'status': 'active',
+             'total': {'value': 80, 'currency': 'EUR'},
+             'item': [{'net': {'value': 30.0, 'currency': 'USD'}}]}
+
+    expense = transform_claims_to_expenses([claim], {}, ('id', 'amount', 'currency', 'status'))[0]
+    assert expense == {'id': 'c1', 'amount': 80.0, 'currency': 'EUR', 'status': 'Submitted'}
+    # Without a total the first line's net amount stands in
+    del claim['total']
+    assert expense_extractor('Claim', ('amount', 'currency'))(claim) == {'amount': 30.0, 'currency': 'USD'}
+
+
+def test_eob_amount_is_the_patient_pay_share():
+    patient_pay = {'category': {'coding': [{'code': 'patient-pay'}]}, 'amount': {'value': 20.0, 'currency': 'USD'}}
+    plan_pay = {'category': {'coding': [{'code': 'benefit'}]}, 'amount': {'value': 75.0, 'currency': 'USD'}}
+    eob = {'total': [plan_pay, patient_pay]}
+
+    assert expense_extractor('ExplanationOfBenefit', ('amount',))(eob) == {'amount': 20.0}
+    assert expense_extractor('ExplanationOfBenefit', ('amount',))({'item': [{'adjudication': [patient_pay]}]}) == {
+        'amount': 20.0}
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Test hedged reads
+Primary on the calling thread, hedges on the pool, latency recorded on every outcome
+"""
+
+import asyncio
+import http.server
+import socketserver
+import threading
+import time
+
+import pytest
+
+from env_config import FHIR_HEDGING_CONFIG
+from hedging import Hedger
+from http_pool import get_session
+
+HOST = 'fhir.example.test'
+
+
+def hedger(max_workers=4, delay=0.05):
+    """An enabled hedger whose delay for (HOST, EOB) is already `delay`"""
+    config = {**FHIR_HEDGING_CONFIG, 'enabled': True, 'min_samples': 5, 'max_workers': max_workers,
+              'min_delay': delay, 'max_delay': delay, 'budget_burst': 100}
+    hedger = Hedger(config)
+    for _ in range(config['min_samples']):
+        hedger.histogram(HOST, 'ExplanationOfBenefit').record(0.001)
+    return hedger
+
+
+class SlowFirstHandler(http.server.BaseHTTPRequestHandler):
+    """Answers its first request after 3s and every later one at once"""
+    protocol_version = 'HTTP/1.1'
+    requests_seen = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with SlowFirstHandler.lock:
+            SlowFirstHandler.requests_seen += 1
+            first = SlowFirstHandler.requests_seen == 1
+        if first:
+            time.sleep(3)
+        body = b'{"resourceType": "Bundle", "entry": []}'
+        try:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def slow_first_server():
+    socketserver.ThreadingTCPServer.daemon_threads = True
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SlowFirstHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/fhir/ExplanationOfBenefit"
+    server.shutdown()
+    server.server_close()
+
+
+def test_hedge_wins_and_aborts_the_primary(slow_first_server):
+    hedging = hedger()
+    session = get_session(slow_first_server)
+    threads = []
+
+    def send(timeout):
+        threads.append(threading.get_ident())
+        return session.get(slow_first_server, timeout=timeout)
+
+    histogram = hedging.histogram(HOST, 'ExplanationOfBenefit')
+    samples = histogram.samples
+    started = time.monotonic()
+    response = hedging.call(HOST, 'ExplanationOfBenefit', send, (5, 5))
+
+    assert response.status_code == 200
+    assert time.monotonic() - started < 1.5
+    assert threads[0] == threading.get_ident() and threads[1] != threading.get_ident()
+    assert hedging.stats()['hedged'] == 1 and hedging.stats()['hedge_wins'] == 1
+    # The aborted primary still counts, at the time it was abandoned
+    assert histogram.samples == samples + 1
+
+
+def test_primaries_are_not_limited_by_the_hedge_pool():
+    hedging = hedger(max_workers=1, delay=5)
+    barrier = threading.Barrier(6, timeout=2)
+    results = []
+
+    def send(timeout):
+        # Only returns once all six reads are in flight at the same time
+        barrier.wait()
+        return 'ok'
+
+    def read():
+        results.append(hedging.call(HOST, 'ExplanationOfBenefit', send, (5, 5)))
+
+    threads = [threading.Thread(target=read) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['ok'] * 6
+    assert hedging.stats()['hedged'] == 0
+
+
+def test_failed_and_timed_out_primaries_are_recorded():
+    hedging = hedger(delay=5)
+    histogram = hedging.histogram(HOST, 'ExplanationOfBenefit')
+    samples = histogram.samples
+
+    def timed_out(timeout):
+        time.sleep(0.05)
+        raise TimeoutError('read timed out')
+
+    with pytest.raises(TimeoutError):
+        hedging.call(HOST, 'ExplanationOfBenefit', timed_out, (5, 5))
+
+    async def failing(timeout):
+        await asyncio.sleep(0.05)
+        raise ConnectionError('reset')
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(hedging.acall(HOST, 'ExplanationOfBenefit', failing, (5, 5)))
+    assert histogram.samples == samples + 2
+    assert histogram.percentile(100) >= 0.05
+
+
+def test_async_hedge_win_records_the_primary():
+    hedging = hedger()
+    histogram = hedging.histogram(HOST, 'ExplanationOfBenefit')
+    samples = histogram.samples
+    calls = []
+
+    async def send(timeout):
+        calls.append(timeout)
+        await asyncio.sleep(3 if len(calls) == 1 else 0)
+        return len(calls)
+
+    started = time.monotonic()
+    assert asyncio.run(hedging.acall(HOST, 'ExplanationOfBenefit', send, (5, 5))) == 2
+    assert time.monotonic() - started < 1
+    assert hedging.stats()['hedge_wins'] == 1
+    assert histogram.samples == samples + 1
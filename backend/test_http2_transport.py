@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Test the HTTP/2 transport adapter
+requests calls through httpx, with the negotiated protocol, TLS and proxy settings honoured
+"""
+
+import http.server
+import ssl
+import threading
+
+import certifi
+import httpx
+import pytest
+import requests
+
+from http2_transport import HTTP2Adapter, _ssl_context, h2_available
+from http_pool import PoolStats
+
+BASE = 'https://fhir.example.test/fhir'
+
+
+def mock_adapter(stats, handler):
+    # The mock transport speaks whatever protocol it reports; h2 is only needed for real connections
+    return HTTP2Adapter(stats, http2=h2_available(), transport=httpx.MockTransport(handler))
+
+
+def session_for(adapter):
+    session = requests.Session()
+    # Keep REQUESTS_CA_BUNDLE and proxy variables out of the settings under test
+    session.trust_env = False
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def test_http2_responses_come_back_as_requests_responses():
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        return httpx.Response(200, json={'resourceType': 'Patient', 'id': 'p1'},
+                              headers={'ETag': 'W/"3"'}, extensions={'http_version': b'HTTP/2'})
+
+    stats = PoolStats()
+    session = session_for(mock_adapter(stats, handler))
+    response = session.get(f"{BASE}/Patient/p1", headers={'Upgrade': 'h2c'}, timeout=(1, 2))
+
+    assert response.status_code == 200
+    assert response.json() == {'resourceType': 'Patient', 'id': 'p1'}
+    assert response.headers['etag'] == 'W/"3"'
+    # Connection-specific headers are not passed on; HTTP/2 forbids them
+    assert 'upgrade' not in seen[0].headers
+    assert stats.snapshot()['http2_streams'] == 1
+
+
+def test_each_tls_setting_gets_its_own_client():
+    adapter = mock_adapter(PoolStats(), lambda request: httpx.Response(204))
+    session = session_for(adapter)
+    session.get(f"{BASE}/metadata")
+    session.get(f"{BASE}/metadata", verify=False)
+    session.get(f"{BASE}/metadata", verify=certifi.where())
+
+    assert adapter.client() is adapter.client(True)
+    assert len({id(client) for client in adapter._clients.values()}) == 3
+
+
+def test_ssl_context_follows_requests_verify_and_cert():
+    assert _ssl_context(True, None).verify_mode == ssl.CERT_REQUIRED
+    assert _ssl_context(certifi.where(), None).verify_mode == ssl.CERT_REQUIRED
+    unverified = _ssl_context(False, None)
+    assert unverified.verify_mode == ssl.CERT_NONE and not unverified.check_hostname
+    with pytest.raises(FileNotFoundError):
+        _ssl_context(True, ('/nonexistent/client.pem', '/nonexistent/client.key'))
+
+
+class ProxyHandler(http.server.BaseHTTPRequestHandler):
+    """Answers every request with the request target it received"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = self.path.encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_requests_proxies_are_used():
+    proxy = http.server.ThreadingHTTPServer(('127.0.0.1', 0), ProxyHandler)
+    threading.Thread(target=proxy.serve_forever, daemon=True).start()
+    try:
+        adapter = HTTP2Adapter(PoolStats(), http1=True, http2=False)
+        url = 'http://fhir.example.test/fhir/Patient/p1'
+        response = session_for(adapter).get(
+            url, proxies={'http': f"http://127.0.0.1:{proxy.server_address[1]}"}, timeout=(1, 2))
+        # A forward proxy gets the absolute URL
+        assert response.text == url
+        adapter.close()
+    finally:
+        proxy.shutdown()
+        proxy.server_close()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Test the pooled HTTP transport
+Connection reuse, pool sizing and the DNS cache of the shared sessions
+"""
+
+import http.server
+import socket
+import socketserver
+import threading
+import time
+
+import pytest
+import requests
+
+from env_config import HTTP_POOL_CONFIG
+from http_pool import DNSCache, PoolStats, _build_session
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Keep-alive server that notes each client connection and waits `delay` per request"""
+    protocol_version = 'HTTP/1.1'
+    delay = 0.0
+    peers = set()
+
+    def do_GET(self):
+        Handler.peers.add(self.client_address)
+        time.sleep(Handler.delay)
+        body = b'{"resourceType": "Patient", "id": "p1"}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def origin():
+    Handler.delay = 0.0
+    Handler.peers = set()
+    socketserver.ThreadingTCPServer.daemon_threads = True
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://localhost:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def session_for(origin, monkeypatch, **config):
+    for name, value in config.items():
+        monkeypatch.setitem(HTTP_POOL_CONFIG, name, value)
+    stats = PoolStats()
+    return _build_session(origin, stats), stats
+
+
+def test_sequential_reads_share_one_connection(origin, monkeypatch):
+    session, stats = session_for(origin, monkeypatch)
+    for _ in range(5):
+        assert session.get(f"{origin}/fhir/Patient/p1", timeout=5).status_code == 200
+
+    counts = stats.snapshot()
+    assert counts['new_connections'] == 1 and counts['hits'] == 4
+    assert counts['dns_lookups'] == 1
+    assert len(Handler.peers) == 1
+
+
+def test_blocking_pool_never_exceeds_its_size(origin, monkeypatch):
+    session, stats = session_for(origin, monkeypatch, pool_maxsize=2, pool_block=True, pool_timeout=5)
+    Handler.delay = 0.1
+    threads = [threading.Thread(target=session.get, args=(f"{origin}/fhir/Patient/p1",), kwargs={'timeout': 5})
+               for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(Handler.peers) == 2
+    assert stats.snapshot()['new_connections'] == 2 and stats.snapshot()['waits'] > 0
+
+
+def test_pool_wait_is_bounded(origin, monkeypatch):
+    session, _ = session_for(origin, monkeypatch, pool_maxsize=1, pool_block=True, pool_timeout=0.1)
+    Handler.delay = 1.0
+    holder = threading.Thread(target=session.get, args=(f"{origin}/fhir/Patient/p1",), kwargs={'timeout': 5})
+    holder.start()
+    time.sleep(0.2)
+
+    started = time.monotonic()
+    with pytest.raises(requests.exceptions.ConnectTimeout):
+        session.get(f"{origin}/fhir/Patient/p1", timeout=5)
+    assert time.monotonic() - started < 0.5
+    holder.join()
+
+
+def test_dns_cache_reuses_then_expires(monkeypatch):
+    lookups = []
+
+    def getaddrinfo(host, port, *args):
+        lookups.append(host)
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('10.0.0.7', port)),
+                (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('10.0.0.7', port))]
+
+    monkeypatch.setattr(socket, 'getaddrinfo', getaddrinfo)
+    stats = PoolStats()
+    cache = DNSCache(0.1, stats)
+    assert cache.resolve('fhir.example.test', 443) == ['10.0.0.7']
+    assert cache.resolve('fhir.example.test', 443) == ['10.0.0.7']
+    assert len(lookups) == 1 and stats.snapshot()['dns_cache_hits'] == 1
+
+    time.sleep(0.15)
+    cache.resolve('fhir.example.test', 443)
+    cache.forget('fhir.example.test', 443)
+    cache.resolve('fhir.example.test', 443)
+    assert len(lookups) == 3
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Test the JSON codec
+Both backends write the same bytes, and the Flask provider honours json.dumps options
+"""
+
+import dataclasses
+import json
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from uuid import UUID
+
+import pytest
+from flask import Flask
+
+import json_codec
+from json_codec import CodecJSONProvider, StdlibCodec
+from records import record_type
+
+Charge = record_type('Charge', ('id', 'amount', 'detail'), numbers=('amount',), objects=('detail',))
+
+
+@dataclasses.dataclass
+class Period:
+    start: date
+    end: date
+
+
+SAMPLES = [
+    {'id': 'eob1', 'amount': 30.5, 'count': 2, 'ok': True, 'note': None},
+    {'name': 'Zoë Müller', 'emoji': '🦷', 'quote': 'say "ah"\n'},
+    {'total': Decimal('125.40'), 'paid': Decimal('0')},
+    {'at': datetime(2025, 8, 1, 9, 30, tzinfo=timezone.utc), 'on': date(2025, 8, 1)},
+    {'request': UUID('12345678-1234-5678-1234-567812345678')},
+    {'period': Period(date(2025, 1, 1), date(2025, 12, 31))},
+    {1: 'int keys', 2: ['are', 'stringified']},
+    {'nan': float('nan'), 'inf': float('inf'), 'nested': [{'neg': float('-inf')}], 'tuple': (1.5, float('nan'))},
+    {'decimal_nan': Decimal('NaN'), 'period': [Period(date(2025, 1, 1), date(2025, 1, 2))]},
+    float('nan'),
+    [Charge('eob1', 30.0, {'codes': ['D1110']}), Charge('eob2', float('nan'), None)],
+    {'expenses': [Charge('eob1', 12, None)], 'total': 1},
+]
+
+
+@pytest.mark.skipif(json_codec.orjson is None, reason='orjson is not installed')
+@pytest.mark.parametrize('value', SAMPLES)
+def test_backends_write_the_same_bytes(value):
+    assert StdlibCodec().dumps(value) == json_codec.OrjsonCodec().dumps(value)
+
+
+@pytest.mark.parametrize('value', SAMPLES)
+def test_stdlib_output_is_valid_json(value):
+    # parse_constant only fires for NaN/Infinity, which are not JSON
+    json.loads(StdlibCodec().dumps(value), parse_constant=pytest.fail)
+
+
+def test_non_finite_floats_are_null():
+    assert StdlibCodec().dumps({'a': float('nan'), 'b': [float('inf')]}) == b'{"a":null,"b":[null]}'
+    assert json_codec.dumps_with({'b': float('-inf'), 'a': 1}, sort_keys=True) == '{"a":1,"b":null}'
+
+
+def test_provider_honours_dumps_options():
+    app = Flask(__name__)
+    app.json = CodecJSONProvider(app)
+    value = {'b': 1, 'a': {'d': 2, 'c': 3}}
+
+    assert app.json.dumps(value) == '{"b":1,"a":{"d":2,"c":3}}'
+    assert app.json.dumps(value, sort_keys=True) == '{"a":{"c":3,"d":2},"b":1}'
+    assert app.json.dumps({'a': 1}, indent=2) == '{\n  "a": 1\n}'
+
+    app.json.sort_keys = True
+    with app.app_context():
+        assert app.json.response(value).get_data() == b'{"a":{"c":3,"d":2},"b":1}'
+    assert app.json.dumps(value) == '{"a":{"c":3,"d":2},"b":1}'
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Test parallel payload transforms
+Runs backfill payloads through the worker pool and compares with the in-process transform
+"""
+
+import json
+
+import pytest
+
+import deadline
+import parallel_transform
+from env_config import TRANSFORM_POOL_CONFIG
+from transformers import transform_eobs_to_expenses
+
+PATIENT = {'name': [{'given': ['Camila'], 'family': 'Lopez'}]}
+FIELDS = ['id', 'date', 'amount', 'category', 'patient_name']
+
+
+def eob(i):
+    return {
+        'resourceType': 'ExplanationOfBenefit', 'id': f'eob{i}', 'status': 'active',
+        'type': {'coding': [{'code': 'oral' if i % 2 else 'vision'}]},
+        'billablePeriod': {'start': f'2025-08-{i % 28 + 1:02d}'},
+        'item': [{'productOrService': {'text': 'Adult Dental Prophylaxis',
+                                       'coding': [{'system': 'http://www.ada.org/cdt', 'code': 'D1110'}]}}],
+        'total': [{'category': {'coding': [{'code': 'patient-pay'}]}, 'amount': {'value': 30.0 + i, 'currency': 'USD'}}]
+    }
+
+
+def bundle(resources):
+    return json.dumps({'resourceType': 'Bundle', 'type': 'searchset',
+                       'entry': [{'resource': resource} for resource in resources]}).encode()
+
+
+@pytest.fixture
+def pool_config(monkeypatch):
+    # Two workers and a task per payload, so even a small backfill goes through the pool
+    monkeypatch.setitem(TRANSFORM_POOL_CONFIG, 'workers', 2)
+    monkeypatch.setitem(TRANSFORM_POOL_CONFIG, 'chunk_bytes', 1)
+
+
+def test_pool_output_matches_in_process_transform(pool_config):
+    eobs = [eob(i) for i in range(60)]
+    pages = [bundle(eobs[start:start + 7]) for start in range(0, len(eobs), 7)]
+
+    expenses = list(parallel_transform.iter_transform_payloads(pages, 'ExplanationOfBenefit', FIELDS, PATIENT))
+
+    assert expenses == transform_eobs_to_expenses(eobs, PATIENT, FIELDS)
+    assert parallel_transform._pool is not None
+
+
+def test_pool_is_kept_across_calls(pool_config):
+    lines = [b'\n'.join(json.dumps(eob(i)).encode() for i in range(start, start + 5)) for start in range(0, 20, 5)]
+    first = list(parallel_transform.iter_transform_payloads(lines, 'ExplanationOfBenefit', ['id'], ndjson=True))
+    pool = parallel_transform.get_pool()
+    second = list(parallel_transform.iter_transform_payloads(lines, 'ExplanationOfBenefit', ['id'], ndjson=True))
+
+    assert first == second == [{'id': f'eob{i}'} for i in range(20)]
+    assert parallel_transform.get_pool() is pool
+
+
+def test_single_task_runs_in_process(monkeypatch):
+    monkeypatch.setattr(parallel_transform, 'get_pool', pytest.fail)
+    expenses = list(parallel_transform.iter_transform_payloads([bundle([eob(1)])], 'ExplanationOfBenefit', ['id']))
+    assert expenses == [{'id': 'eob1'}]
+
+
+def test_waits_are_bounded_by_the_deadline(pool_config):
+    # Each task takes a worker well over the budget
+    pages = [bundle([eob(i) for i in range(5000)])] * 4
+    with deadline.budget(0.01):
+        with pytest.raises(deadline.DeadlineExceeded):
+            list(parallel_transform.iter_transform_payloads(pages, 'ExplanationOfBenefit', ['id']))
+        assert deadline.exceeded()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Test _elements projection
+The elements requested for a field selection are enough to build those fields
+"""
+
+import pytest
+
+from fhir_client import EpicFHIRClient
+from transformers import DEFAULT_EXPENSE_FIELDS, expense_elements, transform_claims_to_expenses, \
+    transform_eobs_to_expenses
+
+PATIENT = {'name': [{'given': ['Camila'], 'family': 'Lopez'}]}
+PATIENT_PAY = {'category': {'coding': [{'code': 'patient-pay'}]}, 'amount': {'value': 42.5, 'currency': 'USD'}}
+EOB = {
+    'resourceType': 'ExplanationOfBenefit', 'id': 'eob1', 'status': 'active',
+    'meta': {'versionId': '3', 'lastUpdated': '2025-08-20T10:00:00Z'},
+    'type': {'coding': [{'code': 'oral'}]},
+    'billablePeriod': {'start': '2025-08-19'},
+    'provider': {'reference': 'Organization/org1', 'display': 'Smile Dental'},
+    'patient': {'reference': 'Patient/p1'},
+    'careTeam': [{'sequence': 1, 'provider': {'reference': 'Practitioner/pr1'}}],
+    'diagnosis': [{'sequence': 1, 'diagnosisCodeableConcept': {'text': 'Caries'}}],
+    'item': [{'productOrService': {'text': 'Adult Dental Prophylaxis',
+                                   'coding': [{'system': 'http://www.ada.org/cdt', 'code': 'D1110'}]},
+              'servicedDate': '2025-08-19', 'adjudication': [PATIENT_PAY]}],
+    'total': [PATIENT_PAY]
+}
+CLAIM = {
+    'resourceType': 'Claim', 'id': 'claim1', 'status': 'active',
+    'type': {'coding': [{'code': 'vision'}]},
+    'provider': {'reference': 'Organization/org2'},
+    'insurance': [{'sequence': 1, 'focal': True, 'coverage': {'reference': 'Coverage/cov1'}}],
+    'item': [{'productOrService': {'text': 'Eye exam'}, 'servicedDate': '2025-07-01',
+              'net': {'value': 80.0, 'currency': 'USD'}}],
+    'total': {'value': 80.0, 'currency': 'USD'}
+}
+
+
+def projected(resource, elements):
+    """What the server returns for _elements: the listed top-level elements plus the mandatory ones"""
+    return {name: value for name, value in resource.items() if name in elements or name in ('resourceType', 'id')}
+
+
+@pytest.mark.parametrize('fields', [DEFAULT_EXPENSE_FIELDS, ('id', 'amount'), ('date', 'category', 'currency'),
+                                    ('provider', 'service', 'status')])
+def test_projected_resources_give_the_same_expenses(fields):
+    elements = expense_elements(fields)
+    references = {'Organization/org2': {'resourceType': 'Organization', 'name': 'Clear View Optics'}}
+
+    assert (transform_eobs_to_expenses([projected(EOB, elements['ExplanationOfBenefit'])], PATIENT, fields, references)
+            == transform_eobs_to_expenses([EOB], PATIENT, fields, references))
+    assert (transform_claims_to_expenses([projected(CLAIM, elements['Claim'])], PATIENT, fields, references)
+            == transform_claims_to_expenses([CLAIM], PATIENT, fields, references))
+    # Elements no field reads are never asked for
+    assert not {'careTeam', 'diagnosis', 'insurance', 'patient'} & set(elements['ExplanationOfBenefit'] + elements['Claim'])
+
+
+def test_raw_resources_need_the_whole_resource():
+    assert expense_elements(('id', 'fhir_data')) is None
+
+
+def test_projected_search_keeps_meta(fake_fhir):
+    fake_fhir.route = lambda request: fake_fhir.searchset(
+        request, [projected(EOB, request.params['_elements'].split(','))])
+    client = EpicFHIRClient(fake_fhir.base_url, 'token', 'p1')
+
+    eobs = client.get_explanation_of_benefits('p1', elements=expense_elements(('id', 'amount'))['ExplanationOfBenefit'])
+
+    requested = fake_fhir.searches('ExplanationOfBenefit')[0].params['_elements'].split(',')
+    assert set(requested) == {'id', 'total', 'item', 'meta'}
+    # versionId and lastUpdated still drive incremental sync
+    assert eobs[0]['meta'] == EOB['meta'] and 'careTeam' not in eobs[0]
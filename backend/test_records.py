@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Test compact records
+JSON output of generated record classes
+"""
+
+import json
+import pickle
+
+import pytest
+
+from json_codec import dumps
+from records import record_type
+
+Charge = record_type('Charge', ('id', 'amount', 'detail'), numbers=('amount',), objects=('detail',))
+
+
+def test_record_json_matches_dict_json():
+    charge = Charge('eob1', 30.5, {'codes': ['D1110']})
+    assert json.loads(charge.__json__()) == charge.to_dict()
+    assert json.loads(dumps([charge, charge])) == [charge.to_dict()] * 2
+
+
+@pytest.mark.parametrize('amount, written', [
+    (30.0, 30.0),
+    (12, 12),
+    (None, None),
+    (float('nan'), None),
+    (float('inf'), None),
+    (float('-inf'), None),
+])
+def test_amounts_are_always_valid_json(amount, written):
+    text = Charge('eob1', amount, None).__json__()
+    # parse_constant only fires for NaN/Infinity, which are not JSON
+    assert json.loads(text, parse_constant=pytest.fail)['amount'] == written
+
+
+def test_records_pickle_by_value():
+    charge = Charge('eob1', 30.0, None)
+    assert pickle.loads(pickle.dumps(charge)) == charge
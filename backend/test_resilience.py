@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test the upstream circuit breaker
+Opens, probes and recovers a breaker through call_with_retries
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from resilience import CircuitBreaker, CircuitOpenError, acall_with_retries, call_with_retries, registry
+
+RESET_TIMEOUT = 0.05
+
+
+class Response:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        self.headers = {}
+
+    def close(self):
+        pass
+
+
+def open_breaker(host: str) -> CircuitBreaker:
+    """A fresh breaker for `host`, opened by two 500s"""
+    registry.config['hosts'][host] = {'failure_threshold': 2, 'reset_timeout': RESET_TIMEOUT, 'max_attempts': 1}
+    for _ in range(2):
+        assert call_with_retries(host, 'Patient', lambda timeout: Response(500)).status_code == 500
+    breaker = registry.breaker(host, 'Patient')
+    assert breaker.state == CircuitBreaker.OPEN
+    return breaker
+
+
+def test_open_breaker_fails_fast_then_recovers():
+    breaker = open_breaker('recover.test')
+    calls = []
+
+    def send(timeout):
+        calls.append(timeout)
+        return Response(200)
+
+    with pytest.raises(CircuitOpenError):
+        call_with_retries('recover.test', 'Patient', send)
+    assert calls == []
+
+    time.sleep(RESET_TIMEOUT)
+    assert call_with_retries('recover.test', 'Patient', send).status_code == 200
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert len(calls) == 1
+
+
+def test_failed_probe_reopens_breaker():
+    breaker = open_breaker('still-down.test')
+    time.sleep(RESET_TIMEOUT)
+    call_with_retries('still-down.test', 'Patient', lambda timeout: Response(503))
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.times_opened == 2
+
+
+def test_unexpected_error_releases_half_open_slot():
+    breaker = open_breaker('buggy.test')
+    time.sleep(RESET_TIMEOUT)
+
+    def broken(timeout):
+        raise ValueError('bug in send')
+
+    with pytest.raises(ValueError):
+        call_with_retries('buggy.test', 'Patient', broken)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.half_open_in_flight == 0
+
+    # The next probe is let through and closes the breaker
+    assert call_with_retries('buggy.test', 'Patient', lambda timeout: Response(200)).status_code == 200
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_cancelled_async_probe_releases_half_open_slot():
+    breaker = open_breaker('cancelled.test')
+    time.sleep(RESET_TIMEOUT)
+
+    async def hang(timeout):
+        await asyncio.sleep(10)
+
+    async def ok(timeout):
+        return Response(200)
+
+    async def main():
+        probe = asyncio.ensure_future(acall_with_retries('cancelled.test', 'Patient', hang))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert breaker.half_open_in_flight == 0
+        return await acall_with_retries('cancelled.test', 'Patient', ok)
+
+    assert asyncio.run(main()).status_code == 200
+    assert breaker.state == CircuitBreaker.CLOSED
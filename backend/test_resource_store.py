@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Test the on-disk resource store
+File permissions, sync marks that survive a worker restart, streamed pages and an unusable path
+"""
+
+import os
+import stat
+
+import fhir_client
+from bundle_stream import BundleStream
+from env_config import FHIR_RESOURCE_STORE_CONFIG
+from fhir_client import EpicFHIRClient
+from fhir_sync import IncrementalSyncStore
+from json_codec import dumps
+from resource_store import ResourceStore
+
+
+def store_at(path):
+    config = FHIR_RESOURCE_STORE_CONFIG
+    return ResourceStore(str(path), config['ttl_by_type'], config['default_ttl'],
+                         config['memory_max_entries'], config['memory_max_bytes'],
+                         config['disk_max_entries'], config['disk_max_bytes'])
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def eob(resource_id, version, last_updated):
+    return {'resourceType': 'ExplanationOfBenefit', 'id': resource_id,
+            'meta': {'versionId': str(version), 'lastUpdated': last_updated}}
+
+
+def test_store_is_private_to_its_user(tmp_path):
+    path = tmp_path / 'app-data' / 'fhir_resources.sqlite3'
+    store = store_at(path)
+    store.put('scope', {'resourceType': 'Patient', 'id': 'p1'}, 'p1')
+    assert store.get('scope', 'Patient', 'p1') == {'resourceType': 'Patient', 'id': 'p1'}
+    assert mode(path.parent) == 0o700
+    for suffix in ('', '-wal', '-shm'):
+        assert mode(f"{path}{suffix}") == 0o600
+
+
+def test_existing_store_file_is_narrowed(tmp_path):
+    path = tmp_path / 'fhir_resources.sqlite3'
+    path.touch(mode=0o644)
+    os.chmod(path, 0o644)
+    store_at(path).put('scope', {'resourceType': 'Patient', 'id': 'p1'})
+    assert mode(path) == 0o600
+
+
+def test_projected_sync_resumes_after_restart(tmp_path, monkeypatch):
+    monkeypatch.setattr(fhir_client, '_resource_store', store_at(tmp_path / 'fhir_resources.sqlite3'))
+    elements = ['id', 'total']
+    client = EpicFHIRClient('https://fhir.example.test/api/FHIR/R4', 'token', 'p1', 'patient/*.read')
+
+    monkeypatch.setattr(fhir_client, '_sync_store', IncrementalSyncStore(10))
+    spec, finish = client._search_plan('ExplanationOfBenefit', 'p1', elements)
+    assert '_lastUpdated' not in spec['params']
+    assert spec['params']['_elements'] == 'id,total,meta'
+    finish([eob('a', 1, '2025-01-01T00:00:00Z'), eob('b', 1, '2025-01-02T00:00:00Z')])
+
+    # A fresh worker picks up the projected set and only asks for the delta
+    monkeypatch.setattr(fhir_client, '_sync_store', IncrementalSyncStore(10))
+    spec, finish = client._search_plan('ExplanationOfBenefit', 'p1', elements)
+    assert spec['params']['_lastUpdated'] == 'ge2025-01-02T00:00:00Z'
+    merged = finish([eob('b', 2, '2025-01-03T00:00:00Z')])
+    assert sorted((resource['id'], resource['meta']['versionId']) for resource in merged) == [('a', '1'), ('b', '2')]
+
+    # Partial resources are never served as full ones, and the full search has no mark yet
+    assert client._stored_resource('https://fhir.example.test/api/FHIR/R4/ExplanationOfBenefit/a') is None
+    spec, _ = client._search_plan('ExplanationOfBenefit', 'p1')
+    assert '_lastUpdated' not in spec['params']
+
+
+def test_unopenable_store_falls_back_to_memory_once(tmp_path, capsys):
+    blocker = tmp_path / 'not-a-directory'
+    blocker.write_text('')
+    store = store_at(blocker / 'fhir_resources.sqlite3')
+    for _ in range(3):
+        store.put('scope', {'resourceType': 'Patient', 'id': 'p1'}, 'p1')
+        assert store.get('scope', 'Patient', 'p1') == {'resourceType': 'Patient', 'id': 'p1'}
+    assert store.get('scope', 'Patient', 'p2') is None
+
+    stats = store.stats()
+    assert stats['disk_disabled'] and stats['disk_errors'] == 1
+    assert capsys.readouterr().out.count('Resource store cannot open') == 1
+
+
+def test_streamed_pages_reach_the_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(fhir_client, '_resource_store', store_at(tmp_path / 'fhir_resources.sqlite3'))
+    monkeypatch.setitem(FHIR_RESOURCE_STORE_CONFIG, 'stream_batch', 2)
+    client = EpicFHIRClient('https://fhir.example.test/api/FHIR/R4', 'token', 'p1', 'patient/*.read')
+    eobs = [eob(f'e{i}', 1, '2025-01-01T00:00:00Z') for i in range(5)]
+    page = BundleStream([dumps({'resourceType': 'Bundle', 'entry': [{'resource': resource} for resource in eobs]})],
+                        params={'patient': 'p1'})
+
+    # The consumer stops after three: those are stored even though the page was not finished
+    resources = client.iter_bundle(page, 'ExplanationOfBenefit', stream=True)
+    assert [next(resources)['id'] for _ in range(3)] == ['e0', 'e1', 'e2']
+    resources.close()
+
+    stored = [client._stored_resource(f'https://fhir.example.test/api/FHIR/R4/ExplanationOfBenefit/e{i}')
+              for i in range(5)]
+    assert stored[:3] == eobs[:3]
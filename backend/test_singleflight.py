@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Test request coalescing
+Concurrent callers share one call, each within its own deadline
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+import deadline
+from singleflight import AsyncSingleFlight, SingleFlight
+
+PATIENT = {'resourceType': 'Patient', 'id': 'p1'}
+
+
+def upstream(calls, seconds):
+    """A fetch taking `seconds`, cut short by the caller's deadline like a real one"""
+    def fetch():
+        left = deadline.remaining()
+        calls.append(left)
+        if left is not None and left < seconds:
+            time.sleep(max(0.0, left))
+            raise deadline.DeadlineExceeded('request deadline exceeded')
+        time.sleep(seconds)
+        return PATIENT
+    return fetch
+
+
+def in_thread(target):
+    thread = threading.Thread(target=target)
+    thread.start()
+    time.sleep(0.02)
+    return thread
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    calls, results = [], []
+
+    def caller():
+        results.append(flight.do('Patient/p1', upstream(calls, 0.2), timeout=5))
+
+    threads = [threading.Thread(target=caller) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == [PATIENT] * 5
+    assert flight.stats() == {'upstream_calls': 1, 'coalesced': 4, 'coalescing_rate': 0.8}
+
+
+def test_follower_takes_over_when_leader_runs_out_of_time():
+    flight = SingleFlight()
+    calls = []
+
+    def leader():
+        with deadline.budget(0.05):
+            with pytest.raises(deadline.DeadlineExceeded):
+                flight.do('Patient/p1', upstream(calls, 0.2), timeout=deadline.remaining())
+
+    leading = in_thread(leader)
+    with deadline.budget(5):
+        result = flight.do('Patient/p1', upstream(calls, 0.2), timeout=deadline.remaining())
+    leading.join()
+
+    assert result == PATIENT
+    # The leader's call ran under the leader's budget; the follower then called under its own
+    assert len(calls) == 2 and calls[0] <= 0.05 and calls[1] > 4
+
+
+def test_hanging_upstream_holds_no_thread_past_its_callers_deadlines():
+    flight = SingleFlight()
+    calls = []
+    threads_before = threading.active_count()
+
+    def caller(seconds):
+        def run():
+            with deadline.budget(seconds):
+                with pytest.raises(TimeoutError):
+                    flight.do('Patient/p1', upstream(calls, 60), timeout=deadline.remaining())
+        return run
+
+    started = time.monotonic()
+    callers = [in_thread(caller(0.1)), in_thread(caller(0.2))]
+    for thread in callers:
+        thread.join()
+
+    # Every call ended with the deadline of the caller running it; nothing is left working upstream
+    assert time.monotonic() - started < 1
+    assert len(calls) == 2
+    assert threading.active_count() == threads_before
+
+
+def test_errors_reach_every_caller():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError('upstream said no')
+
+    with pytest.raises(ValueError):
+        flight.do('Patient/p1', fail, timeout=1)
+    with pytest.raises(ValueError):
+        flight.do('Patient/p1', fail)
+
+
+def test_async_follower_takes_over_when_leader_runs_out_of_time():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def fetch():
+        left = deadline.remaining()
+        calls.append(left)
+        if left < 0.2:
+            await asyncio.sleep(left)
+            raise deadline.DeadlineExceeded('request deadline exceeded')
+        await asyncio.sleep(0.2)
+        return PATIENT
+
+    async def caller(seconds):
+        with deadline.budget(seconds):
+            return await flight.do('Patient/p1', fetch, timeout=deadline.remaining())
+
+    async def main():
+        leader = asyncio.ensure_future(caller(0.05))
+        await asyncio.sleep(0.01)
+        follower = await caller(5)
+        with pytest.raises(TimeoutError):
+            await leader
+        return follower
+
+    assert asyncio.run(main()) == PATIENT
+    assert len(calls) == 2 and calls[0] <= 0.05 and calls[1] > 4
+    assert flight.stats()['coalesced'] == 1
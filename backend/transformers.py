@@ -1,171 +1,231 @@
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 from datetime import datetime
+from functools import lru_cache
 
-def transform_eobs_to_expenses(eobs: List[Dict], patient: Dict) -> List[Dict]:
-    """Transform FHIR EOB resources to expense tracker format"""
-    expenses = []
-    
-    for eob in eobs:
-        if eob.get('resourceType') != 'ExplanationOfBenefit':
-            continue
-            
-        # Extract expense data from EOB
-        expense = {
-            'id': eob.get('id', 'unknown'),
-            'date': extract_service_date(eob),
-            'provider': extract_provider_name(eob),
-            'service': extract_service_description(eob),
-            'amount': extract_patient_responsibility(eob),
-            'status': determine_expense_status(eob),
-            'category': categorize_expense(eob),
-            'fhir_data': eob,  # Keep original FHIR data
-            'patient_name': extract_patient_name(patient),
-            'currency': extract_currency(eob)
-        }
-        
-        expenses.append(expense)
-    
-    return expenses
+from categorization import categorizer
+from expense_table import ExpenseTable
+from field_mapping import SOURCE, Context, Extractor, Field, compile_mapping
+from fhirpath import compile_expression
+from records import Record, record_type
+
+def projection_elements(paths: Iterable[str]) -> List[str]:
+    """Top-level element names for a FHIR _elements projection of `paths`"""
+    return list(dict.fromkeys(path.split('.')[0] for path in paths))
+
+def _today() -> str:
+    return datetime.now().strftime('%Y-%m-%d')
+
+EOB_STATUSES = {
+    'active': 'Approved',
+    'cancelled': 'Cancelled',
+    'draft': 'Pending',
+    'entered-in-error': 'Error'
+}
+
+CLAIM_STATUSES = {
+    'active': 'Submitted',
+    'cancelled': 'Cancelled',
+    'draft': 'Draft',
+    'entered-in-error': 'Error'
+}
+
+def _resolved_provider(resource: Dict, out: Dict, context: Dict) -> Optional[str]:
+    """Provider name from the resolved provider/organization references"""
+    for field in ('provider', 'organization'):
+        if field in resource:
+            name = resolve_reference_name(resource[field], context.get('references'))
+            if name:
+                return name
+    return None
+
+_ITEM_CODINGS = compile_expression("item.first().productOrService.coding")
+_TYPE_CODE = compile_expression("type.coding.first().code")
+
+def _categorize(resource: Dict, out: Dict, context: Dict) -> str:
+    """Category from the service codes, claim type, then service description (see categorization)"""
+    return categorizer.categorize(_ITEM_CODINGS(resource, None), _TYPE_CODE(resource, None), out['service'])
+
+# Expense field mappings, one per source resource type, as FHIRPath (see
+# fhirpath). Each field selection is compiled once into an extractor that
+# fills those fields in a single visit of the resource (see field_mapping);
+# the paths it reads also drive the _elements projection.
+PATIENT_PAY = "where(category.coding.first().code = 'patient-pay')"
+
+EOB_EXPENSE_FIELDS = {
+    'id': Field("id", default='unknown'),
+    'date': Field("billablePeriod.start | item.first().servicedDate", default=_today),
+    'provider': Field("provider.display | organization.display",
+                      fallback=_resolved_provider, default='Unknown Provider',
+                      reads=('provider.reference', 'organization.reference')),
+    'service': Field("item.first().productOrService.text | item.first().productOrService.coding.first().display",
+                     default='Unknown Service'),
+    'amount': Field(f"total.{PATIENT_PAY}.amount.value",
+                    f"item.first().adjudication.{PATIENT_PAY}.amount.value",
+                    convert=float, default=0.0),
+    'status': Field("status", lookup=EOB_STATUSES, default='Pending'),
+    'category': Field(fallback=_categorize, needs=('service',),
+                      reads=('item.productOrService.coding', 'type.coding.code')),
+    'fhir_data': SOURCE,
+    'patient_name': Context('patient_name'),
+    'currency': Field("total.first().amount.currency | item.first().adjudication.first().amount.currency",
+                      default='USD')
+}
+
+# Claim.total is a single Money; item.net holds the per-line amount
+CLAIM_EXPENSE_FIELDS = {
+    **EOB_EXPENSE_FIELDS,
+    'amount': Field("total.value | item.first().net.value", convert=float, default=0.0),
+    'status': Field("status", lookup=CLAIM_STATUSES, default='Submitted'),
+    'currency': Field("total.currency | item.first().net.currency", default='USD')
+}
+
+EXPENSE_MAPPINGS = {
+    'ExplanationOfBenefit': EOB_EXPENSE_FIELDS,
+    'Claim': CLAIM_EXPENSE_FIELDS
+}
+
+# Every output field, and the ones a list view gets by default: the raw
+# resource (fhir_data) is opt-in, see server /api/expenses/<id>/fhir
+EXPENSE_FIELDS = tuple(EOB_EXPENSE_FIELDS)
+DEFAULT_EXPENSE_FIELDS = tuple(field for field in EXPENSE_FIELDS if field != 'fhir_data')
+
+def expense_fields(names: Iterable[str]) -> Tuple[str, ...]:
+    """Validated field selection in EXPENSE_FIELDS order; ValueError names unknown fields"""
+    names = set(names)
+    unknown = sorted(names.difference(EXPENSE_FIELDS))
+    if unknown:
+        raise ValueError(f"Unknown expense fields: {', '.join(unknown)}")
+    return tuple(field for field in EXPENSE_FIELDS if field in names)
+
+def expense_record(fields: Optional[Tuple[str, ...]] = None) -> type:
+    """Expense record class for a field selection (default: all of EXPENSE_FIELDS); see records"""
+    return record_type('Expense', fields if fields is not None else EXPENSE_FIELDS,
+                       numbers=('amount',), objects=('fhir_data',))
+
+Expense = expense_record()
 
-def transform_claims_to_expenses(claims: List[Dict], patient: Dict) -> List[Dict]:
+@lru_cache(maxsize=None)
+def expense_extractor(resource_type: str, fields: Optional[Tuple[str, ...]] = None,
+                      records: bool = False) -> Extractor:
+    """Compiled extractor building only `fields` (default: all) for a resource type (cached)
+
+    It returns expense dicts, or Expense records (expense_record(fields)) with records=True.
+    """
+    record = expense_record(fields) if records else None
+    return compile_mapping(EXPENSE_MAPPINGS[resource_type], fields=fields, record=record)
+
+EXPENSE_EXTRACTORS = {resource_type: expense_extractor(resource_type) for resource_type in EXPENSE_MAPPINGS}
+
+def expense_elements(fields: Optional[Sequence[str]] = None) -> Optional[Dict[str, List[str]]]:
+    """_elements per source resource type for EpicFHIRClient.get_patient_and_eob_data
+
+    Only the elements the selected fields read are requested. None when the
+    raw resource itself is selected, since that needs the full resource.
+    """
+    fields = tuple(fields) if fields is not None else EXPENSE_FIELDS
+    if 'fhir_data' in fields:
+        return None
+    return {
+        resource_type: projection_elements(expense_extractor(resource_type, fields).paths)
+        for resource_type in EXPENSE_MAPPINGS
+    }
+
+def _transform_resources(resources: Iterable[Dict], resource_type: str, patient: Dict,
+                         fields: Optional[Sequence[str]], references: Optional[Dict[str, Dict]],
+                         records: bool) -> List:
+    fields = expense_fields(fields) if fields is not None else EXPENSE_FIELDS
+    extract = expense_extractor(resource_type, fields, records).extract
+    context = {'patient_name': extract_patient_name(patient), 'references': references}
+    return [extract(resource, context) for resource in resources
+            if resource.get('resourceType') == resource_type]
+
+def transform_eobs_to_expenses(eobs: Iterable[Dict], patient: Dict,
+                               fields: Optional[Sequence[str]] = None,
+                               references: Optional[Dict[str, Dict]] = None,
+                               records: bool = False) -> List:
+    """Transform FHIR EOB resources to expense tracker format
+
+    `eobs` may be a lazy iterator (e.g. EpicFHIRClient.iter_explanation_of_benefits),
+    in which case each page is transformed as it arrives. `fields` selects
+    the output fields (default: all of EXPENSE_FIELDS, including the source
+    resource as fhir_data); unselected fields are never built, which also
+    lets the caller fetch a projected resource (see expense_elements).
+    `references` maps 'Type/id' to resolved provider resources
+    (eob_data['references']). With records=True the expenses are compact
+    Expense records (see records) instead of dicts; both are built by the
+    same compiled extractor.
+    """
+    return _transform_resources(eobs, 'ExplanationOfBenefit', patient, fields, references, records)
+
+def transform_claims_to_expenses(claims: Iterable[Dict], patient: Dict,
+                                 fields: Optional[Sequence[str]] = None,
+                                 references: Optional[Dict[str, Dict]] = None,
+                                 records: bool = False) -> List:
     """Transform FHIR Claim resources to expense tracker format (fallback)"""
-    expenses = []
-    
-    for claim in claims:
-        if claim.get('resourceType') != 'Claim':
-            continue
-            
-        # Extract expense data from Claim
-        expense = {
-            'id': claim.get('id', 'unknown'),
-            'date': extract_claim_service_date(claim),
-            'provider': extract_claim_provider_name(claim),
-            'service': extract_claim_service_description(claim),
-            'amount': extract_claim_amount(claim),
-            'status': determine_claim_status(claim),
-            'category': categorize_claim_expense(claim),
-            'fhir_data': claim,  # Keep original FHIR data
-            'patient_name': extract_patient_name(patient),
-            'currency': extract_claim_currency(claim)
-        }
-        
-        expenses.append(expense)
-    
-    return expenses
+    return _transform_resources(claims, 'Claim', patient, fields, references, records)
 
-def transform_any_eob_data_to_expenses(eob_data: Dict, patient: Dict) -> List[Dict]:
+def transform_any_eob_data_to_expenses(eob_data: Dict, patient: Dict,
+                                       fields: Optional[Sequence[str]] = None,
+                                       records: bool = False) -> List:
     """Transform any EOB data (EOB or Claim) to expenses"""
     source = eob_data.get('source', 'none')
     data = eob_data.get('data', [])
+    references = eob_data.get('references')
     
     if source == 'ExplanationOfBenefit':
-        return transform_eobs_to_expenses(data, patient)
+        return transform_eobs_to_expenses(data, patient, fields, references, records)
     elif source == 'Claim':
-        return transform_claims_to_expenses(data, patient)
+        return transform_claims_to_expenses(data, patient, fields, references, records)
     else:
         return []
 
-def extract_service_date(eob: Dict) -> str:
-    """Extract service date from EOB"""
-    # Try billablePeriod first
-    if 'billablePeriod' in eob and 'start' in eob['billablePeriod']:
-        return eob['billablePeriod']['start']
-    
-    # Try items servicedDate
-    if 'item' in eob and len(eob['item']) > 0:
-        item = eob['item'][0]
-        if 'servicedDate' in item:
-            return item['servicedDate']
-    
-    return datetime.now().strftime('%Y-%m-%d')
+# Columns of the batch (columnar) transform, see expense_table
+EXPENSE_TABLE_FIELDS = ('id', 'date', 'provider', 'amount', 'status', 'category', 'currency')
 
-def extract_provider_name(eob: Dict) -> str:
-    """Extract provider name from EOB"""
-    if 'provider' in eob and 'display' in eob['provider']:
-        return eob['provider']['display']
-    
-    if 'organization' in eob and 'display' in eob['organization']:
-        return eob['organization']['display']
-    
-    return 'Unknown Provider'
+def transform_any_eob_data_to_table(eob_data: Dict, chunk_size: int = 10000) -> ExpenseTable:
+    """Batch transform of EOB data (EOB or Claim) into a columnar ExpenseTable
 
-def extract_service_description(eob: Dict) -> str:
-    """Extract service description from EOB"""
-    if 'item' in eob and len(eob['item']) > 0:
-        item = eob['item'][0]
-        
-        # Try productOrService text first
-        if 'productOrService' in item and 'text' in item['productOrService']:
-            return item['productOrService']['text']
-        
-        # Try coding display
-        if 'productOrService' in item and 'coding' in item['productOrService']:
-            coding = item['productOrService']['coding'][0]
-            if 'display' in coding:
-                return coding['display']
-    
-    return 'Unknown Service'
-
-def extract_patient_responsibility(eob: Dict) -> float:
-    """Extract patient responsibility amount from EOB"""
-    # Check total section first
-    if 'total' in eob:
-        for total in eob['total']:
-            if 'category' in total and 'coding' in total['category']:
-                coding = total['category']['coding'][0]
-                if coding.get('code') == 'patient-pay' and 'amount' in total:
-                    return float(total['amount']['value'])
-    
-    # Check item adjudication
-    if 'item' in eob and len(eob['item']) > 0:
-        item = eob['item'][0]
-        if 'adjudication' in item:
-            for adj in item['adjudication']:
-                if 'category' in adj and 'coding' in adj['category']:
-                    coding = adj['category']['coding'][0]
-                    if coding.get('code') == 'patient-pay' and 'amount' in adj:
-                        return float(adj['amount']['value'])
-    
-    return 0.0
+    For reporting over large batches: only EXPENSE_TABLE_FIELDS are built,
+    and resources are converted `chunk_size` at a time so no more than one
+    chunk of expense dicts is alive at once. Requires numpy.
+    """
+    source = eob_data.get('source', 'none')
+    if source not in EXPENSE_MAPPINGS:
+        return ExpenseTable.from_expenses([])
+    
+    extract = expense_extractor(source, EXPENSE_TABLE_FIELDS).extract
+    context = {'patient_name': None, 'references': eob_data.get('references')}
+    tables = []
+    chunk = []
+    for resource in eob_data.get('data', []):
+        if resource.get('resourceType') != source:
+            continue
+        chunk.append(extract(resource, context))
+        if len(chunk) >= chunk_size:
+            tables.append(ExpenseTable.from_expenses(chunk))
+            chunk = []
+    if chunk or not tables:
+        tables.append(ExpenseTable.from_expenses(chunk))
+    return tables[0] if len(tables) == 1 else ExpenseTable.concat(tables)
 
-def determine_expense_status(eob: Dict) -> str:
-    """Determine expense status based on EOB data"""
-    status = eob.get('status', 'unknown')
-    
-    status_mapping = {
-        'active': 'Approved',
-        'cancelled': 'Cancelled',
-        'draft': 'Pending',
-        'entered-in-error': 'Error'
-    }
-    
-    return status_mapping.get(status, 'Pending')
-
-def categorize_expense(eob: Dict) -> str:
-    """Categorize expense based on EOB type and service"""
-    # Check EOB type
-    if 'type' in eob and 'coding' in eob['type']:
-        coding = eob['type']['coding'][0]
-        code = coding.get('code', '')
-        
-        if code == 'oral':
-            return 'Dental'
-        elif code == 'vision':
-            return 'Vision'
-        elif code == 'medical':
-            return 'Medical'
-    
-    # Check service description
-    service_desc = extract_service_description(eob).lower()
-    
-    if any(word in service_desc for word in ['dental', 'tooth', 'prophylaxis']):
-        return 'Dental'
-    elif any(word in service_desc for word in ['vision', 'eye', 'glasses']):
-        return 'Vision'
-    elif any(word in service_desc for word in ['medication', 'prescription']):
-        return 'Prescription'
-    else:
-        return 'Medical'
+def resolve_reference_name(reference: Dict, references: Optional[Dict[str, Dict]]) -> Optional[str]:
+    """Name of the Organization/Practitioner a Reference points at, if resolved"""
+    if not references or 'reference' not in reference:
+        return None
+    
+    resource = references.get('/'.join(reference['reference'].split('/')[-2:]))
+    if not resource:
+        return None
+    
+    name = resource.get('name')
+    if isinstance(name, str):
+        return name
+    if isinstance(name, list) and len(name) > 0:
+        if 'text' in name[0]:
+            return name[0]['text']
+        parts = name[0].get('given', []) + [name[0].get('family', '')]
+        return ' '.join(part for part in parts if part) or None
+    return None
 
 def extract_patient_name(patient: Dict) -> str:
     """Extract patient name from patient resource"""
@@ -178,35 +238,23 @@ def extract_patient_name(patient: Dict) -> str:
     
     return 'Unknown Patient'
 
-def extract_currency(eob: Dict) -> str:
-    """Extract currency from EOB"""
-    # Check total section
-    if 'total' in eob and len(eob['total']) > 0:
-        total = eob['total'][0]
-        if 'amount' in total and 'currency' in total['amount']:
-            return total['amount']['currency']
-    
-    # Check item adjudication
-    if 'item' in eob and len(eob['item']) > 0:
-        item = eob['item'][0]
-        if 'adjudication' in item and len(item['adjudication']) > 0:
-            adj = item['adjudication'][0]
-            if 'amount' in adj and 'currency' in adj['amount']:
-                return adj['amount']['currency']
-    
-    return 'USD'
+PatientSummary = record_type('PatientSummary', ('id', 'name', 'birth_date', 'gender', 'address', 'phone', 'email'))
+
+def patient_summary(patient: Dict) -> Record:
+    """Transform patient FHIR resource to a simplified PatientSummary record"""
+    return PatientSummary(
+        patient.get('id'),
+        extract_patient_name(patient),
+        patient.get('birthDate'),
+        patient.get('gender'),
+        extract_address(patient),
+        extract_phone(patient),
+        extract_email(patient)
+    )
 
 def transform_patient_data(patient: Dict) -> Dict:
     """Transform patient FHIR resource to simplified format"""
-    return {
-        'id': patient.get('id'),
-        'name': extract_patient_name(patient),
-        'birth_date': patient.get('birthDate'),
-        'gender': patient.get('gender'),
-        'address': extract_address(patient),
-        'phone': extract_phone(patient),
-        'email': extract_email(patient)
-    }
+    return patient_summary(patient).to_dict()
 
 def extract_address(patient: Dict) -> Optional[str]:
     """Extract patient address"""
@@ -243,115 +291,3 @@ def extract_email(patient: Dict) -> Optional[str]:
                 return telecom.get('value')
     return None
 
-# Claim-specific extraction functions
-def extract_claim_service_date(claim: Dict) -> str:
-    """Extract service date from Claim"""
-    # Try billablePeriod first
-    if 'billablePeriod' in claim and 'start' in claim['billablePeriod']:
-        return claim['billablePeriod']['start']
-    
-    # Try items servicedDate
-    if 'item' in claim and len(claim['item']) > 0:
-        item = claim['item'][0]
-        if 'servicedDate' in item:
-            return item['servicedDate']
-    
-    return datetime.now().strftime('%Y-%m-%d')
-
-def extract_claim_provider_name(claim: Dict) -> str:
-    """Extract provider name from Claim"""
-    if 'provider' in claim and 'display' in claim['provider']:
-        return claim['provider']['display']
-    
-    if 'organization' in claim and 'display' in claim['organization']:
-        return claim['organization']['display']
-    
-    return 'Unknown Provider'
-
-def extract_claim_service_description(claim: Dict) -> str:
-    """Extract service description from Claim"""
-    if 'item' in claim and len(claim['item']) > 0:
-        item = claim['item'][0]
-        
-        # Try productOrService text first
-        if 'productOrService' in item and 'text' in item['productOrService']:
-            return item['productOrService']['text']
-        
-        # Try coding display
-        if 'productOrService' in item and 'coding' in item['productOrService']:
-            coding = item['productOrService']['coding'][0]
-            if 'display' in coding:
-                return coding['display']
-    
-    return 'Unknown Service'
-
-def extract_claim_amount(claim: Dict) -> float:
-    """Extract amount from Claim"""
-    # Check total section first
-    if 'total' in claim:
-        for total in claim['total']:
-            if 'amount' in total:
-                return float(total['amount']['value'])
-    
-    # Check item amounts
-    if 'item' in claim and len(claim['item']) > 0:
-        item = claim['item'][0]
-        if 'net' in item and 'value' in item['net']:
-            return float(item['net']['value'])
-    
-    return 0.0
-
-def determine_claim_status(claim: Dict) -> str:
-    """Determine claim status"""
-    status = claim.get('status', 'unknown')
-    
-    status_mapping = {
-        'active': 'Submitted',
-        'cancelled': 'Cancelled',
-        'draft': 'Draft',
-        'entered-in-error': 'Error'
-    }
-    
-    return status_mapping.get(status, 'Submitted')
-
-def categorize_claim_expense(claim: Dict) -> str:
-    """Categorize claim expense"""
-    # Check claim type
-    if 'type' in claim and 'coding' in claim['type']:
-        coding = claim['type']['coding'][0]
-        code = coding.get('code', '')
-        
-        if code == 'oral':
-            return 'Dental'
-        elif code == 'vision':
-            return 'Vision'
-        elif code == 'medical':
-            return 'Medical'
-    
-    # Check service description
-    service_desc = extract_claim_service_description(claim).lower()
-    
-    if any(word in service_desc for word in ['dental', 'tooth', 'prophylaxis']):
-        return 'Dental'
-    elif any(word in service_desc for word in ['vision', 'eye', 'glasses']):
-        return 'Vision'
-    elif any(word in service_desc for word in ['medication', 'prescription']):
-        return 'Prescription'
-    else:
-        return 'Medical'
-
-def extract_claim_currency(claim: Dict) -> str:
-    """Extract currency from Claim"""
-    # Check total section
-    if 'total' in claim and len(claim['total']) > 0:
-        total = claim['total'][0]
-        if 'amount' in total and 'currency' in total['amount']:
-            return total['amount']['currency']
-    
-    # Check item amounts
-    if 'item' in claim and len(claim['item']) > 0:
-        item = claim['item'][0]
-        if 'net' in item and 'currency' in item['net']:
-            return item['net']['currency']
-    
-    return 'USD'